@@ -0,0 +1,227 @@
+import asyncio
+import contextvars
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+import config
+import utils
+from metrics import current_command, DB_SECONDS, DB_CALLS
+
+# DB 呼び出し専用のスレッドプール（プールの接続数と同じだけ並列に実行できる）
+_executor = ThreadPoolExecutor(max_workers=config.DB_POOL_MAX, thread_name_prefix="db")
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    ブロッキングな DB 関数をスレッドプールで実行し、イベントループを止めずに結果を待つ。
+    呼び出し元の contextvars はワーカースレッドへ引き継ぐ。
+    所要時間と呼び出し元のコマンドごとの回数をメトリクスに記録する。
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, func, *args, **kwargs)
+    name = getattr(func, "__name__", "unknown")
+    DB_CALLS.inc(current_command.get(), name)
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_executor, call)
+    finally:
+        DB_SECONDS.observe(time.perf_counter() - started, name)
+
+
+async def get_player(guild_id: int, player_id: int) -> dict:
+    """
+    utils.get_player の非同期版
+    """
+    return await run_db(utils.get_player, guild_id, player_id)
+
+
+async def get_players(guild_id: int, player_ids: list) -> dict:
+    """
+    utils.get_players の非同期版
+    """
+    return await run_db(utils.get_players, guild_id, player_ids)
+
+
+async def upsert_player(guild_id: int, player_id: int, mu: float, sigma: float, games: int, wins: int,
+                        last_match: str):
+    """
+    utils.upsert_player の非同期版
+    """
+    return await run_db(utils.upsert_player, guild_id, player_id, mu, sigma, games, wins, last_match)
+
+
+async def insert_match_history(
+    guild_id: int,
+    player_id: int,
+    match_id: int,
+    timestamp: str,
+    rank: int,
+    wins: int,
+    mu_before: float,
+    sigma_before: float,
+    mu_after: float,
+    sigma_after: float
+):
+    """
+    utils.insert_match_history の非同期版
+    """
+    return await run_db(
+        utils.insert_match_history,
+        guild_id, player_id, match_id, timestamp, rank, wins, mu_before, sigma_before, mu_after, sigma_after
+    )
+
+
+async def save_match_results(guild_id: int, match_id: int, players: list, history: list, outcome_mask: int = None,
+                             pairs: list = ()):
+    """
+    utils.save_match_results の非同期版
+    """
+    return await run_db(utils.save_match_results, guild_id, match_id, players, history, outcome_mask, pairs)
+
+
+async def start_match(guild_id: int, channel_id: int, host_id: int, entry_order: list, patterns: list) -> int:
+    """
+    utils.start_match の非同期版
+    """
+    return await run_db(utils.start_match, guild_id, channel_id, host_id, entry_order, patterns)
+
+
+async def record_game(match_id: int, game_no: int, team1_won: bool):
+    """
+    utils.record_game の非同期版
+    """
+    return await run_db(utils.record_game, match_id, game_no, team1_won)
+
+
+async def get_match_games(match_id: int) -> list:
+    """
+    utils.get_match_games の非同期版
+    """
+    return await run_db(utils.get_match_games, match_id)
+
+
+async def get_running_matches(channel_id: int = None) -> list:
+    """
+    utils.get_running_matches の非同期版
+    """
+    return await run_db(utils.get_running_matches, channel_id)
+
+
+async def abort_match(match_id: int):
+    """
+    utils.abort_match の非同期版
+    """
+    return await run_db(utils.abort_match, match_id)
+
+
+async def get_all_players(guild_id: int) -> list:
+    """
+    utils.get_all_players の非同期版
+    """
+    return await run_db(utils.get_all_players, guild_id)
+
+
+async def get_player_history(guild_id: int, player_id: int) -> list:
+    """
+    utils.get_player_history の非同期版
+    """
+    return await run_db(utils.get_player_history, guild_id, player_id)
+
+
+async def get_player_summary(guild_id: int, player_id: int) -> dict:
+    """
+    utils.get_player_summary の非同期版
+    """
+    return await run_db(utils.get_player_summary, guild_id, player_id)
+
+
+async def get_rating_series(guild_id: int, player_id: int, max_points: int = config.HISTORY_CHART_POINTS) -> list:
+    """
+    utils.get_rating_series の非同期版
+    """
+    return await run_db(utils.get_rating_series, guild_id, player_id, max_points)
+
+
+async def get_ranking_page(guild_id: int, page: int, per_page: int) -> tuple:
+    """
+    utils.get_ranking_page の非同期版
+    """
+    return await run_db(utils.get_ranking_page, guild_id, page, per_page)
+
+
+async def get_player_rank(guild_id: int, player_id: int) -> tuple:
+    """
+    utils.get_player_rank の非同期版
+    """
+    return await run_db(utils.get_player_rank, guild_id, player_id)
+
+
+async def get_pair_stats(guild_id: int, player_id: int, other_id: int) -> dict:
+    """
+    utils.get_pair_stats の非同期版
+    """
+    return await run_db(utils.get_pair_stats, guild_id, player_id, other_id)
+
+
+async def get_partner_stats(guild_id: int, player_id: int) -> list:
+    """
+    utils.get_partner_stats の非同期版
+    """
+    return await run_db(utils.get_partner_stats, guild_id, player_id)
+
+
+async def maybe_take_snapshot(guild_id: int) -> dict:
+    """
+    utils.maybe_take_snapshot の非同期版
+    """
+    return await run_db(utils.maybe_take_snapshot, guild_id)
+
+
+async def get_ranking_as_of(guild_id: int, at, page: int, per_page: int) -> tuple:
+    """
+    utils.get_ranking_as_of の非同期版
+    """
+    return await run_db(utils.get_ranking_as_of, guild_id, at, page, per_page)
+
+
+async def start_season(guild_id: int, name: str) -> dict:
+    """
+    utils.start_season の非同期版
+    """
+    return await run_db(utils.start_season, guild_id, name)
+
+
+async def get_seasons(guild_id: int) -> list:
+    """
+    utils.get_seasons の非同期版
+    """
+    return await run_db(utils.get_seasons, guild_id)
+
+
+async def get_season_ranking(guild_id: int, name: str, page: int, per_page: int) -> tuple:
+    """
+    utils.get_season_ranking の非同期版
+    """
+    return await run_db(utils.get_season_ranking, guild_id, name, page, per_page)
+
+
+async def get_state(key: str) -> str:
+    """
+    utils.get_state の非同期版
+    """
+    return await run_db(utils.get_state, key)
+
+
+async def set_state(key: str, value: str):
+    """
+    utils.set_state の非同期版
+    """
+    await run_db(utils.set_state, key, value)
+
+
+def shutdown():
+    """
+    実行中の DB 呼び出しの完了を待ってスレッドプールを停止する
+    """
+    _executor.shutdown(wait=True)
@@ -0,0 +1,308 @@
+"""
+Discord に接続せずに主要コマンドを実行し、レイテンシと DB / Discord API の呼び出し回数を計測する。
+
+    DB_NAME=bench python -m benchmarks.bench --seed            # 合成データを投入してから計測
+    STORAGE_BACKEND=memory python -m benchmarks.bench --seed   # DB サーバーなしで計測
+    DB_NAME=bench python -m benchmarks.bench --json out.json   # 結果を保存
+    DB_NAME=bench python -m benchmarks.bench --compare out.json
+        # 保存した結果より p95 が --tolerance 以上悪化したコマンドがあれば終了コード 1
+
+--seed は players / match_history / matches を作り直すので、PostgreSQL では DB_NAME が未指定だと実行しない。
+SQLite / インメモリのバックエンドでは、DB への往復回数の代わりに実行した SQL 文の数を数える。
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import threading
+import psycopg2.extensions
+import config
+import utils
+import async_utils
+import charts
+from sessions import sessions, ENTRY_LIMIT
+from names import resolver
+from match import MatchCog
+from stats import StatsCog, RANKING_PAGE_SIZE
+from lobby import LobbyCog
+from storage import get_storage, close_storage
+from storage.sqlite import SQLiteStorage
+from benchmarks.fakes import FakeGuild, FakeChannel, FakeContext, FakeUser
+from benchmarks.seed import seed, PLAYER_ID_BASE
+
+# これより小さい p95 の差は計測の揺れとみなす
+MIN_REGRESSION_MS = 1.0
+
+
+class RoundTrips:
+    """
+    DB への往復回数（execute / executemany / COPY / commit / rollback）をスレッドをまたいで数える
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def hit(self):
+        with self._lock:
+            self.count += 1
+
+
+round_trips = RoundTrips()
+_counting_cursors = {}
+
+
+def _counting_cursor(base):
+    """
+    base のカーソルクラスに、往復回数を数える処理を足したサブクラスを返す
+    """
+    cls = _counting_cursors.get(base)
+    if cls is None:
+        def execute(self, *args, **kwargs):
+            round_trips.hit()
+            return base.execute(self, *args, **kwargs)
+
+        def executemany(self, *args, **kwargs):
+            round_trips.hit()
+            return base.executemany(self, *args, **kwargs)
+
+        def copy_expert(self, *args, **kwargs):
+            round_trips.hit()
+            return base.copy_expert(self, *args, **kwargs)
+
+        cls = _counting_cursors[base] = type(
+            f"Counting{base.__name__}", (base,),
+            {"execute": execute, "executemany": executemany, "copy_expert": copy_expert}
+        )
+    return cls
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    """
+    作るカーソルをすべて往復回数を数えるものにする接続クラス
+    """
+
+    def cursor(self, *args, **kwargs):
+        base = kwargs.pop("cursor_factory", None) or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = _counting_cursor(base)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        round_trips.hit()
+        return super().commit()
+
+    def rollback(self):
+        round_trips.hit()
+        return super().rollback()
+
+
+class Sample:
+    """
+    1コマンド分の計測結果
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = []
+        self.db = []
+        self.rest = []
+
+    def add(self, elapsed: float, db: int, rest: int):
+        self.latencies.append(elapsed * 1000)
+        self.db.append(db)
+        self.rest.append(rest)
+
+    def percentile(self, p: float) -> float:
+        ordered = sorted(self.latencies)
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+    def summary(self) -> dict:
+        return {
+            "n": len(self.latencies),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": max(self.latencies),
+            "db_per_call": sum(self.db) / len(self.db),
+            "rest_per_call": sum(self.rest) / len(self.rest),
+        }
+
+
+class Bench:
+    def __init__(self, player_ids: list, total_players: int, iterations: int, warmup: int, cold: bool):
+        self.player_ids = player_ids
+        self.total_players = total_players
+        self.iterations = iterations
+        self.warmup = warmup
+        self.cold = cold
+        self.rng = random.Random(0)
+        self.guild = FakeGuild(1)
+        self.channels = iter(range(10 ** 6, 2 * 10 ** 6))
+        self.match_cog = MatchCog(None)
+        self.stats_cog = StatsCog(None)
+        self.lobby_cog = LobbyCog(None)
+        self.samples = {}
+
+    def _context(self, author_id: int = None) -> FakeContext:
+        channel = FakeChannel(next(self.channels), self.guild, random.Random(self.rng.random()))
+        return FakeContext(channel, FakeUser(author_id or self.rng.choice(self.player_ids)))
+
+    def _reset_caches(self):
+        utils.player_cache.clear()
+        utils.ranking_indexes.clear()
+        charts.chart_cache.clear()
+        resolver._names.clear()
+
+    async def measure(self, name: str, make_call):
+        """
+        make_call() が返すコルーチンを実行して計測する。最初の warmup 回は記録しない
+        """
+        sample = self.samples.setdefault(name, Sample(name))
+        for i in range(self.warmup + self.iterations):
+            if self.cold:
+                self._reset_caches()
+            ctx, coro = make_call()
+            db_before, rest_before = round_trips.count, ctx.channel.rest.calls
+            started = time.perf_counter()
+            await coro
+            elapsed = time.perf_counter() - started
+            if i >= self.warmup:
+                sample.add(elapsed, round_trips.count - db_before, ctx.channel.rest.calls - rest_before)
+
+    async def run(self):
+        def join():
+            ctx = self._context()
+            session = sessions.for_context(ctx)
+            # 満員の一歩手前まで埋めておき、最後の1人の参加を計測する
+            for uid in self.rng.sample(self.player_ids, ENTRY_LIMIT - 1):
+                session.join(str(uid))
+            return ctx, LobbyCog.join.callback(self.lobby_cog, ctx)
+
+        def match():
+            ctx = self._context()
+            sessions.for_context(ctx).entry_order = [str(uid) for uid in self.rng.sample(self.player_ids, ENTRY_LIMIT)]
+            return ctx, MatchCog.match.callback(self.match_cog, ctx, balance=False)
+
+        def undo():
+            ctx = self._context()
+            return ctx, MatchCog.undo.callback(self.match_cog, ctx, count=1, match_id=None)
+
+        def ranking():
+            ctx = self._context()
+            last_page = max(1, math.ceil(self.total_players / RANKING_PAGE_SIZE))
+            return ctx, StatsCog.ranking.callback(self.stats_cog, ctx, self.rng.randint(1, last_page))
+
+        def history():
+            ctx = self._context()
+            return ctx, StatsCog.history.callback(self.stats_cog, ctx, FakeUser(self.rng.choice(self.player_ids)))
+
+        await self.measure("join", join)
+        await self.measure("match", match)
+        # 計測した試合の分だけ取り消す（seed のデータは残す）
+        await self.measure("undo", undo)
+        await self.measure("ranking", ranking)
+        await self.measure("history", history)
+        return {name: sample.summary() for name, sample in self.samples.items()}
+
+
+def _format(results: dict) -> str:
+    lines = [f"{'command':<10} {'n':>4} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9} {'db/call':>8} {'rest/call':>9}"]
+    for name, r in results.items():
+        lines.append(
+            f"{name:<10} {r['n']:>4} {r['p50']:>7.1f}ms {r['p95']:>7.1f}ms {r['p99']:>7.1f}ms "
+            f"{r['max']:>7.1f}ms {r['db_per_call']:>8.1f} {r['rest_per_call']:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def _compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    baseline より p95 が tolerance（割合）かつ MIN_REGRESSION_MS 以上悪化したか、
+    DB 往復が増えたコマンドを返す
+    """
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if r["p95"] > base["p95"] * (1 + tolerance) and r["p95"] - base["p95"] > MIN_REGRESSION_MS:
+            regressions.append(f"{name}: p95 {base['p95']:.1f}ms -> {r['p95']:.1f}ms")
+        if r["db_per_call"] > base["db_per_call"]:
+            regressions.append(f"{name}: db/call {base['db_per_call']:.1f} -> {r['db_per_call']:.1f}")
+    return regressions
+
+
+def _count_round_trips():
+    """
+    使用中のバックエンドの DB 呼び出しを round_trips で数えるようにする
+    """
+    storage = get_storage()
+    if isinstance(storage, SQLiteStorage):
+        # 同じプロセス内なので往復はなく、実行した文の数を数える
+        storage._conn.set_trace_callback(lambda statement: round_trips.hit())
+    else:
+        config.DB_CONFIG["connection_factory"] = CountingConnection
+
+
+async def _main(args) -> int:
+    _count_round_trips()
+    try:
+        await async_utils.run_db(utils.migrate)
+        if args.seed:
+            print(f"seeding {args.players} players / {args.history} history rows ...")
+            started = time.perf_counter()
+            await async_utils.run_db(seed, args.players, args.history)
+            print(f"seeded in {time.perf_counter() - started:.1f}s")
+
+        # seed は guild_id 1 のサーバーにデータを作る（Bench の FakeGuild と同じ）
+        players = await async_utils.run_db(utils.get_all_players, 1)
+        total = len(players)
+        player_ids = sorted(p['id'] for p in players if p['id'] >= PLAYER_ID_BASE)[:1000]
+        if len(player_ids) < ENTRY_LIMIT:
+            print("合成データがありません。--seed を付けて実行してください", file=sys.stderr)
+            return 2
+
+        bench = Bench(player_ids, total, args.iterations, args.warmup, args.cold)
+        results = await bench.run()
+        print(_format(results))
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+        if args.compare:
+            with open(args.compare) as f:
+                regressions = _compare(results, json.load(f), args.tolerance)
+            for line in regressions:
+                print("REGRESSION", line)
+            if regressions:
+                return 1
+        return 0
+    finally:
+        charts.shutdown()
+        async_utils.shutdown()
+        close_storage()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="主要コマンドのオフラインベンチマーク")
+    parser.add_argument("--seed", action="store_true", help="合成データを投入し直す（PostgreSQL では DB_NAME 必須）")
+    parser.add_argument("--players", type=int, default=10000)
+    parser.add_argument("--history", type=int, default=1_000_000)
+    parser.add_argument("--iterations", type=int, default=50, help="コマンドごとの計測回数")
+    parser.add_argument("--warmup", type=int, default=1, help="計測しない最初の実行回数")
+    parser.add_argument("--cold", action="store_true", help="毎回キャッシュを空にしてから実行する")
+    parser.add_argument("--json", help="結果を書き出す JSON ファイル")
+    parser.add_argument("--compare", help="比較する以前の結果の JSON ファイル")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="許容する p95 の悪化の割合")
+    args = parser.parse_args()
+    if args.seed and os.getenv("STORAGE_BACKEND", "postgres") == "postgres" and not os.getenv("DB_NAME"):
+        parser.error("--seed は既存のデータを消すので、DB_NAME でベンチマーク用の DB を指定してください")
+    sys.exit(asyncio.run(_main(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+ベンチマーク用の Discord の代役。コマンドのコールバックに渡す ctx と、
+その先の guild / channel / message / interaction を最小限の形で再現する。
+送信・編集の回数を数え、MatchView のボタンは表示されたら自動で押す。
+"""
+import random
+import asyncio
+import itertools
+
+_message_ids = itertools.count(1)
+
+
+class RestCounter:
+    """
+    Discord API を呼んだはずの回数（送信・編集・削除・インタラクション応答）
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def hit(self):
+        self.calls += 1
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.display_name = f"player{user_id}"
+        self.mention = f"<@{user_id}>"
+
+
+class FakeGuild:
+    """
+    メンバーキャッシュに全員がいるサーバー
+    """
+
+    def __init__(self, guild_id: int = 1):
+        self.id = guild_id
+
+    def get_member(self, user_id: int):
+        return FakeUser(user_id)
+
+    async def query_members(self, user_ids=None, limit=None, cache=True):
+        return [FakeUser(uid) for uid in user_ids or []]
+
+
+class FakeResponse:
+    def __init__(self, message):
+        self._message = message
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def edit_message(self, **kwargs):
+        self._done = True
+        await self._message._apply(kwargs)
+
+    async def defer(self, **kwargs):
+        self._done = True
+        self._message.channel.rest.hit()
+
+
+class FakeInteraction:
+    def __init__(self, message, user):
+        self.message = message
+        self.user = user
+        self.response = FakeResponse(message)
+
+
+class FakeMessage:
+    def __init__(self, channel, kwargs):
+        self.id = next(_message_ids)
+        self.channel = channel
+        self.embed = None
+        self.view = None
+        self._update(kwargs)
+
+    def _update(self, kwargs):
+        if "embed" in kwargs:
+            self.embed = kwargs["embed"]
+        if "view" in kwargs:
+            self.view = kwargs["view"]
+
+    async def _apply(self, kwargs):
+        self.channel.rest.hit()
+        self._update(kwargs)
+        self.channel.click(self)
+
+    async def edit(self, **kwargs):
+        await self._apply(kwargs)
+        return self
+
+    async def delete(self):
+        self.channel.rest.hit()
+
+
+class FakeChannel:
+    """
+    送信されたメッセージに MatchView が付いていれば、次のループでボタンを押す。
+    押すボタン（Aチーム / Bチーム）は乱数で決める。
+    """
+
+    def __init__(self, channel_id: int, guild, rng: random.Random = None):
+        self.id = channel_id
+        self.guild = guild
+        self.rest = RestCounter()
+        self.rng = rng or random.Random(channel_id)
+        self.messages = []
+        self._clicks = set()
+
+    def click(self, message):
+        view = message.view
+        if view is None or not hasattr(view, "a_win"):
+            return
+        button = view.a_win if self.rng.random() < 0.5 else view.b_win
+        task = asyncio.create_task(button.callback(FakeInteraction(message, FakeUser(0))))
+        self._clicks.add(task)
+        task.add_done_callback(self._clicks.discard)
+
+    async def send(self, content=None, **kwargs):
+        self.rest.hit()
+        message = FakeMessage(self, kwargs)
+        message.content = content
+        self.messages.append(message)
+        self.click(message)
+        return message
+
+
+class FakeContext:
+    """
+    hybrid_command のコールバックに渡す ctx の代役
+    """
+
+    def __init__(self, channel, author):
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.interaction = None
+
+    async def defer(self, **kwargs):
+        self.channel.rest.hit()
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
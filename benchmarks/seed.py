@@ -0,0 +1,157 @@
+"""
+ベンチマーク用の合成データを投入する。既存の players / match_history / matches は消えるので、
+必ずベンチマーク専用の DB（DB_NAME で指定）か、SQLite / インメモリのバックエンドに対して使うこと。
+"""
+from storage import get_storage
+from storage.sqlite import SQLiteStorage
+
+# Discord のユーザーIDに近い桁数にするための基準値
+PLAYER_ID_BASE = 10 ** 17
+# 1試合の8人を重複なく選ぶための、プレイヤー数と互いに素な係数
+_PLAYER_STRIDE = 7919
+
+
+def seed(players: int = 10000, history: int = 1_000_000, guild_id: int = 1, channel_id: int = 1):
+    """
+    players 人と、約 history 行（8人 × history / 8 試合）の試合履歴を作る。
+    生成はすべて DB 側で行う（PostgreSQL は generate_series、SQLite は再帰 CTE）。
+    """
+    if players < 8 or players % _PLAYER_STRIDE == 0:
+        raise ValueError("players は8以上で、7919 の倍数以外を指定してください")
+    matches = history // 8
+    params = {
+        "base": PLAYER_ID_BASE, "players": players, "matches": matches,
+        "stride": _PLAYER_STRIDE, "guild_id": guild_id, "channel_id": channel_id,
+    }
+    storage = get_storage()
+    if isinstance(storage, SQLiteStorage):
+        _seed_sqlite(storage, params)
+    else:
+        _seed_postgres(params)
+
+
+def _seed_postgres(params: dict):
+    from storage.postgres import get_connection
+
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            "TRUNCATE rating_snapshots, rating_snapshot_players, seasons, pair_stats, match_games, matches, "
+            "match_history, players RESTART IDENTITY"
+        )
+        cur.execute(
+            """
+            INSERT INTO players (guild_id, id, mu, sigma, games, wins, last_match)
+            SELECT %(guild_id)s, %(base)s + g, 1500 + 200 * (random() - 0.5), 10 + 40 * random(), 0, 0, NULL
+            FROM generate_series(0, %(players)s - 1) g;
+
+            INSERT INTO match_history
+                (guild_id, player_id, match_id, timestamp, rank, wins, mu_before, sigma_before, mu_after, sigma_after)
+            SELECT
+                %(guild_id)s,
+                %(base)s + ((m::bigint * 8 + k) * %(stride)s) %% %(players)s,
+                m,
+                TIMESTAMP '2024-01-01' + m * INTERVAL '1 minute',
+                k,
+                7 - k,
+                1500 + r,
+                30,
+                1500 + r + (3.5 - k) * 2,
+                29.5
+            FROM generate_series(1, %(matches)s) m,
+                 generate_series(0, 7) k,
+                 LATERAL (SELECT 200 * (random() - 0.5) AS r) noise;
+
+            INSERT INTO matches (match_id, guild_id, channel_id, status, started_at, ended_at)
+            SELECT m, %(guild_id)s, %(channel_id)s, 'finished',
+                   TIMESTAMP '2024-01-01' + m * INTERVAL '1 minute',
+                   TIMESTAMP '2024-01-01' + m * INTERVAL '1 minute'
+            FROM generate_series(1, %(matches)s) m;
+            SELECT setval(pg_get_serial_sequence('matches', 'match_id'), %(matches)s + 1, false);
+
+            UPDATE players p SET games = c.games, wins = c.wins, last_match = c.last_match
+            FROM (
+                SELECT player_id, COUNT(*) AS games, SUM(wins) AS wins, MAX(timestamp) AS last_match
+                FROM match_history
+                GROUP BY player_id
+            ) c
+            WHERE p.guild_id = %(guild_id)s AND p.id = c.player_id;
+            """,
+            params
+        )
+    # 統計情報を更新して、本番規模の実行計画にする（トランザクション外で実行）
+    with get_connection() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("VACUUM ANALYZE players")
+                cur.execute("VACUUM ANALYZE match_history")
+                cur.execute("VACUUM ANALYZE matches")
+        finally:
+            conn.autocommit = False
+
+
+def _seed_sqlite(storage: SQLiteStorage, params: dict):
+    with storage._transaction() as cur:
+        for table in ("rating_snapshots", "seasons", "pair_stats", "match_games", "matches", "match_history", "players"):
+            cur.execute(f"DELETE FROM {table}")
+        cur.execute("DELETE FROM sqlite_sequence")
+        cur.execute(
+            """
+            WITH RECURSIVE g(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM g WHERE n + 1 < :players)
+            INSERT INTO players (guild_id, id, mu, sigma, games, wins, last_match)
+            SELECT :guild_id, :base + n,
+                   1500 + 200 * (abs(random() % 1000000) / 1000000.0 - 0.5),
+                   10 + 40 * (abs(random() % 1000000) / 1000000.0),
+                   0, 0, NULL
+            FROM g
+            """,
+            params
+        )
+        cur.execute(
+            """
+            WITH RECURSIVE m(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM m WHERE n < :matches),
+            k(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM k WHERE n < 7),
+            noise(m, r) AS (SELECT n, 200 * (abs(random() % 1000000) / 1000000.0 - 0.5) FROM m)
+            INSERT INTO match_history
+                (guild_id, player_id, match_id, timestamp, rank, wins, mu_before, sigma_before, mu_after, sigma_after)
+            SELECT
+                :guild_id,
+                :base + ((noise.m * 8 + k.n) * :stride) % :players,
+                noise.m,
+                datetime('2024-01-01', '+' || noise.m || ' minutes'),
+                k.n,
+                7 - k.n,
+                1500 + noise.r,
+                30,
+                1500 + noise.r + (3.5 - k.n) * 2,
+                29.5
+            FROM noise, k
+            ORDER BY noise.m, k.n
+            """,
+            params
+        )
+        cur.execute(
+            """
+            WITH RECURSIVE m(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM m WHERE n < :matches)
+            INSERT INTO matches (match_id, guild_id, channel_id, status, started_at, ended_at)
+            SELECT n, :guild_id, :channel_id, 'finished',
+                   datetime('2024-01-01', '+' || n || ' minutes'),
+                   datetime('2024-01-01', '+' || n || ' minutes')
+            FROM m
+            """,
+            params
+        )
+        cur.execute(
+            """
+            UPDATE players SET games = c.games, wins = c.wins, last_match = c.last_match
+            FROM (
+                SELECT player_id, COUNT(*) AS games, SUM(wins) AS wins, MAX(timestamp) AS last_match
+                FROM match_history
+                GROUP BY player_id
+            ) c
+            WHERE players.guild_id = :guild_id AND players.id = c.player_id
+            """,
+            params
+        )
+    with storage._lock:
+        storage._conn.execute("ANALYZE")
@@ -0,0 +1,94 @@
+import time
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    スレッドセーフな LRU キャッシュ。
+    ttl（秒）を指定すると、その時間を過ぎたエントリはミス扱いになる。
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # 書き込み・無効化のたびに増える世代番号（古い読み込み結果での上書きを防ぐ）
+        self.generation = 0
+        self._data = OrderedDict()  # key -> (期限, 値)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        キャッシュから値を取り出す。なければ（または期限切れなら）default
+        """
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """
+        値を書き込む（DB 更新後の write-through 用）
+        """
+        with self._lock:
+            self.generation += 1
+            self._store(key, value)
+
+    def fill(self, key, value, generation: int):
+        """
+        DB から読んだ値を書き込む。
+        読み込み開始（generation 取得）後に書き込みがあった場合は古い値なので捨てる。
+        """
+        with self._lock:
+            if self.generation == generation:
+                self._store(key, value)
+
+    def invalidate(self, key):
+        """
+        指定したキーを削除する
+        """
+        with self._lock:
+            self.generation += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        全エントリを削除する
+        """
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """
+        ヒット数・ミス数・ヒット率・現在の件数を返す
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "size": len(self._data),
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    def _store(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
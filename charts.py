@@ -0,0 +1,92 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from cache import LRUCache
+
+# グラフ描画ワーカー数とキャッシュ件数
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', 2))
+CHART_CACHE_SIZE = int(os.getenv('CHART_CACHE_SIZE', 256))
+
+# (player_id, 最新の match_id) -> PNG のバイト列
+chart_cache = LRUCache(CHART_CACHE_SIZE)
+
+_executor = None
+_pending = {}  # 描画中のキー -> Future（同じグラフの同時描画をまとめる）
+
+
+def render_rating_chart(points: list) -> bytes:
+    """
+    [(何試合目か, レート), ...] からレート推移のグラフを描画して PNG のバイト列を返す。
+    pyplot のグローバル状態は使わず、Figure ごとに独立して描画する。
+    matplotlib は読み込みが重いので、描画プロセスで初めて使うときに読み込む。
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot([n for n, _ in points], [r for _, r in points], marker="o", label="Rate")
+    ax.set_xlabel("Match")
+    ax.set_ylabel("Rate")
+    ax.grid(True)
+    fig.tight_layout()
+    buf = BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def _get_executor():
+    """
+    描画用のプロセスプールを返す（初回呼び出し時に作成）。
+    描画は GIL を握り続けるので、スレッドではなく別プロセスで行う。
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=CHART_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+async def get_rating_chart(player_id: int, match_id: int, load_points) -> bytes:
+    """
+    レート推移グラフの PNG を返す。
+    (player_id, 最新の match_id) が同じなら描画済みの画像をそのまま返す。
+    load_points はキャッシュにない場合だけ呼ばれ、描画する点を返すコルーチン関数。
+    """
+    key = (int(player_id), match_id)
+    png = chart_cache.get(key)
+    if png is not None:
+        return png
+
+    future = _pending.get(key)
+    if future is None:
+        points = await load_points()
+        future = _pending.get(key)
+    if future is None:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(_get_executor(), render_rating_chart, points)
+        _pending[key] = future
+        future.add_done_callback(lambda f: _on_rendered(key, f))
+    # 呼び出し元がキャンセルされても描画自体は続け、結果はキャッシュに残す
+    return await asyncio.shield(future)
+
+
+def _on_rendered(key, future):
+    _pending.pop(key, None)
+    if not future.cancelled() and future.exception() is None:
+        chart_cache.set(key, future.result())
+
+
+def shutdown():
+    """
+    描画用のプロセスプールを停止する
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
@@ -0,0 +1,49 @@
+"""
+環境変数（.env）から読む設定。storage と utils の両方がここから読むので、他のモジュールを import しない。
+"""
+import os
+from dotenv import load_dotenv
+
+# .env から環境変数を読み込む
+load_dotenv()
+
+# DB接続設定（STORAGE_BACKEND=postgres のとき）
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'port': int(os.getenv('DB_PORT', 5432)),
+    'user': os.getenv('DB_USER', 'postgres'),
+}
+# 未指定なら libpq の既定（PGDATABASE またはユーザー名）の DB に接続する
+if os.getenv('DB_NAME'):
+    DB_CONFIG['dbname'] = os.getenv('DB_NAME')
+
+# 他人の登録や /metrics など、管理者だけが使える操作を許可する Discord ユーザーID
+ADMIN_ID = int(os.getenv('ADMIN_ID', 970133347722485820))
+
+# TrueSkill 設定（replay.py で別の値を試してから反映する）
+TS_MU = float(os.getenv('TS_MU', 1500.0))
+TS_SIGMA = float(os.getenv('TS_SIGMA', 50.0))
+TS_BETA = float(os.getenv('TS_BETA', 10.0))
+TS_TAU = float(os.getenv('TS_TAU', 1.0))
+TS_DRAW_PROBABILITY = float(os.getenv('TS_DRAW_PROBABILITY', 0.10))
+
+# コネクションプール設定（STORAGE_BACKEND=postgres のとき）
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))
+# psycopg2 のプールは minconn 本を超えて返された接続を閉じてしまうので、
+# 既定では最大数と同じにして、同時アクセスのたびに再接続（とプリペアド文の作り直し）が起きないようにする
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', DB_POOL_MAX))
+# この秒数以上使われていなかった接続は、貸し出し前に疎通確認する
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv('DB_POOL_HEALTHCHECK_IDLE', 30))
+
+# プレイヤーキャッシュ設定（TTL 0 なら期限なし）
+PLAYER_CACHE_SIZE = int(os.getenv('PLAYER_CACHE_SIZE', 1024))
+PLAYER_CACHE_TTL = float(os.getenv('PLAYER_CACHE_TTL', 0)) or None
+
+# /history のグラフに描く最大点数（これを超える履歴は間引く）
+HISTORY_CHART_POINTS = int(os.getenv('HISTORY_CHART_POINTS', 200))
+
+# 1プロセスでサーバーごとにこの試合数を保存するごとに、レートのスナップショットを取る（0 なら自動では取らない）
+SNAPSHOT_INTERVAL = int(os.getenv('SNAPSHOT_INTERVAL', 100))
+
+# サーバーごとに分ける前のデータを割り当てるサーバーID（マイグレーション v9 で使う。未指定なら試合が最も多いサーバー）
+LEGACY_GUILD_ID = int(os.getenv('LEGACY_GUILD_ID')) if os.getenv('LEGACY_GUILD_ID') else None
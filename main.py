@@ -1,12 +1,33 @@
 import os
+import time
+import json
+import hashlib
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
 import asyncio
+from utils import migrate
+from storage import close_storage
+import async_utils
+import charts
+
+# 起動からログイン完了までの時間を表示するための基準
+STARTED_AT = time.perf_counter()
 
 # 環境変数読み込み
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
+# コマンドを即時反映するサーバーのID（カンマ区切り）。未指定なら全サーバー共通で同期する
+SYNC_GUILD_IDS = [int(g) for g in os.getenv('SYNC_GUILD_IDS', '').split(',') if g.strip()]
+# シャード設定。未指定なら Discord の推奨数のシャードをこのプロセスですべて動かす。
+# 複数プロセスに分けるときは、全体のシャード数 SHARD_COUNT と、このプロセスが受け持つ SHARD_IDS（カンマ区切り）を
+# 指定する。1つのサーバーは1つのシャード（プロセス）だけが受け持ち、データもサーバーごとに分かれているので、
+# プロセスごとのキャッシュはそのまま使える
+SHARD_COUNT = int(os.getenv('SHARD_COUNT')) if os.getenv('SHARD_COUNT') else None
+SHARD_IDS = [int(s) for s in os.getenv('SHARD_IDS', '').split(',') if s.strip()] or None
+
+# 読み込む Cog（monitoring は他の Cog のコマンドも計測する）
+EXTENSIONS = ["monitoring", "names", "register", "stats", "match", "lobby"]
 
 # Intent設定
 intents = discord.Intents.default()
@@ -14,24 +35,65 @@ intents.members = True
 intents.message_content = True
 
 # Botインスタンス
-bot = commands.Bot(command_prefix='!', intents=intents)
+bot = commands.AutoShardedBot(command_prefix='!', intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+
+
+def command_tree_hash(guild=None) -> str:
+    """
+    同期するコマンド定義のハッシュ。定義が変わらなければ同じ値になる
+    """
+    payload = sorted(
+        (cmd.to_dict(bot.tree) for cmd in bot.tree.get_commands(guild=guild)),
+        key=lambda c: c["name"]
+    )
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+async def sync_command_tree():
+    """
+    コマンド定義が前回の同期から変わったときだけ Discord に同期する。
+    ハッシュは bot_state に保存する（消せば次回の起動で同期し直す）。
+    """
+    guilds = [discord.Object(id=g) for g in SYNC_GUILD_IDS] or [None]
+    for guild in guilds:
+        if guild is not None:
+            bot.tree.copy_global_to(guild=guild)
+        key = f"command_tree:{bot.application_id}:{guild.id if guild else 'global'}"
+        digest = command_tree_hash(guild)
+        if await async_utils.get_state(key) == digest:
+            continue
+        await bot.tree.sync(guild=guild)
+        await async_utils.set_state(key, digest)
+        print(f"コマンドを同期しました ({guild.id if guild else 'global'})")
+
+
+@bot.event
+async def setup_hook():
+    # ログイン後・ゲートウェイ接続前に1回だけ呼ばれる（再接続では呼ばれない）
+    await asyncio.gather(
+        async_utils.run_db(migrate),
+        *(bot.load_extension(name) for name in EXTENSIONS)
+    )
+    # コマンドはアプリケーション全体で共通なので、シャード0を受け持つプロセスだけが同期する
+    if SHARD_IDS is None or 0 in SHARD_IDS:
+        await sync_command_tree()
 
 
 @bot.event
 async def on_ready():
-    await bot.tree.sync()
-    print(f"Logged in as {bot.user} (ID: {bot.user.id})")
-    print("Bot is ready.")
+    print(f"Logged in as {bot.user} (ID: {bot.user.id}, shards: {sorted(bot.shards)} / {bot.shard_count})")
+    print(f"Bot is ready. ({time.perf_counter() - STARTED_AT:.1f}s)")
 
 
 
-async def load_cogs():
-    await bot.load_extension("register")
-    await bot.load_extension("stats")
-    await bot.load_extension("match")
-    await bot.load_extension("lobby")
-    await bot.start(TOKEN)
+async def main():
+    try:
+        await bot.start(TOKEN)
+    finally:
+        charts.shutdown()
+        async_utils.shutdown()
+        close_storage()
 
 
 if __name__ == '__main__':
-    asyncio.run(load_cogs())
+    asyncio.run(main())
@@ -1,35 +1,185 @@
 import discord
 from discord.ext import commands
+from discord import app_commands
 from discord.ui import View
 from datetime import datetime
 import asyncio
-from utils import entry_order, match_patterns, get_player, upsert_player, insert_match_history, get_connection
-from trueskill import TrueSkill
+from utils import refresh_players
+from config import ADMIN_ID, TS_MU, TS_SIGMA, TS_BETA, TS_TAU, TS_DRAW_PROBABILITY
+from outcomes import match_patterns, outcome_mask, pair_deltas
+from sessions import sessions, ENTRY_LIMIT
+from storage import get_storage, ConflictError
+from names import resolver
+from scheduler import edit_scheduler
+from charts import chart_cache
+from async_utils import (
+    run_db, get_players, save_match_results, start_match, abort_match,
+    record_game, get_match_games, get_running_matches, maybe_take_snapshot
+)
 import traceback
 
-# TrueSkill 初期設定
-ts = TrueSkill(mu=1500.0, sigma=50.0, beta=10.0, tau=1.0)
+# 試合結果の書き込みが他の試合と競合したときに、読み直して計算し直す最大回数
+SAVE_RETRIES = 5
+# /undo で一度に取り消せる試合数の上限
+UNDO_MAX_COUNT = 10
 
-def make_rating(mu, sigma):
-    return ts.Rating(mu=mu, sigma=sigma)
+_ts = None
+
+def get_ts():
+    """
+    TrueSkill の環境を返す（起動を速くするため、初めてレートを計算するときに作る）
+    """
+    global _ts
+    if _ts is None:
+        from trueskill import TrueSkill
+        _ts = TrueSkill(mu=TS_MU, sigma=TS_SIGMA, beta=TS_BETA, tau=TS_TAU, draw_probability=TS_DRAW_PROBABILITY)
+    return _ts
 
-def get_next_match_id():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute('SELECT COALESCE(MAX(match_id), 0) + 1 FROM match_history;')
-    next_id = cur.fetchone()[0]
-    cur.close()
-    conn.close()
-    return next_id
+def make_rating(mu, sigma):
+    return get_ts().Rating(mu=mu, sigma=sigma)
+
+def _replay_match(rows, state):
+    """
+    取り消しより後の1試合を、巻き戻した後のレートで計算し直す。
+    rows は (行ID, player_id, rank, μ前, σ前) のリスト、state は player_id -> (μ, σ)。
+    戻り値は match_history を書き換える (行ID, μ前, σ前, μ後, σ後) のリスト
+    """
+    before = []
+    for _, pid, _, mu_b, sig_b in rows:
+        # まだ影響を受けていない人は保存済みの試合前の値がそのまま正しい
+        before.append(state.setdefault(pid, (mu_b, sig_b)))
+    rated = get_ts().rate([(make_rating(mu, sigma),) for mu, sigma in before], ranks=[r[2] for r in rows])
+    updates = []
+    for (row_id, pid, _, _, _), (mu_b, sig_b), (r,) in zip(rows, before, rated):
+        state[pid] = (round(float(r.mu), 2), round(float(r.sigma), 2))
+        updates.append((row_id, mu_b, sig_b) + state[pid])
+    return updates
+
+def undo_matches(guild_id: int, count: int = 1, match_id: int = None):
+    """
+    サーバー内の最新 count 試合（match_id 指定時はその試合）を1トランザクションで取り消す。
+    最新でない試合を取り消したときは、影響を受けるプレイヤーが出ている同じサーバーの後の試合を順に計算し直す。
+    戻り値は (取り消した match_id のリスト, 対象プレイヤーIDのリスト, 再計算した試合数)
+    """
+    for attempt in range(SAVE_RETRIES):
+        try:
+            targets, undone, replayed, restored = get_storage().undo_matches(guild_id, count, match_id, _replay_match)
+            break
+        except ConflictError:
+            # 試合結果の保存と競合したので、トランザクションごとやり直す
+            if attempt == SAVE_RETRIES - 1:
+                raise
+    # コミット後に巻き戻したレートでキャッシュを更新する
+    refresh_players(restored)
+    return targets, undone, replayed
+
+def _rate_match(match_id: int, entry_order: list, names: dict, win_counts: dict, ranks: dict, players: dict) -> tuple:
+    """
+    読み込んだ players の値で1試合分のレートを計算する。
+    戻り値は (表示用の結果, save_match_results に渡す players と match_history の行)
+    """
+    ratings = [make_rating(float(players[int(uid)]['mu']), float(players[int(uid)]['sigma'])) for uid in entry_order]
+    rated = get_ts().rate([[r] for r in ratings], ranks=[ranks[uid] for uid in entry_order])
+
+    timestamp = datetime.now()
+    results = []
+    player_rows = []
+    history_rows = []
+
+    for idx, uid in enumerate(entry_order):
+        player = players[int(uid)]
+        old_mu, old_sigma = float(player['mu']), float(player['sigma'])
+        new_mu, new_sigma = round(float(rated[idx][0].mu), 2), round(float(rated[idx][0].sigma), 2)
+        w = win_counts[uid]
+
+        # データベースには通常のμ, σを保存（version は読み込んだときの値）
+        player_rows.append({
+            "player_id": uid, "mu": new_mu, "sigma": new_sigma,
+            "games": player['games'] + 1, "wins": player['wins'] + w,
+            "last_match": timestamp.isoformat(), "version": player['version'],
+        })
+        history_rows.append({
+            "player_id": uid, "match_id": match_id, "timestamp": timestamp.isoformat(),
+            "rank": ranks[uid], "wins": w,
+            "mu_before": old_mu, "sigma_before": old_sigma, "mu_after": new_mu, "sigma_after": new_sigma,
+        })
+
+        # 表示用には保守的レートを計算
+        old_conservative = round(old_mu - 3 * old_sigma)
+        new_conservative = round(new_mu - 3 * new_sigma)
+
+        results.append({"name": names[uid], "wins": w, "mu_old": old_conservative, "mu_new": new_conservative, "rank": ranks[uid]})
+    return results, player_rows, history_rows
+
+async def _append_game(previous, match_id: int, game_no: int, team1_won: bool):
+    """
+    1ゲーム分の結果を保存する。直前の保存が終わってから書き込むので、保存済みの結果に抜けができない。
+    """
+    if previous is not None:
+        await previous
+    await record_game(match_id, game_no, team1_won)
+
+async def _settle_saving(saving):
+    """
+    試合を中止する前に、保存中のゲーム結果の書き込みを待つ（中止後に書き込まれないようにする）。
+    保存の失敗は中止の妨げにならないので、ログに出すだけにする。
+    """
+    if saving is None:
+        return
+    try:
+        await saving
+    except Exception:
+        traceback.print_exc()
+
+
+class MatchView(View):
+    def __init__(self):
+        super().__init__(timeout=900)
+        self.result = None
+        # 押されたボタンのインタラクション（次の盤面への書き換えをこの応答で行う）
+        self.interaction = None
+
+    @discord.ui.button(label="Aチーム勝利", style=discord.ButtonStyle.success)
+    async def a_win(self, intr, btn):
+        self.result = True
+        self.interaction = intr
+        self.stop()
+
+    @discord.ui.button(label="Bチーム勝利", style=discord.ButtonStyle.danger)
+    async def b_win(self, intr, btn):
+        self.result = False
+        self.interaction = intr
+        self.stop()
+
+    @discord.ui.button(label="中止", style=discord.ButtonStyle.secondary)
+    async def cancel(self, intr, btn):
+        self.result = "abort"
+        self.interaction = intr
+        self.stop()
+
+
+class ResumeView(View):
+    def __init__(self):
+        super().__init__(timeout=900)
+        self.result = None
+
+    @discord.ui.button(label="再開", style=discord.ButtonStyle.success)
+    async def resume(self, intr, btn):
+        self.result = True
+        self.stop()
+
+    @discord.ui.button(label="破棄", style=discord.ButtonStyle.danger)
+    async def discard(self, intr, btn):
+        self.result = False
+        self.stop()
 
 class MatchCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.aborted = False
-        
-
-      
+        self._resume_checked = False
+        self._tasks = set()
 
+    @commands.guild_only()
     @commands.hybrid_command(name="order", description="8人のプレイヤー順を指定")
     async def order(self, ctx,
         player1: discord.Member, player2: discord.Member, player3: discord.Member, player4: discord.Member,
@@ -37,11 +187,9 @@ class MatchCog(commands.Cog):
         try:
             await ctx.defer()
             members = [player1, player2, player3, player4, player5, player6, player7, player8]
-            
-            missing_players = []
-            for member in members:
-                if get_player(str(member.id)) is None:
-                    missing_players.append(member.display_name)
+
+            registered = await get_players(ctx.guild.id, [m.id for m in members])
+            missing_players = [m.display_name for m in members if m.id not in registered]
 
             if missing_players:
                 missing_message = "、".join(missing_players) + "が未登録です。"
@@ -51,9 +199,16 @@ class MatchCog(commands.Cog):
                 )
                 await ctx.send(embed=embed)
                 return
-            
-            entry_order.clear()
-            entry_order.extend(str(m.id) for m in members)
+
+            session = sessions.for_context(ctx)
+            if session.lock.locked():
+                embed = discord.Embed(
+                    description="⚠️ このチャンネルでは試合が進行中のため、順番を変更できません",
+                    color=0x1E90FF
+                )
+                await ctx.send(embed=embed)
+                return
+            session.entry_order = [str(m.id) for m in members]
 
             msg = "**順番を設定しました** 次に `/match` で記録を開始してください。\n"
             for i, m in enumerate(members):
@@ -72,63 +227,193 @@ class MatchCog(commands.Cog):
                 )
             await ctx.send(embed=embed)
 
-    
 
+
+    @commands.guild_only()
     @commands.hybrid_command(name="match", description="14試合を実行し、勝利数から順位とレートを算出")
-    async def match(self, ctx):
+    @app_commands.describe(balance="レートから実力が拮抗する組み合わせを自動で選ぶ")
+    async def match(self, ctx, balance: bool = False):
         await ctx.defer()
+        session = sessions.for_context(ctx)
         try:
-            if len(entry_order) != 8:
+            entry_order = list(session.entry_order)
+            if len(entry_order) != ENTRY_LIMIT:
                 embed = discord.Embed(
                     description="⚠️ 先に `/order` で8人の順番を設定してください",
                     color=0x1E90FF
                 )
                 await ctx.send(embed=embed)
                 return
+            if session.lock.locked():
+                embed = discord.Embed(
+                    description="⚠️ このチャンネルでは既に試合が進行中です",
+                    color=0x1E90FF
+                )
+                await ctx.send(embed=embed)
+                return
+
+            # 空いているロックは待たずに取得できるので、確認との間に割り込まれない
+            await session.lock.acquire()
+        except Exception:
+            traceback.print_exc()
+            embed = discord.Embed(
+                description="❌ エラーが発生しました。",
+                color=0x1E90FF
+            )
+            await ctx.send(embed=embed)
+            return
+
+        await self._run_match(
+            ctx, ctx.guild, ctx.channel.id, session, entry_order,
+            host_id=session.host_id or ctx.author.id, balance=balance
+        )
+
+    @commands.guild_only()
+    @commands.hybrid_command(name="resume", description="中断された試合の記録を再開します")
+    async def resume(self, ctx):
+        try:
+            await ctx.defer()
+            running = await get_running_matches(ctx.channel.id)
+            if not running:
+                embed = discord.Embed(
+                    description="🔔 このチャンネルに中断された試合はありません",
+                    color=0x1E90FF
+                )
+                await ctx.send(embed=embed)
+                return
+        except Exception:
+            traceback.print_exc()
+            embed = discord.Embed(
+                description="❌ エラーが発生しました。",
+                color=0x1E90FF
+            )
+            await ctx.send(embed=embed)
+            return
+
+        await self._offer_resume(ctx, ctx.guild, running[-1])
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # 再接続のたびに呼ばれるので、確認は起動後の1回だけ
+        if self._resume_checked:
+            return
+        self._resume_checked = True
+        try:
+            running = await get_running_matches()
+        except Exception:
+            traceback.print_exc()
+            return
+        for m in running:
+            # 他のプロセスのシャードが受け持つサーバーのチャンネルは見えないので、そのプロセスに任せる
+            channel = self.bot.get_channel(m["channel_id"])
+            if channel is not None:
+                task = asyncio.create_task(self._offer_resume(channel, channel.guild, m))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _offer_resume(self, dest, guild, running: dict):
+        """
+        中断された試合の再開／破棄を確認し、再開なら続きから記録する
+        """
+        try:
+            match_id = running["match_id"]
+            games = list(running["games"])
+            embed = discord.Embed(
+                description=f"⏸️ 試合（Match ID: {match_id}）が第{len(games) + 1}試合で中断されています。再開しますか？",
+                color=0x1E90FF
+            )
+            view = ResumeView()
+            message = await dest.send(embed=embed, view=view)
+            if await view.wait():
+                # タイムアウト時はそのまま残し、次回起動時や /resume で再確認する
+                await message.edit(view=None)
+                return
+            await message.delete()
 
-            self.aborted = False
-            match_id = get_next_match_id()
+            if not view.result:
+                await abort_match(match_id)
+                embed = discord.Embed(
+                    description=f"🗑️ 試合（Match ID: {match_id}）を破棄しました。",
+                    color=0x1E90FF
+                )
+                await dest.send(embed=embed)
+                return
+
+            session = sessions.get(running["guild_id"], running["channel_id"])
+            if session.lock.locked():
+                embed = discord.Embed(
+                    description="⚠️ このチャンネルでは既に試合が進行中です",
+                    color=0x1E90FF
+                )
+                await dest.send(embed=embed)
+                return
+            await session.lock.acquire()
+            session.entry_order = [str(uid) for uid in running["entry_order"]]
+        except Exception:
+            traceback.print_exc()
+            embed = discord.Embed(
+                description="❌ エラーが発生しました。",
+                color=0x1E90FF
+            )
+            await dest.send(embed=embed)
+            return
+
+        await self._run_match(
+            dest, guild, running["channel_id"], session, list(session.entry_order),
+            match_id=match_id, patterns=running["patterns"], results=games
+        )
+
+    async def _run_match(self, dest, guild, channel_id: int, session, entry_order: list,
+                         host_id=None, balance: bool = False,
+                         match_id: int = None, patterns: list = None, results: list = ()):
+        """
+        14試合の記録から結果の書き込みまでを行う。呼び出し元で session.lock を取得しておくこと。
+        match_id を渡すと、保存済みの results の続きから再開する。
+        各ゲームの結果はクリックごとに match_games へ保存し、最後はそこから集計する。
+        盤面は1つのメッセージを書き換えて使い、結果表示もそのメッセージに出す。
+        """
+        resumable = False  # 失敗したときに /resume で続きから再開できる状態か（running の試合があるか）
+        try:
+            session.aborted = False
+            # 8人の表示名は最初に1回だけ解決して使い回す
+            names = await resolver.resolve(guild, entry_order)
+            if match_id is None:
+                patterns = match_patterns
+                if balance:
+                    # NumPy を使うので、初めて使うときに読み込む
+                    from matchmaking import balanced_schedule
+                    players = await get_players(guild.id, entry_order)
+                    patterns = balanced_schedule(
+                        [(players[int(uid)]['mu'], players[int(uid)]['sigma']) for uid in entry_order]
+                    )
+                match_id = await start_match(guild.id, channel_id, host_id, entry_order, patterns)
+            resumable = True
             win_counts = {uid: 0 for uid in entry_order}
-            match_results = []
-            last_message = None
-            last_winner = None
-
-            class MatchView(View):
-                def __init__(self, idx):
-                    super().__init__(timeout=900)
-                    self.idx = idx
-                    self.result = None
-
-                @discord.ui.button(label="Aチーム勝利", style=discord.ButtonStyle.success)
-                async def a_win(self, intr, btn):
-                    self.result = True
-                    self.stop()
-
-                @discord.ui.button(label="Bチーム勝利", style=discord.ButtonStyle.danger)
-                async def b_win(self, intr, btn):
-                    self.result = False
-                    self.stop()
-
-                @discord.ui.button(label="中止", style=discord.ButtonStyle.secondary)
-                async def cancel(self, intr, btn):
-                    self.result = "abort"
-                    self.stop()
-
-            for i, pattern in enumerate(match_patterns):
-                if self.aborted:
+            for pattern, team1_won in zip(patterns, results):
+                winner = pattern["team1"] if team1_won else pattern["team2"]
+                for idx in winner:
+                    win_counts[entry_order[idx]] += 1
+            board = None  # 盤面のメッセージ
+            clicked = None  # 直前に押されたボタンのインタラクション
+            last_winner = results[-1] if results else None
+            saving = None  # 直前のゲーム結果の保存タスク
+
+            for i, pattern in enumerate(patterns):
+                if i < len(results):
+                    continue
+                if session.aborted:
                     embed = discord.Embed(
                     description="🛑 マッチが中止されました",
                     color=0x1E90FF
                     )
-                    await ctx.send(embed=embed)
+                    await dest.send(embed=embed)
                     return
 
                 team1 = [entry_order[n] for n in pattern["team1"]]
                 team2 = [entry_order[n] for n in pattern["team2"]]
 
-                a_names = [ctx.guild.get_member(int(uid)).display_name if ctx.guild.get_member(int(uid)) else uid for uid in team1]
-                b_names = [ctx.guild.get_member(int(uid)).display_name if ctx.guild.get_member(int(uid)) else uid for uid in team2]
-
+                a_names = [names[uid] for uid in team1]
+                b_names = [names[uid] for uid in team2]
 
                 embed = discord.Embed(
                     title=f"第{i+1}試合（Match ID: {match_id}）",
@@ -140,86 +425,76 @@ class MatchCog(commands.Cog):
                 if last_winner is not None:
                     winner_str = "Aチーム" if last_winner else "Bチーム"
                     embed.add_field(name="前回の勝者", value=winner_str, inline=True)
-                
+
                 # 各プレイヤーの勝利数を表示
                 wins_text_lines = []
                 for uid in entry_order:
-                    player_name = ctx.guild.get_member(int(uid)).display_name if ctx.guild.get_member(int(uid)) else uid
+                    player_name = names[uid]
                     wins_text_lines.append(f"{player_name}: {win_counts[uid]}勝")
                 embed.add_field(name="🏆 勝利数", value="\n".join(wins_text_lines), inline=False)
-                    
 
-                view = MatchView(i)
-                if i > 0 and last_message:
-                    try:
-                        await last_message.delete()
-                    except Exception:
-                        pass
-                last_message = await ctx.send(embed=embed, view=view)
+                view = MatchView()
+                if board is None:
+                    board = await dest.send(embed=embed, view=view)
+                else:
+                    await edit_scheduler.edit(board, interaction=clicked, embed=embed, view=view)
 
-                try:
-                    await view.wait()
-                except asyncio.TimeoutError:
+                if await view.wait():
+                    await _settle_saving(saving)
+                    await abort_match(match_id)
+                    resumable = False
                     embed = discord.Embed(
                     description=f"第{i+1}試合はスキップされました。",
                     color=0x1E90FF
                     )
-                    await ctx.send(embed=embed)
+                    await edit_scheduler.edit(board, embed=embed, view=None)
                     return
 
+                clicked = view.interaction
                 if view.result == "abort":
-                    self.aborted = True
-                    if last_message:
-                        try:
-                            await last_message.delete()
-                        except Exception:
-                            pass
+                    session.aborted = True
+                    await _settle_saving(saving)
+                    await abort_match(match_id)
+                    resumable = False
                     embed = discord.Embed(
                         description="🛑 試合記録が中止されました。",
                         color=0x1E90FF
                     )
-                    await ctx.send(embed=embed)
+                    await edit_scheduler.edit(board, interaction=clicked, embed=embed, view=None)
                     return
 
+                # 結果の保存は待たずに次の試合を表示する（保存は直前の保存の後に順番に行う）
+                saving = asyncio.create_task(_append_game(saving, match_id, i, view.result))
                 last_winner = view.result
-                match_results.append(view.result)
                 winner = pattern["team1"] if view.result else pattern["team2"]
                 for idx in winner:
                     win_counts[entry_order[idx]] += 1
 
-            if last_message:
-                try:
-                    await last_message.delete()
-                except Exception:
-                    pass
+            # 保存済みのゲーム結果から集計する
+            if saving is not None:
+                await saving
+            win_counts = {uid: 0 for uid in entry_order}
+            games = await get_match_games(match_id)
+            for pattern, team1_won in zip(patterns, games):
+                winner = pattern["team1"] if team1_won else pattern["team2"]
+                for idx in winner:
+                    win_counts[entry_order[idx]] += 1
 
             ranks = {uid: sum(1 for w in win_counts.values() if w > win_counts[uid]) for uid in entry_order}
-            ratings = [make_rating(*(float(get_player(uid)[k]) for k in ('mu', 'sigma'))) for uid in entry_order]
-            rated = ts.rate([[r] for r in ratings], ranks=[ranks[uid] for uid in entry_order])
-
-            timestamp = datetime.now()
-            results = []
-
-            for idx, uid in enumerate(entry_order):
-                player = get_player(uid)
-                old_mu, old_sigma = float(player['mu']), float(player['sigma'])
-                new_mu, new_sigma = round(float(rated[idx][0].mu), 2), round(float(rated[idx][0].sigma), 2)
-                w = win_counts[uid]
-
-                # データベースには通常のμ, σを保存
-                player['mu'], player['sigma'], player['games'], player['wins'], player['last_match'] = (
-                    new_mu, new_sigma, player['games'] + 1, player['wins'] + w, timestamp
-                )
-                upsert_player(uid, player['mu'], player['sigma'], player['games'], player['wins'], timestamp.isoformat())
-                insert_match_history(uid, match_id, timestamp.isoformat(), ranks[uid], w, old_mu, old_sigma, new_mu, new_sigma)
-
-                # 表示用には保守的レートを計算
-                old_conservative = round(old_mu - 3 * old_sigma)
-                new_conservative = round(new_mu - 3 * new_sigma)
-
-                name = ctx.guild.get_member(int(uid)).display_name if ctx.guild.get_member(int(uid)) else uid
-                results.append({"name": name, "wins": w, "mu_old": old_conservative, "mu_new": new_conservative, "rank": ranks[uid]})
-
+            mask = outcome_mask(games)
+            pairs = pair_deltas(entry_order, patterns, mask)
+            for attempt in range(SAVE_RETRIES):
+                players = await get_players(guild.id, entry_order)
+                results, player_rows, history_rows = _rate_match(match_id, entry_order, names, win_counts, ranks, players)
+                try:
+                    # 全員分の players / match_history と、ゲーム結果・ペア統計を1トランザクションで書き込む
+                    await save_match_results(guild.id, match_id, player_rows, history_rows, mask, pairs)
+                    resumable = False
+                    break
+                except ConflictError:
+                    # 読み込んだ後に別の試合が同じプレイヤーのレートを更新していたので、最新の値で計算し直す
+                    if attempt == SAVE_RETRIES - 1:
+                        raise
 
             # （差し替え）表形式の結果表示（Embedでコードブロックをdescriptionに収める）
             results.sort(key=lambda r: r["rank"])
@@ -238,78 +513,59 @@ class MatchCog(commands.Cog):
                 description="\n".join(lines),
                 color=0x1E90FF
             )
-            await ctx.send(embed=result_embed, reference=None)
+            if board is None:
+                await dest.send(embed=result_embed, reference=None)
+            else:
+                await edit_scheduler.edit(board, interaction=clicked, embed=result_embed, view=None)
 
+            # 一定の試合数ごとにレートのスナップショットを取る（失敗しても試合結果には影響しない）
+            try:
+                await maybe_take_snapshot(guild.id)
+            except Exception:
+                traceback.print_exc()
 
         except Exception:
-            import traceback
             traceback.print_exc()
+            if resumable:
+                # 保存済みのゲーム結果は残るので、/resume で続きから再開できる
+                description = "❌ エラーが発生しました。`/resume` で続きから再開できます。"
+            else:
+                description = "❌ エラーが発生しました。"
             embed = discord.Embed(
-                description="❌ エラーが発生しました。",
+                description=description,
                 color=0x1E90FF
             )
-            await ctx.send(embed=embed)
-
-
-
-
-
-
+            await dest.send(embed=embed)
+        finally:
+            session.lock.release()
 
+    @commands.guild_only()
     @commands.hybrid_command(name='undo', description='最新の試合を取り消します')
-    async def undo(self, ctx):
-        from utils import get_connection
+    @app_commands.describe(count=f"取り消す試合数（新しい順、{UNDO_MAX_COUNT}まで）", match_id="取り消す試合のID（指定時は count を無視）")
+    async def undo(self, ctx, count: commands.Range[int, 1, UNDO_MAX_COUNT] = 1, match_id: int = None):
         try:
+            # 複数試合や ID 指定の取り消しは影響が大きいので管理者のみ
+            if (count > 1 or match_id is not None) and ctx.author.id != ADMIN_ID:
+                embed = discord.Embed(
+                    description="複数の試合や ID を指定した取り消しは管理者のみ実行できます",
+                    color=0xED4245
+                )
+                await ctx.send(embed=embed, ephemeral=True)
+                return
             await ctx.defer()
-            conn = get_connection()
-            cur = conn.cursor()
-            cur.execute("SELECT MAX(match_id) FROM match_history;")
-            latest = cur.fetchone()[0]
-            if latest is None:
+            targets, undone, replayed = await run_db(undo_matches, ctx.guild.id, count, match_id)
+            if not targets:
                 await ctx.send("❌ 取り消す試合がありません。")
-                cur.close(); conn.close()
                 return
-            cur.execute("""
-                SELECT player_id, mu_before, sigma_before, wins, timestamp
-                FROM match_history
-                WHERE match_id = %s;
-            """, (latest,))
-            rows = cur.fetchall()
-            undone = []
-            for user_id, mu_b, sig_b, w_delta, ts_b in rows:
-                cur.execute("SELECT games, wins FROM players WHERE id = %s;", (user_id,))
-                games, total_wins = cur.fetchone()
-                cur.execute("""
-                    UPDATE players SET
-                        mu = %s,
-                        sigma = %s,
-                        games = %s,
-                        wins = %s,
-                        last_match = (
-                            SELECT timestamp
-                            FROM match_history
-                            WHERE player_id = %s AND match_id < %s
-                            ORDER BY match_id DESC
-                            LIMIT 1
-                        )
-                    WHERE id = %s;
-                """, (
-                    mu_b,
-                    sig_b,
-                    games - 1,
-                    total_wins - w_delta,
-                    user_id,
-                    latest,
-                    user_id
-                ))
-                undone.append(user_id)
-            cur.execute("DELETE FROM match_history WHERE match_id = %s;", (latest,))
-            conn.commit()
-            cur.close()
-            conn.close()
-            names = [ctx.guild.get_member(int(uid)).display_name if ctx.guild.get_member(int(uid)) else str(uid) for uid in undone]
-            await ctx.send(f"↩️ 試合 (ID: {latest}) を取り消しました\n" + "".join(names))
-        
+            if replayed:
+                # 後の試合のレート推移が変わるのでグラフを描き直させる
+                chart_cache.clear()
+            names = await resolver.resolve(ctx.guild, undone)
+            message = f"↩️ 試合 (ID: {', '.join(map(str, targets))}) を取り消しました\n" + "".join(names[uid] for uid in undone)
+            if replayed:
+                message += f"\n🔁 後の {replayed} 試合のレートを計算し直しました"
+            await ctx.send(message)
+
         except Exception:
             traceback.print_exc()
             await ctx.send("❌ エラーが発生しました。")
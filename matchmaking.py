@@ -0,0 +1,101 @@
+import math
+from functools import lru_cache
+from itertools import combinations
+import numpy as np
+from config import TS_BETA
+
+# 1試合の人数と、1セッションで行う試合数
+PLAYERS = 8
+GAMES = 14
+# 試合の質をペア偏りに対してどれだけ重視するか
+QUALITY_WEIGHT = 4.0
+
+
+@lru_cache(maxsize=1)
+def split_matrices() -> tuple:
+    """
+    8人を4対4に分ける全35通りと、その接続行列を返す（初回だけ計算してキャッシュ）。
+      splits: (35, 4) 各分け方の Aチーム（0番は常に Aチーム）
+      sides:  (35, 8) Aチームなら +1、Bチームなら -1
+      pairs:  (35, 28) 28組のペアが同じチームなら 1
+    """
+    splits = [(0,) + rest for rest in combinations(range(1, PLAYERS), 3)]
+    sides = -np.ones((len(splits), PLAYERS))
+    for i, team in enumerate(splits):
+        sides[i, list(team)] = 1
+    pair_index = list(combinations(range(PLAYERS), 2))
+    pairs = np.array([
+        [1.0 if sides[i, a] == sides[i, b] else 0.0 for a, b in pair_index]
+        for i in range(len(splits))
+    ])
+    for m in (sides, pairs):
+        m.setflags(write=False)
+    return np.array(splits), sides, pairs
+
+
+def evaluate_splits(mus, sigmas, beta: float = TS_BETA) -> np.ndarray:
+    """
+    全35通りの分け方について、TrueSkill の試合の質を一括で計算する。
+    戻り値は分け方ごとの質の配列
+    """
+    _, sides, _ = split_matrices()
+    mus = np.asarray(mus, dtype=float)
+    sigmas = np.asarray(sigmas, dtype=float)
+    # チーム能力差の分布 N(delta, variance)
+    delta = sides @ mus
+    variance = PLAYERS * beta ** 2 + np.sum(sigmas ** 2)
+    return math.sqrt(PLAYERS * beta ** 2 / variance) * np.exp(-delta ** 2 / (2 * variance))
+
+
+def balanced_schedule(ratings: list, games: int = GAMES, beta: float = TS_BETA) -> list:
+    """
+    8人の [(μ, σ), ...]（試合の並び順）から、試合の質が高く
+    ペアの組み合わせ回数が偏らない games 試合分の分け方を選ぶ。
+    戻り値は outcomes.match_patterns と同じ形式のリスト。
+    """
+    splits, _, pairs = split_matrices()
+    mus, sigmas = zip(*((float(m), float(s)) for m, s in ratings))
+    quality = evaluate_splits(mus, sigmas, beta)
+    # 質を 0〜1 に正規化して、どの実力差でも同じ重みで効かせる
+    spread = quality.max() - quality.min()
+    quality = (quality - quality.min()) / spread if spread > 0 else np.zeros_like(quality)
+
+    # 貪欲法: 毎回、ペア偏りの増加が小さく質の高い分け方を足していく
+    chosen = []
+    coverage = np.zeros(pairs.shape[1])
+    available = np.ones(len(splits), dtype=bool)
+    for _ in range(games):
+        spread_after = ((coverage + pairs) ** 2).sum(axis=1)
+        score = QUALITY_WEIGHT * quality - spread_after
+        score[~available] = -np.inf
+        best = int(np.argmax(score))
+        chosen.append(best)
+        available[best] = False
+        coverage += pairs[best]
+
+    # 入れ替えによる局所改善: 選んだ試合と未使用の分け方の全組み合わせを一括で評価し、
+    # 最も良くなる入れ替えを改善がなくなるまで繰り返す
+    chosen = np.array(chosen)
+    for _ in range(games * len(splits)):
+        unused = np.flatnonzero(available)
+        # (選択中の位置, 候補, ペア) の3次元で入れ替え後の同チーム回数を作る
+        trial = coverage - pairs[chosen][:, None, :] + pairs[unused][None, :, :]
+        gain = (
+            QUALITY_WEIGHT * (quality[unused][None, :] - quality[chosen][:, None])
+            - (trial ** 2).sum(axis=2) + (coverage ** 2).sum()
+        )
+        pos, cand = np.unravel_index(np.argmax(gain), gain.shape)
+        if gain[pos, cand] <= 1e-9:
+            break
+        available[chosen[pos]] = True
+        available[unused[cand]] = False
+        coverage = trial[pos, cand]
+        chosen[pos] = unused[cand]
+
+    return [
+        {
+            "team1": list(map(int, splits[i])),
+            "team2": [p for p in range(PLAYERS) if p not in splits[i]],
+        }
+        for i in chosen
+    ]
@@ -0,0 +1,220 @@
+"""
+Prometheus のテキスト形式で出力できる、最小限のメトリクス集計。
+DB 処理はワーカースレッドから記録するので、更新はすべてロックの中で行う。
+"""
+import threading
+from contextvars import ContextVar
+
+# コマンドの実行時間用のバケット（秒）。/match はボタン待ちを含むので長めまで取る
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 1800)
+
+# 実行中のコマンド名（run_db がワーカースレッドへ引き継ぐので、DB 呼び出しをコマンドに紐付けられる）
+current_command = ContextVar("current_command", default="-")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"] + self._lines()
+
+    def _lines(self) -> list:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def _lines(self) -> list:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(self.snapshot().items())
+        ]
+
+
+class Gauge(_Metric):
+    """
+    set() で値を入れるか、出力のたびに fn() が返す {ラベルのタプル: 値} を使う
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames=(), fn=None):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+        self._fn = fn
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def snapshot(self) -> dict:
+        if self._fn is not None:
+            return dict(self._fn())
+        with self._lock:
+            return dict(self._values)
+
+    def _lines(self) -> list:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(self.snapshot().items())
+        ]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}  # ラベル -> [各バケットの件数, 合計, 件数]
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self) -> dict:
+        """
+        {ラベル: (累積件数のリスト, 合計, 件数)} を返す
+        """
+        with self._lock:
+            result = {}
+            for labels, (counts, total, count) in self._values.items():
+                cumulative = []
+                running = 0
+                for c in counts:
+                    running += c
+                    cumulative.append(running)
+                result[labels] = (cumulative, total, count)
+            return result
+
+    def quantile(self, q: float, *labels) -> float:
+        """
+        バケットから q 分位点を見積もる（該当バケットの上限を返す）。記録がなければ None
+        """
+        entry = self.snapshot().get(labels)
+        if entry is None or entry[2] == 0:
+            return None
+        cumulative, _, count = entry
+        for bound, running in zip(self.buckets, cumulative):
+            if running >= q * count:
+                return bound
+        return self.buckets[-1]
+
+    def _lines(self) -> list:
+        lines = []
+        for labels, (cumulative, total, count) in sorted(self.snapshot().items()):
+            for bound, running in zip(self.buckets, cumulative):
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {running}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames=(), fn=None) -> Gauge:
+        return self._register(Gauge(name, help, labelnames, fn))
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        登録済みの全メトリクスを Prometheus のテキスト形式で返す
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+# Bot 全体で共有するレジストリと、各モジュールから記録するメトリクス
+registry = Registry()
+
+COMMAND_SECONDS = registry.histogram(
+    "bot_command_seconds", "コマンドの実行時間", ("command",)
+)
+COMMAND_ERRORS = registry.counter(
+    "bot_command_errors_total", "処理されなかった例外で終わったコマンドの数", ("command",)
+)
+DB_SECONDS = registry.histogram(
+    "bot_db_seconds", "DB 処理の所要時間（スレッドプールの待ち時間を含む）", ("function",)
+)
+DB_CALLS = registry.counter(
+    "bot_db_calls_total", "コマンドごとの DB 処理の呼び出し回数", ("command", "function")
+)
+LOOP_LAG = registry.histogram(
+    "bot_event_loop_lag_seconds", "イベントループの遅延",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+DISCORD_REQUESTS = registry.counter(
+    "bot_discord_requests_total", "Discord API の呼び出し回数", ("method", "route", "status")
+)
+DB_STATEMENTS = registry.counter(
+    "bot_db_statements_total", "プリペアド文の実行回数（kind=prepare は接続ごとの初回の PREPARE）",
+    ("statement", "kind")
+)
+DB_PLANS = registry.gauge(
+    "bot_db_plans", "プリペアド文を generic / custom plan で実行した回数（アイドル接続の疎通確認のたびに更新）",
+    ("statement", "plan")
+)
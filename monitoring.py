@@ -0,0 +1,228 @@
+import os
+import time
+import asyncio
+import traceback
+from io import BytesIO
+import discord
+from discord.ext import commands
+from utils import player_cache
+from config import ADMIN_ID
+from names import resolver
+from charts import chart_cache
+from scheduler import edit_scheduler
+from metrics import (
+    registry, current_command, COMMAND_SECONDS, COMMAND_ERRORS, DB_CALLS, LOOP_LAG, DISCORD_REQUESTS,
+    DB_STATEMENTS, DB_PLANS
+)
+
+# イベントループの遅延を測る間隔（秒）
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', 1.0))
+# 指定するとこのファイルに METRICS_INTERVAL 秒ごとに書き出す（node_exporter の textfile 用）
+METRICS_FILE = os.getenv('METRICS_FILE')
+METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', 15))
+# 指定するとこのポートの /metrics で公開する（Prometheus から直接取得する場合）
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+# 実行開始時刻（コマンドの実行時間の計測用）
+_started_at = {}
+
+
+def _cache_values(key: str) -> dict:
+    caches = {"players": player_cache, "names": resolver, "charts": chart_cache}
+    return {(name,): cache.stats()[key] for name, cache in caches.items()}
+
+
+registry.gauge(
+    "bot_cache_hit_ratio", "キャッシュのヒット率", ("cache",), fn=lambda: _cache_values("hit_ratio")
+)
+registry.gauge(
+    "bot_cache_size", "キャッシュの件数", ("cache",), fn=lambda: _cache_values("size")
+)
+registry.gauge(
+    "bot_message_edits", "編集スケジューラの送信数とまとめた数", ("kind",),
+    fn=lambda: {(k,): v for k, v in edit_scheduler.stats().items()}
+)
+
+
+class MonitoringCog(commands.Cog):
+    """
+    コマンド・DB・イベントループ・Discord API の計測と、その出力を行うCog
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self._tasks = []
+        self._runner = None
+        self._original_request = None
+
+    async def cog_load(self):
+        self.bot.before_invoke(self._before_invoke)
+        self.bot.after_invoke(self._after_invoke)
+        self._wrap_http()
+        self._tasks.append(asyncio.create_task(self._watch_loop_lag()))
+        if METRICS_FILE:
+            self._tasks.append(asyncio.create_task(self._export_file()))
+        if METRICS_PORT:
+            await self._start_server()
+
+    async def cog_unload(self):
+        for task in self._tasks:
+            task.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
+        if self._original_request is not None:
+            self.bot.http.request = self._original_request
+
+    async def _before_invoke(self, ctx):
+        # 同じタスク内の DB 呼び出し（run_db）にコマンド名が引き継がれる
+        current_command.set(ctx.command.qualified_name)
+        _started_at[id(ctx)] = time.perf_counter()
+
+    async def _after_invoke(self, ctx):
+        started = _started_at.pop(id(ctx), None)
+        if started is not None:
+            COMMAND_SECONDS.observe(time.perf_counter() - started, ctx.command.qualified_name)
+
+    @commands.Cog.listener()
+    async def on_command_error(self, ctx, error):
+        if ctx.command is not None:
+            COMMAND_ERRORS.inc(ctx.command.qualified_name)
+
+    def _wrap_http(self):
+        """
+        Discord API の呼び出しをすべて数えるため、HTTPClient.request を包む
+        """
+        original = self._original_request = self.bot.http.request
+
+        async def request(route, **kwargs):
+            status = "error"
+            try:
+                response = await original(route, **kwargs)
+                status = "ok"
+                return response
+            except discord.HTTPException as e:
+                status = str(e.status)
+                raise
+            finally:
+                DISCORD_REQUESTS.inc(route.method, route.path, status)
+
+        self.bot.http.request = request
+
+    async def _watch_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            LOOP_LAG.observe(max(0.0, loop.time() - started - LOOP_LAG_INTERVAL))
+
+    async def _export_file(self):
+        while True:
+            try:
+                await asyncio.to_thread(_write_atomic, METRICS_FILE, registry.render())
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(METRICS_INTERVAL)
+
+    async def _start_server(self):
+        from aiohttp import web
+
+        async def handle(request):
+            return web.Response(
+                body=registry.render().encode(),
+                headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+            )
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, METRICS_HOST, METRICS_PORT).start()
+
+    @commands.hybrid_command(name="metrics", description="（管理者のみ）コマンドごとの処理時間と内部の統計を表示します")
+    async def metrics(self, ctx):
+        try:
+            if ctx.author.id != ADMIN_ID:
+                embed = discord.Embed(
+                    description="このコマンドは管理者のみ実行できます",
+                    color=0xED4245
+                )
+                await ctx.send(embed=embed, ephemeral=True)
+                return
+
+            # 合計時間の長い順に、どのコマンドが時間を使っているかを並べる
+            lines = ["```", f"{'command':<12} {'count':>5} {'avg':>8} {'p95':>7} {'db/call':>7}"]
+            db_calls = {}
+            for (command, _), count in DB_CALLS.snapshot().items():
+                db_calls[command] = db_calls.get(command, 0) + count
+            commands_by_time = sorted(
+                COMMAND_SECONDS.snapshot().items(), key=lambda item: item[1][1], reverse=True
+            )
+            for (command,), (_, total, count) in commands_by_time:
+                p95 = COMMAND_SECONDS.quantile(0.95, command)
+                lines.append(
+                    f"{command:<12} {count:>5} {total / count:>7.2f}s {p95:>6g}s {db_calls.get(command, 0) / count:>7.1f}"
+                )
+            lines.append("```")
+
+            ratios = _cache_values("hit_ratio")
+            lag = LOOP_LAG.quantile(0.99)
+            requests = sum(DISCORD_REQUESTS.snapshot().values())
+            embed = discord.Embed(
+                title="📈 メトリクス",
+                description="\n".join(lines),
+                color=0x1E90FF
+            )
+            embed.add_field(
+                name="キャッシュヒット率",
+                value="\n".join(f"{name}: {ratio:.0%}" for (name,), ratio in ratios.items()),
+                inline=True
+            )
+            embed.add_field(
+                name="イベントループ遅延 (p99)",
+                value=f"{lag:g}s 以下" if lag is not None else "-",
+                inline=True
+            )
+            embed.add_field(name="Discord API 呼び出し", value=f"{requests} 回", inline=True)
+
+            # プリペアド文（PostgreSQL のみ）: PREPARE を省けた割合と、generic plan で実行された割合
+            statements = {}
+            for (_, kind), count in DB_STATEMENTS.snapshot().items():
+                statements[kind] = statements.get(kind, 0) + count
+            if statements.get("execute"):
+                plans = {}
+                for (_, plan), count in DB_PLANS.snapshot().items():
+                    plans[plan] = plans.get(plan, 0) + count
+                planned = plans.get("generic", 0) + plans.get("custom", 0)
+                prepared = [f"再利用率: {1 - statements.get('prepare', 0) / statements['execute']:.0%}"]
+                if planned:
+                    prepared.append(f"generic plan: {plans.get('generic', 0) / planned:.0%}")
+                embed.add_field(
+                    name="プリペアド文",
+                    value="\n".join(prepared),
+                    inline=True
+                )
+
+            file = discord.File(BytesIO(registry.render().encode()), filename="metrics.prom")
+            await ctx.send(embed=embed, file=file, ephemeral=True)
+
+        except Exception:
+            traceback.print_exc()
+            embed = discord.Embed(
+                description="エラーが発生しました",
+                color=0xED4245
+            )
+            await ctx.send(embed=embed)
+
+
+def _write_atomic(path: str, text: str):
+    """
+    書き出し途中のファイルを読まれないよう、一時ファイルに書いてから置き換える
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+async def setup(bot):
+    await bot.add_cog(MonitoringCog(bot))
@@ -0,0 +1,120 @@
+import os
+from discord.ext import commands
+from cache import LRUCache
+
+# 表示名キャッシュの件数と、見つからなかったIDを再取得しない秒数
+NAME_CACHE_SIZE = int(os.getenv('NAME_CACHE_SIZE', 10000))
+NAME_MISS_TTL = float(os.getenv('NAME_MISS_TTL', 600))
+
+# query_members の user_ids に一度に渡せる上限
+MEMBER_CHUNK_SIZE = 100
+
+
+class NameResolver:
+    """
+    Discord ID から表示名を引くサービス。
+    解決した表示名は (guild_id, user_id) ごとにキャッシュし、
+    メンバーキャッシュにいない人はまとめてゲートウェイから取得する。
+    """
+
+    def __init__(self, maxsize: int = NAME_CACHE_SIZE, miss_ttl: float = NAME_MISS_TTL):
+        self._names = LRUCache(maxsize)
+        # 退出済みなどで見つからなかったID（一定時間は再取得しない）
+        self._missing = LRUCache(maxsize, miss_ttl)
+
+    def get(self, guild, user_id) -> str:
+        """
+        キャッシュ済みまたはメンバーキャッシュにある表示名を返す（通信しない）。
+        見つからなければ ID をそのまま返す。
+        """
+        key = (guild.id, int(user_id))
+        name = self._names.get(key)
+        if name is not None:
+            return name
+        member = guild.get_member(int(user_id))
+        if member is None:
+            return str(user_id)
+        self._names.set(key, member.display_name)
+        return member.display_name
+
+    async def resolve(self, guild, user_ids) -> dict:
+        """
+        複数の ID の表示名をまとめて解決し、{渡された ID: 表示名} で返す。
+        メンバーキャッシュにいない人は 100 人ずつ1回のリクエストで取得する。
+        """
+        names = {}
+        missing = {}
+        for uid in user_ids:
+            key = (guild.id, int(uid))
+            name = self._names.get(key)
+            if name is None:
+                member = guild.get_member(int(uid))
+                if member is not None:
+                    name = member.display_name
+                    self._names.set(key, name)
+            if name is not None:
+                names[uid] = name
+            elif self._missing.get(key) is not None:
+                names[uid] = str(uid)
+            else:
+                missing.setdefault(int(uid), []).append(uid)
+
+        ids = list(missing)
+        for start in range(0, len(ids), MEMBER_CHUNK_SIZE):
+            chunk = ids[start:start + MEMBER_CHUNK_SIZE]
+            members = await guild.query_members(user_ids=chunk, limit=len(chunk), cache=True)
+            for member in members:
+                self._names.set((guild.id, member.id), member.display_name)
+                for uid in missing.pop(member.id, []):
+                    names[uid] = member.display_name
+
+        for user_id, uids in missing.items():
+            self._missing.set((guild.id, user_id), True)
+            for uid in uids:
+                names[uid] = str(uid)
+        return names
+
+    def invalidate(self, guild_id: int, user_id: int):
+        """
+        表示名が変わった（またはサーバーに出入りした）人のキャッシュを消す
+        """
+        self._names.invalidate((guild_id, user_id))
+        self._missing.invalidate((guild_id, user_id))
+
+    def stats(self) -> dict:
+        return self._names.stats()
+
+
+# Bot 全体で共有する表示名リゾルバ
+resolver = NameResolver()
+
+
+class NamesCog(commands.Cog):
+    """
+    メンバー更新イベントを受けて表示名キャッシュを無効化するCog
+    """
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if before.display_name != after.display_name:
+            resolver.invalidate(after.guild.id, after.id)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        resolver.invalidate(member.guild.id, member.id)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        resolver.invalidate(member.guild.id, member.id)
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before, after):
+        # ニックネームのない人はユーザー名の変更で表示名が変わる
+        for guild in after.mutual_guilds:
+            resolver.invalidate(guild.id, after.id)
+
+
+async def setup(bot):
+    await bot.add_cog(NamesCog(bot))
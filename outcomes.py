@@ -0,0 +1,94 @@
+"""
+試合パターンとゲーム結果の圧縮表現。
+終了した試合は matches に「並び順（entry_order）・パターンセットID・結果のビットマスク」だけを残す。
+ビット i が立っていれば第 i+1 試合は Aチーム（team1）の勝ち。
+"""
+from itertools import combinations
+
+# 手動定義の試合パターン（インデックスベース）
+match_patterns = [
+    {"team1": [0, 1, 2, 3], "team2": [4, 5, 6, 7]},
+    {"team1": [0, 2, 4, 6], "team2": [1, 3, 5, 7]},
+    {"team1": [0, 3, 4, 7], "team2": [1, 2, 5, 6]},
+    {"team1": [0, 1, 6, 7], "team2": [2, 3, 4, 5]},
+    {"team1": [0, 2, 5, 7], "team2": [1, 3, 4, 6]},
+    {"team1": [0, 1, 4, 5], "team2": [2, 3, 6, 7]},
+    {"team1": [0, 3, 5, 6], "team2": [1, 2, 4, 7]},
+    {"team1": [0, 1, 2, 4], "team2": [3, 5, 6, 7]},
+    {"team1": [0, 3, 4, 6], "team2": [1, 2, 5, 7]},
+    {"team1": [0, 1, 3, 7], "team2": [2, 4, 5, 6]},
+    {"team1": [0, 2, 3, 5], "team2": [1, 4, 6, 7]},
+    {"team1": [0, 2, 6, 7], "team2": [1, 3, 4, 5]},
+    {"team1": [0, 1, 5, 6], "team2": [2, 3, 4, 7]},
+    {"team1": [0, 4, 5, 7], "team2": [1, 2, 3, 6]},
+]
+
+# パターンセットID -> 試合パターン。ID は DB に保存されるので、追加は新しい ID でのみ行うこと
+PATTERN_SETS = {
+    0: match_patterns,
+}
+
+
+def pattern_set_id(patterns: list) -> int:
+    """
+    定義済みのパターンセットならその ID、/match balance などで作った独自のパターンなら None
+    """
+    for set_id, known in PATTERN_SETS.items():
+        if patterns == known:
+            return set_id
+    return None
+
+
+def resolve_patterns(pattern_set: int, patterns: list) -> list:
+    """
+    保存されたパターンセットID（独自のパターンなら保存した patterns）から試合パターンを返す
+    """
+    if pattern_set is not None:
+        return PATTERN_SETS[pattern_set]
+    return patterns
+
+
+def outcome_mask(games: list) -> int:
+    """
+    ゲーム結果（Aチーム勝利なら True）のリストをビットマスクにする
+    """
+    mask = 0
+    for i, team1_won in enumerate(games):
+        if team1_won:
+            mask |= 1 << i
+    return mask
+
+
+def unpack_mask(mask: int, games: int) -> list:
+    """
+    outcome_mask の逆変換
+    """
+    return [bool(mask >> i & 1) for i in range(games)]
+
+
+def pair_deltas(entry_order: list, patterns: list, mask: int, sign: int = 1) -> list:
+    """
+    1試合分のペア統計の増分を返す（sign=-1 で取り消し用の減分）。
+    各行は (player_a, player_b, 同じチームの試合数, 同じチームで勝った数, 敵同士の試合数, a が勝った数)
+    で、player_a < player_b。
+    """
+    deltas = {}
+    ids = [int(uid) for uid in entry_order]
+    for i, pattern in enumerate(patterns):
+        team1_won = bool(mask >> i & 1)
+        side = {}
+        for idx in pattern["team1"]:
+            side[idx] = team1_won
+        for idx in pattern["team2"]:
+            side[idx] = not team1_won
+        for x, y in combinations(sorted(side), 2):
+            a, b = sorted((ids[x], ids[y]))
+            won_a = side[x] if ids[x] == a else side[y]
+            row = deltas.setdefault((a, b), [0, 0, 0, 0])
+            if side[x] == side[y]:
+                row[0] += 1
+                row[1] += won_a
+            else:
+                row[2] += 1
+                row[3] += won_a
+    return [(a, b) + tuple(sign * v for v in row) for (a, b), row in deltas.items()]
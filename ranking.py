@@ -0,0 +1,83 @@
+import threading
+from bisect import bisect_left, insort
+
+
+def conservative_rating(mu, sigma) -> float:
+    """
+    表示・順位付けに使う保守的レート (μ - 3σ)
+    """
+    return float(mu) - 3 * float(sigma)
+
+
+class RankingIndex:
+    """
+    保守的レートの降順に並べたプレイヤー索引。
+    (-レート, id) のソート済みリストを持ち、順位の検索は二分探索で O(log n)。
+    試合後は対象プレイヤーの分だけ差し替える（リストの削除と挿入で1人あたり O(n) かかるが、
+    n はサーバーの登録人数で、要素の移動だけなので1試合8人分なら十分速い）。
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._keys = []    # (-保守的レート, id) の昇順 = レートの降順
+        self._by_id = {}   # id -> 現在のキー
+        self._lock = threading.Lock()
+
+    def load(self, players: list):
+        """
+        全プレイヤーの行から索引を作り直す
+        """
+        keys = {p['id']: (-conservative_rating(p['mu'], p['sigma']), p['id']) for p in players}
+        with self._lock:
+            self._by_id = keys
+            self._keys = sorted(keys.values())
+            self.loaded = True
+
+    def update(self, players: list):
+        """
+        更新された players の行だけを索引に反映する
+        """
+        with self._lock:
+            for p in players:
+                self._discard(p['id'])
+                key = (-conservative_rating(p['mu'], p['sigma']), p['id'])
+                insort(self._keys, key)
+                self._by_id[p['id']] = key
+
+    def invalidate(self):
+        """
+        索引を破棄する（次回利用時に DB から読み直す）
+        """
+        with self._lock:
+            self.loaded = False
+            self._keys = []
+            self._by_id = {}
+
+    def page(self, page: int, per_page: int) -> list:
+        """
+        page ページ目（1始まり）の (順位, id, 保守的レート) のリストを返す
+        """
+        start = (page - 1) * per_page
+        with self._lock:
+            keys = self._keys[start:start + per_page]
+        return [(start + i + 1, pid, -neg) for i, (neg, pid) in enumerate(keys)]
+
+    def rank_of(self, player_id: int):
+        """
+        プレイヤーの (順位, 保守的レート) を返す。索引になければ None
+        """
+        with self._lock:
+            key = self._by_id.get(player_id)
+            if key is None:
+                return None
+            return bisect_left(self._keys, key) + 1, -key[0]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _discard(self, player_id):
+        key = self._by_id.pop(player_id, None)
+        if key is not None:
+            i = bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
@@ -1,6 +1,7 @@
 import discord
 from discord.ext import commands
-from utils import get_player, upsert_player
+from async_utils import get_player, upsert_player
+from config import TS_MU, TS_SIGMA, ADMIN_ID
 import traceback
 
 class RegisterCog(commands.Cog):
@@ -11,6 +12,7 @@ class RegisterCog(commands.Cog):
         self.bot = bot
 
 
+    @commands.guild_only()
     @commands.hybrid_command(name="register", description="自分のプレイヤー情報を登録します(/registerのみ入力)")
     async def register(self, ctx, member: discord.Member = None):
         try:
@@ -21,7 +23,7 @@ class RegisterCog(commands.Cog):
             target_id = target.id
 
             # 他者を登録しようとしている → 管理者かチェック
-            if member and ctx.author.id != 970133347722485820:  # ← あなたのDiscordユーザーIDに置き換えてください
+            if member and ctx.author.id != ADMIN_ID:  # ← .env の ADMIN_ID で変更できます
                 embed = discord.Embed(
                         description="他のプレイヤーを登録できるのは管理者のみです",
                         color=0xED4245
@@ -29,7 +31,7 @@ class RegisterCog(commands.Cog):
                 await ctx.send(embed=embed)
                 return
 
-            player = get_player(target_id)
+            player = await get_player(ctx.guild.id, target_id)
             if player:
                 embed = discord.Embed(
                         description=f"{target.display_name} は既に登録済みです。μ={player['mu']:.2f}, σ={player['sigma']:.2f}",
@@ -38,16 +40,17 @@ class RegisterCog(commands.Cog):
                 await ctx.send(embed=embed)
                 return
 
-            upsert_player(
+            await upsert_player(
+                guild_id=ctx.guild.id,
                 player_id=target_id,
-                mu=1500.0,
-                sigma=50.0,
+                mu=TS_MU,
+                sigma=TS_SIGMA,
                 games=0,
                 wins=0,
                 last_match=None
             )
             embed = discord.Embed(
-                        description=f"{target.display_name} の登録が完了しました！μ=1500.0, σ=50.0",
+                        description=f"{target.display_name} の登録が完了しました！μ={TS_MU}, σ={TS_SIGMA}",
                         color=0x57F287
                     )
             await ctx.send(embed=embed)
@@ -0,0 +1,255 @@
+"""
+match_history を match_id 順に再生し、指定した TrueSkill パラメータで全員のレートを計算し直す。
+レートはサーバーごとに別々なので、(サーバー, プレイヤー) の組ごとに計算する。
+
+    python replay.py --beta 8 --tau 0.5            # 差分レポートのみ
+    python replay.py --beta 8 --tau 0.5 --write    # 結果を players / match_history に書き戻す
+
+書き戻しは Bot を止めた状態で行うこと（起動中の Bot のキャッシュには反映されない）。
+サーバーサイドカーソルと COPY を使うので、PostgreSQL のバックエンド専用。
+"""
+import argparse
+import io
+import time
+import numpy as np
+from trueskill import TrueSkill
+from config import TS_MU, TS_SIGMA, TS_BETA, TS_TAU, TS_DRAW_PROBABILITY
+from storage.postgres import get_connection
+
+# サーバーサイドカーソルで一度に受け取る行数
+FETCH_SIZE = 10000
+
+
+def stream_matches(conn, fetch_size: int = FETCH_SIZE):
+    """
+    match_history を match_id 順に読み、試合ごとに
+    (match_id, guild_id, 行IDの配列, player_id の配列, 順位の配列) を返すジェネレータ。
+    サーバーサイドカーソルで少しずつ受け取るので、全件をメモリに載せない。
+    """
+    with conn.cursor(name="replay_stream") as cur:
+        cur.itersize = fetch_size
+        cur.execute(
+            """
+            SELECT match_id, guild_id, id, player_id, rank
+            FROM match_history
+            ORDER BY match_id, id
+            """
+        )
+        current = None
+        guild = None
+        rows = []
+        for match_id, guild_id, row_id, player_id, rank in cur:
+            if match_id != current and rows:
+                yield current, guild, *map(np.array, zip(*rows))
+                rows = []
+            current = match_id
+            guild = guild_id
+            rows.append((row_id, player_id, rank))
+        if rows:
+            yield current, guild, *map(np.array, zip(*rows))
+
+
+class ReplayEngine:
+    """
+    全プレイヤーの μ/σ を NumPy 配列で持ち、試合ごとに ts.rate を適用していく。
+    (guild_id, player_id) の組を配列の添字に割り当て、試合の8人分をまとめて読み書きする。
+    """
+
+    def __init__(self, env: TrueSkill, capacity: int = 1024):
+        self.env = env
+        self.slots = {}  # (guild_id, player_id) -> 配列の添字
+        self.mu = np.empty(capacity)
+        self.sigma = np.empty(capacity)
+        # 書き戻し用: match_history の行IDと試合前後の μ/σ
+        self._rows = []
+
+    def _indices(self, guild_id: int, player_ids) -> np.ndarray:
+        idx = np.empty(len(player_ids), dtype=np.int64)
+        for i, pid in enumerate(player_ids.tolist()):
+            slot = self.slots.get((guild_id, pid))
+            if slot is None:
+                slot = self.slots[(guild_id, pid)] = len(self.slots)
+                if slot >= len(self.mu):
+                    self.mu = np.resize(self.mu, len(self.mu) * 2)
+                    self.sigma = np.resize(self.sigma, len(self.sigma) * 2)
+                self.mu[slot] = self.env.mu
+                self.sigma[slot] = self.env.sigma
+            idx[i] = slot
+        return idx
+
+    def rate_match(self, guild_id: int, row_ids, player_ids, ranks):
+        """
+        1試合分を再計算して状態配列を更新する。
+        Bot と同じく、保存値は小数第2位に丸めたものを次の試合の事前値として使う。
+        """
+        idx = self._indices(guild_id, player_ids)
+        mu_before = self.mu[idx]
+        sigma_before = self.sigma[idx]
+        rated = self.env.rate(
+            [(self.env.create_rating(m, s),) for m, s in zip(mu_before.tolist(), sigma_before.tolist())],
+            ranks=ranks.tolist()
+        )
+        mu_after = np.round([r[0].mu for r in rated], 2)
+        sigma_after = np.round([r[0].sigma for r in rated], 2)
+        self.mu[idx] = mu_after
+        self.sigma[idx] = sigma_after
+        self._rows.append(np.column_stack((row_ids, mu_before, sigma_before, mu_after, sigma_after)))
+
+    def history_rows(self) -> np.ndarray:
+        """
+        再計算した match_history の (行ID, μ前, σ前, μ後, σ後) を1つの配列で返す
+        """
+        if not self._rows:
+            return np.empty((0, 5))
+        return np.concatenate(self._rows)
+
+    def player_states(self) -> tuple:
+        """
+        (guild_id の配列, player_id の配列, μ の配列, σ の配列) を返す
+        """
+        keys = np.array(list(self.slots.keys()), dtype=np.int64).reshape(-1, 2)
+        n = len(keys)
+        return keys[:, 0].copy(), keys[:, 1].copy(), self.mu[:n].copy(), self.sigma[:n].copy()
+
+
+def replay(conn, env: TrueSkill) -> ReplayEngine:
+    """
+    全試合を再生した ReplayEngine を返す
+    """
+    engine = ReplayEngine(env)
+    for _, guild_id, row_ids, player_ids, ranks in stream_matches(conn):
+        engine.rate_match(guild_id, row_ids, player_ids, ranks)
+    return engine
+
+
+def diff_report(conn, engine: ReplayEngine, top: int = 20) -> str:
+    """
+    現在の players と再計算結果の保守的レートの差をまとめた文字列を返す
+    """
+    guilds, ids, mu, sigma = engine.player_states()
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT p.guild_id, p.id, p.mu, p.sigma
+            FROM players p
+            JOIN unnest(%s::BIGINT[], %s::BIGINT[]) AS k (guild_id, id)
+              ON p.guild_id = k.guild_id AND p.id = k.id
+            """,
+            (guilds.tolist(), ids.tolist())
+        )
+        current = {(gid, pid): float(m) - 3 * float(s) for gid, pid, m, s in cur.fetchall()}
+    replayed = mu - 3 * sigma
+    before = np.array([current.get(key, np.nan) for key in zip(guilds.tolist(), ids.tolist())])
+    delta = replayed - before
+    order = np.argsort(-np.abs(np.nan_to_num(delta)))
+
+    lines = [
+        f"players: {len(ids)}  history rows: {len(engine.history_rows())}",
+        f"mean |Δ|: {np.nanmean(np.abs(delta)):.2f}  max |Δ|: {np.nanmax(np.abs(delta)):.2f}" if len(ids) else "",
+        f"{'guild_id':>20} {'player_id':>20} {'current':>9} {'replayed':>9} {'Δ':>8}",
+    ]
+    for i in order[:top]:
+        lines.append(
+            f"{guilds[i]:>20} {ids[i]:>20} {before[i]:>9.1f} {replayed[i]:>9.1f} {delta[i]:>+8.1f}"
+        )
+    return "\n".join(lines)
+
+
+def _copy_rows(cur, table: str, columns: str, rows: np.ndarray, fmt: str):
+    buf = io.StringIO()
+    np.savetxt(buf, rows, fmt=fmt, delimiter="\t")
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN", buf)
+
+
+def write_back(conn, engine: ReplayEngine):
+    """
+    再計算結果を1トランザクションで書き戻す。
+    COPY で一時テーブルに流し込み、UPDATE ... FROM で一括更新する。
+    試合に出ていないプレイヤーは env の初期値に戻す。
+    古いレートで作ったスナップショットは消す（次の試合から取り直される）。
+    """
+    guilds, ids, mu, sigma = engine.player_states()
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TEMP TABLE replay_history (
+                id BIGINT PRIMARY KEY,
+                mu_before DOUBLE PRECISION, sigma_before DOUBLE PRECISION,
+                mu_after DOUBLE PRECISION, sigma_after DOUBLE PRECISION
+            ) ON COMMIT DROP;
+            CREATE TEMP TABLE replay_players (
+                guild_id BIGINT, id BIGINT, mu DOUBLE PRECISION, sigma DOUBLE PRECISION,
+                PRIMARY KEY (guild_id, id)
+            ) ON COMMIT DROP;
+            """
+        )
+        _copy_rows(cur, "replay_history", "id, mu_before, sigma_before, mu_after, sigma_after",
+                   engine.history_rows(), ["%d", "%.2f", "%.2f", "%.2f", "%.2f"])
+        # column_stack だと snowflake が float64 になって桁が落ちるので、
+        # ID 列は int64 のまま構造化配列に詰める
+        players = np.empty(len(ids), dtype=[("guild_id", np.int64), ("id", np.int64),
+                                            ("mu", float), ("sigma", float)])
+        players["guild_id"], players["id"], players["mu"], players["sigma"] = guilds, ids, mu, sigma
+        _copy_rows(cur, "replay_players", "guild_id, id, mu, sigma",
+                   players, ["%d", "%d", "%.2f", "%.2f"])
+        cur.execute(
+            """
+            UPDATE match_history h SET
+                mu_before = r.mu_before, sigma_before = r.sigma_before,
+                mu_after = r.mu_after, sigma_after = r.sigma_after
+            FROM replay_history r
+            WHERE h.id = r.id
+            """
+        )
+        cur.execute(
+            """
+            UPDATE players p SET mu = r.mu, sigma = r.sigma, version = p.version + 1
+            FROM replay_players r
+            WHERE p.guild_id = r.guild_id AND p.id = r.id
+            """
+        )
+        if cur.rowcount != len(ids):
+            # 一致しないまま commit すると、一部のプレイヤーだけ古いレートが残る
+            raise RuntimeError(
+                f"players の更新件数が再計算した人数と一致しません: {cur.rowcount} / {len(ids)}"
+            )
+        # 試合に出ていないプレイヤーは再計算で使った初期値に揃える（--mu / --sigma を変えたときに尺度が混ざらないように）
+        mu0, sigma0 = round(engine.env.mu, 2), round(engine.env.sigma, 2)
+        cur.execute(
+            """
+            UPDATE players p SET mu = %s, sigma = %s, version = p.version + 1
+            WHERE NOT EXISTS (SELECT 1 FROM replay_players r WHERE r.guild_id = p.guild_id AND r.id = p.id)
+              AND (p.mu, p.sigma) IS DISTINCT FROM (%s, %s)
+            """,
+            (mu0, sigma0, mu0, sigma0)
+        )
+        cur.execute("DELETE FROM rating_snapshots")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="match_history からレートを再計算する")
+    parser.add_argument("--mu", type=float, default=TS_MU)
+    parser.add_argument("--sigma", type=float, default=TS_SIGMA)
+    parser.add_argument("--beta", type=float, default=TS_BETA)
+    parser.add_argument("--tau", type=float, default=TS_TAU)
+    parser.add_argument("--draw-probability", type=float, default=TS_DRAW_PROBABILITY)
+    parser.add_argument("--top", type=int, default=20, help="差分レポートに出す人数")
+    parser.add_argument("--write", action="store_true", help="結果を DB に書き戻す")
+    args = parser.parse_args()
+
+    env = TrueSkill(mu=args.mu, sigma=args.sigma, beta=args.beta, tau=args.tau,
+                    draw_probability=args.draw_probability)
+    started = time.perf_counter()
+    with get_connection() as conn:
+        engine = replay(conn, env)
+        elapsed = time.perf_counter() - started
+        print(diff_report(conn, engine, args.top))
+        print(f"replayed in {elapsed:.2f}s")
+        if args.write:
+            write_back(conn, engine)
+            print("written back")
+
+
+if __name__ == "__main__":
+    main()
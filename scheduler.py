@@ -0,0 +1,146 @@
+import os
+import time
+import asyncio
+import functools
+from collections import deque
+import discord
+
+# チャンネルごとのメッセージ編集の上限（EDIT_RATE 回 / EDIT_PER 秒）
+EDIT_RATE = int(os.getenv('EDIT_RATE', 5))
+EDIT_PER = float(os.getenv('EDIT_PER', 5.0))
+
+
+class _PendingEdit:
+    __slots__ = ("message", "kwargs", "waiters")
+
+    def __init__(self, message, kwargs, waiter):
+        self.message = message
+        self.kwargs = kwargs
+        self.waiters = [waiter]
+
+
+def _resolve(waiters, error=None):
+    for waiter in waiters:
+        if waiter.done():
+            continue
+        if error is None:
+            waiter.set_result(None)
+        else:
+            waiter.set_exception(error)
+
+
+class EditScheduler:
+    """
+    メッセージ編集の送信を管理するスケジューラ。
+    - 送信待ちの編集が同じメッセージに重なったら、内容をまとめて1回の編集にする
+    - チャンネルごとのトークンバケットで、レート制限に当たらない間隔で送る
+    - ボタン操作への応答として編集できる場合は、インタラクション応答1回で済ませる
+    """
+
+    def __init__(self, rate: int = EDIT_RATE, per: float = EDIT_PER):
+        self.rate = rate
+        self.per = per
+        self.sent = 0        # 実際に送った編集の回数
+        self.coalesced = 0   # まとめられて送らずに済んだ編集の回数
+        self._pending = {}   # message.id -> _PendingEdit
+        self._queues = {}    # channel.id -> 送信待ちの message.id
+        self._workers = {}   # channel.id -> 送信タスク
+        self._buckets = {}   # channel.id -> [残りトークン, 最終補充時刻]
+
+    async def edit(self, message, interaction=None, **kwargs):
+        """
+        メッセージの編集を予約し、反映されるまで待つ。
+        interaction が未応答なら、その応答として即座に編集する。
+        """
+        pending = None
+        if interaction is not None and not interaction.response.is_done():
+            # 送信待ちの編集があれば、それも含めて応答1回で送る
+            pending = self._pending.pop(message.id, None)
+            if pending is not None:
+                kwargs = {**pending.kwargs, **kwargs}
+                self.coalesced += 1
+            try:
+                await interaction.response.edit_message(**kwargs)
+            except discord.HTTPException:
+                pass  # 応答期限切れなどは通常の編集として送り直す
+            else:
+                self.sent += 1
+                if pending is not None:
+                    _resolve(pending.waiters)
+                return
+
+        waiter = asyncio.get_running_loop().create_future()
+        queued = self._pending.get(message.id)
+        if queued is not None:
+            queued.kwargs.update(kwargs)
+            queued.waiters.append(waiter)
+            self.coalesced += 1
+        else:
+            queued = self._pending[message.id] = _PendingEdit(message, dict(kwargs), waiter)
+            channel_id = message.channel.id
+            self._queues.setdefault(channel_id, deque()).append(message.id)
+            if channel_id not in self._workers:
+                self._workers[channel_id] = asyncio.create_task(self._drain(channel_id))
+        if pending is not None:
+            queued.waiters.extend(pending.waiters)
+        await waiter
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "coalesced": self.coalesced, "pending": len(self._pending)}
+
+    async def _drain(self, channel_id):
+        """
+        チャンネルの送信待ちを順に送る（チャンネルごとに1タスク）
+        """
+        queue = self._queues[channel_id]
+        try:
+            while queue:
+                await self._take_token(channel_id)
+                pending = self._pending.pop(queue.popleft(), None)
+                if pending is None:
+                    continue  # インタラクション応答で送信済み
+                try:
+                    await self._send(pending)
+                except Exception as e:
+                    _resolve(pending.waiters, e)
+                else:
+                    _resolve(pending.waiters)
+        finally:
+            self._workers.pop(channel_id, None)
+            if not queue:
+                self._queues.pop(channel_id, None)
+
+    async def _send(self, pending: _PendingEdit):
+        message = pending.message
+        edit = message.edit
+        while True:
+            try:
+                await edit(**pending.kwargs)
+                self.sent += 1
+                return
+            except discord.RateLimited as e:
+                await asyncio.sleep(e.retry_after)
+            except discord.HTTPException:
+                # インタラクションの応答で送ったメッセージは、期限切れや応答済みだと webhook 経由で編集できない。
+                # その場合は Bot としてチャンネルのメッセージを直接編集する
+                if not isinstance(message, discord.InteractionMessage) or isinstance(edit, functools.partial):
+                    raise
+                edit = functools.partial(discord.Message.edit, message)
+
+    async def _take_token(self, channel_id):
+        """
+        トークンバケットから1つ取り出す。空なら補充されるまで待つ
+        """
+        bucket = self._buckets.setdefault(channel_id, [float(self.rate), time.monotonic()])
+        while True:
+            now = time.monotonic()
+            bucket[0] = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate / self.per)
+            bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return
+            await asyncio.sleep((1 - bucket[0]) * self.per / self.rate)
+
+
+# Bot 全体で共有するスケジューラ
+edit_scheduler = EditScheduler()
@@ -0,0 +1,448 @@
+"""
+DB スキーマのバージョン管理。起動時に migrate() を呼ぶと、未適用のマイグレーションを順に適用する。
+
+    python schema.py                      # マイグレーションを適用
+    python schema.py --explain            # よく使うクエリの実行計画を表示
+    python schema.py --explain --no-seqscan
+        # シーケンシャルスキャンを禁止して、本番規模で使われる索引を確認する
+"""
+import os
+import argparse
+from datetime import datetime
+from psycopg2.extras import Json
+from outcomes import PATTERN_SETS
+from storage.base import match_pair_deltas
+from storage.postgres import get_connection, STATEMENTS
+from config import LEGACY_GUILD_ID, HISTORY_CHART_POINTS
+
+# 複数プロセスが同時に起動してもマイグレーションが二重に走らないようにするロックID
+SCHEMA_LOCK_ID = 4_404_001
+# 起動時に実行計画を確認してシーケンシャルスキャンを報告するか
+SCHEMA_EXPLAIN = os.getenv('SCHEMA_EXPLAIN', '0') == '1'
+
+
+def _create_matches(cur):
+    """
+    matches を作成する。新しく作ったときは既存の match_history から補完し、
+    match_id のシーケンスを既存の最大値の次から始める。
+    """
+    cur.execute("SELECT to_regclass('matches') IS NULL")
+    created = cur.fetchone()[0]
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS matches (
+            match_id BIGSERIAL PRIMARY KEY,
+            guild_id BIGINT,
+            channel_id BIGINT,
+            host_id BIGINT,
+            status TEXT NOT NULL DEFAULT 'running',
+            started_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP,
+            ended_at TIMESTAMP
+        );
+        ALTER TABLE matches ADD COLUMN IF NOT EXISTS entry_order BIGINT[];
+        ALTER TABLE matches ADD COLUMN IF NOT EXISTS patterns JSONB;
+        CREATE INDEX IF NOT EXISTS matches_finished_idx
+            ON matches (match_id DESC) WHERE status = 'finished';
+        CREATE INDEX IF NOT EXISTS matches_running_idx
+            ON matches (channel_id) WHERE status = 'running';
+        """
+    )
+    if created:
+        cur.execute(
+            """
+            INSERT INTO matches (match_id, status, started_at, ended_at)
+            SELECT match_id, 'finished', MIN(timestamp), MAX(timestamp)
+            FROM match_history
+            GROUP BY match_id;
+            SELECT setval(
+                pg_get_serial_sequence('matches', 'match_id'),
+                COALESCE((SELECT MAX(match_id) FROM matches), 0) + 1,
+                false
+            );
+            """
+        )
+
+
+def _compact_results(cur):
+    """
+    終了した試合のゲーム結果を matches.outcome_mask に移して match_games から消し、
+    定義済みのパターンは ID に置き換える。既存の試合から pair_stats を作る。
+    """
+    cur.execute(
+        """
+        ALTER TABLE matches ADD COLUMN IF NOT EXISTS outcome_mask INTEGER;
+        ALTER TABLE matches ADD COLUMN IF NOT EXISTS pattern_set SMALLINT;
+        CREATE TABLE IF NOT EXISTS pair_stats (
+            player_a BIGINT NOT NULL,
+            player_b BIGINT NOT NULL,
+            together_games INTEGER NOT NULL DEFAULT 0,
+            together_wins INTEGER NOT NULL DEFAULT 0,
+            versus_games INTEGER NOT NULL DEFAULT 0,
+            a_wins INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (player_a, player_b),
+            CHECK (player_a < player_b)
+        );
+        CREATE INDEX IF NOT EXISTS pair_stats_player_b_idx ON pair_stats (player_b);
+        UPDATE matches m SET outcome_mask = g.mask
+        FROM (
+            SELECT match_id, COALESCE(SUM(1 << game_no) FILTER (WHERE team1_won), 0) AS mask
+            FROM match_games
+            GROUP BY match_id
+        ) g
+        WHERE m.match_id = g.match_id AND m.status = 'finished';
+        DELETE FROM match_games g USING matches m
+        WHERE g.match_id = m.match_id AND m.status <> 'running';
+        """
+    )
+    for set_id, patterns in PATTERN_SETS.items():
+        cur.execute(
+            "UPDATE matches SET pattern_set = %s, patterns = NULL WHERE patterns = %s",
+            (set_id, Json(patterns))
+        )
+    cur.execute(
+        """
+        SELECT entry_order, pattern_set, patterns, outcome_mask
+        FROM matches
+        WHERE status = 'finished' AND outcome_mask IS NOT NULL
+        """
+    )
+    # この時点の pair_stats にはまだ guild_id がないので、プリペアド文（v9 以降の形）は使わない
+    cur.execute(
+        """
+        INSERT INTO pair_stats (player_a, player_b, together_games, together_wins, versus_games, a_wins)
+        SELECT * FROM unnest(
+            %s::BIGINT[], %s::BIGINT[], %s::INTEGER[], %s::INTEGER[], %s::INTEGER[], %s::INTEGER[]
+        )
+        """,
+        [list(col) for col in zip(*match_pair_deltas(cur.fetchall()))] or [[]] * 6
+    )
+
+
+def legacy_guild_id(cur) -> int:
+    """
+    サーバーごとに分ける前のデータをまとめて割り当てるサーバー。
+    LEGACY_GUILD_ID で指定がなければ、試合が最も多いサーバー（試合がなければ 0）
+    """
+    if LEGACY_GUILD_ID is not None:
+        return LEGACY_GUILD_ID
+    cur.execute(
+        """
+        SELECT guild_id FROM matches
+        WHERE guild_id IS NOT NULL
+        GROUP BY guild_id
+        ORDER BY COUNT(*) DESC
+        LIMIT 1
+        """
+    )
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def _partition_by_guild(cur):
+    """
+    players / match_history / pair_stats / スナップショット / シーズンに guild_id を足し、
+    既存の行は legacy_guild_id のサーバーのものにする（それまでのレートは全サーバー共通だったため、
+    他のサーバーで行われた試合も同じサーバーに寄せる）。索引はすべて guild_id を先頭にする。
+    スナップショットは作り直せるので消す。
+    """
+    legacy = legacy_guild_id(cur)
+    cur.execute("UPDATE matches SET guild_id = %s WHERE guild_id IS DISTINCT FROM %s", (legacy, legacy))
+    if cur.rowcount:
+        print(f"schema: 既存の {cur.rowcount} 試合をサーバー {legacy} に割り当てました")
+    # 定数の DEFAULT 付きの列追加は表を書き換えないので、大きな match_history でもすぐ終わる
+    cur.execute(
+        """
+        ALTER TABLE matches ALTER COLUMN guild_id SET NOT NULL;
+        ALTER TABLE players ADD COLUMN guild_id BIGINT NOT NULL DEFAULT %(legacy)s;
+        ALTER TABLE players ALTER COLUMN guild_id DROP DEFAULT;
+        ALTER TABLE match_history ADD COLUMN guild_id BIGINT NOT NULL DEFAULT %(legacy)s;
+        ALTER TABLE match_history ALTER COLUMN guild_id DROP DEFAULT;
+        ALTER TABLE pair_stats ADD COLUMN guild_id BIGINT NOT NULL DEFAULT %(legacy)s;
+        ALTER TABLE pair_stats ALTER COLUMN guild_id DROP DEFAULT;
+        ALTER TABLE seasons ADD COLUMN guild_id BIGINT NOT NULL DEFAULT %(legacy)s;
+        ALTER TABLE seasons ALTER COLUMN guild_id DROP DEFAULT;
+        DELETE FROM rating_snapshots;
+        ALTER TABLE rating_snapshots ADD COLUMN guild_id BIGINT NOT NULL;
+
+        ALTER TABLE players DROP CONSTRAINT players_pkey, ADD PRIMARY KEY (guild_id, id);
+        ALTER TABLE pair_stats DROP CONSTRAINT pair_stats_pkey, ADD PRIMARY KEY (guild_id, player_a, player_b);
+        ALTER TABLE seasons DROP CONSTRAINT seasons_pkey, ADD PRIMARY KEY (guild_id, name);
+        ALTER TABLE rating_snapshots DROP CONSTRAINT rating_snapshots_last_match_id_key,
+            ADD UNIQUE (guild_id, last_match_id);
+
+        DROP INDEX IF EXISTS players_conservative_idx;
+        DROP INDEX IF EXISTS match_history_player_match_idx;
+        DROP INDEX IF EXISTS match_history_player_timestamp_idx;
+        DROP INDEX IF EXISTS match_history_match_idx;
+        DROP INDEX IF EXISTS pair_stats_player_b_idx;
+        DROP INDEX IF EXISTS matches_finished_idx;
+        DROP INDEX IF EXISTS matches_started_idx;
+        CREATE INDEX players_conservative_idx
+            ON players (guild_id, (mu - 3 * sigma) DESC, id);
+        CREATE INDEX match_history_player_match_idx
+            ON match_history (guild_id, player_id, match_id);
+        CREATE INDEX match_history_player_timestamp_idx
+            ON match_history (guild_id, player_id, timestamp DESC);
+        CREATE INDEX match_history_match_idx
+            ON match_history (guild_id, match_id);
+        CREATE INDEX pair_stats_player_b_idx ON pair_stats (guild_id, player_b);
+        CREATE INDEX matches_finished_idx
+            ON matches (guild_id, match_id DESC) WHERE status = 'finished';
+        CREATE INDEX matches_started_idx ON matches (guild_id, started_at);
+        ANALYZE players;
+        ANALYZE match_history;
+        """,
+        {"legacy": legacy}
+    )
+
+
+# (バージョン, 説明, SQL またはカーソルを受け取る関数)。追加は末尾にのみ行うこと
+MIGRATIONS = [
+    (1, "players / match_history", """
+        CREATE TABLE IF NOT EXISTS players (
+            id BIGINT PRIMARY KEY,
+            mu DOUBLE PRECISION,
+            sigma DOUBLE PRECISION,
+            games INTEGER,
+            wins INTEGER,
+            last_match TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS match_history (
+            id SERIAL PRIMARY KEY,
+            player_id BIGINT,
+            match_id BIGINT,
+            timestamp TIMESTAMP,
+            rank INTEGER,
+            wins INTEGER,
+            mu_before DOUBLE PRECISION,
+            sigma_before DOUBLE PRECISION,
+            mu_after DOUBLE PRECISION,
+            sigma_after DOUBLE PRECISION
+        );
+    """),
+    (2, "matches", _create_matches),
+    (3, "match_games", """
+        CREATE TABLE IF NOT EXISTS match_games (
+            match_id BIGINT NOT NULL REFERENCES matches (match_id) ON DELETE CASCADE,
+            game_no SMALLINT NOT NULL,
+            team1_won BOOLEAN NOT NULL,
+            recorded_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP,
+            PRIMARY KEY (match_id, game_no)
+        );
+    """),
+    # player_id で絞って match_id 順: 戦績・レート推移・undo の last_match
+    # player_id で絞って timestamp 降順: /history の履歴一覧
+    # match_id で絞る: undo の削除・再計算と matches の補完
+    # 保守的レートの降順（同点は id 順）: ランキング
+    (4, "match_history / players indexes", """
+        CREATE INDEX IF NOT EXISTS match_history_player_match_idx
+            ON match_history (player_id, match_id);
+        CREATE INDEX IF NOT EXISTS match_history_player_timestamp_idx
+            ON match_history (player_id, timestamp DESC);
+        CREATE INDEX IF NOT EXISTS match_history_match_idx
+            ON match_history (match_id);
+        CREATE INDEX IF NOT EXISTS players_conservative_idx
+            ON players ((mu - 3 * sigma) DESC, id);
+        ANALYZE players;
+        ANALYZE match_history;
+    """),
+    # Bot が再起動をまたいで覚えておく値（コマンドツリーのハッシュなど）
+    (5, "bot_state", """
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP
+        );
+    """),
+    # 終了した試合のゲーム結果はビットマスクで持ち、ペアごとの集計を pair_stats に持つ
+    (6, "outcome_mask / pair_stats", _compact_results),
+    # players の行を書き換えるたびに増やす（試合結果の書き込みで、読み込み後の更新を検出する）
+    (7, "players.version", """
+        ALTER TABLE players ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0;
+    """),
+    # match_history を全員分のレートに畳み込んだスナップショット（last_match_id 以下の試合を反映済み）と、
+    # シーズンの区切り。過去の時点のランキングはスナップショット + その後の履歴から作る
+    (8, "rating_snapshots / seasons", """
+        CREATE TABLE IF NOT EXISTS rating_snapshots (
+            snapshot_id BIGSERIAL PRIMARY KEY,
+            last_match_id BIGINT NOT NULL UNIQUE,
+            last_timestamp TIMESTAMP,
+            created_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS rating_snapshot_players (
+            snapshot_id BIGINT NOT NULL REFERENCES rating_snapshots (snapshot_id) ON DELETE CASCADE,
+            player_id BIGINT NOT NULL,
+            mu DOUBLE PRECISION NOT NULL,
+            sigma DOUBLE PRECISION NOT NULL,
+            games INTEGER NOT NULL,
+            wins INTEGER NOT NULL,
+            last_match TIMESTAMP,
+            PRIMARY KEY (snapshot_id, player_id)
+        );
+        CREATE TABLE IF NOT EXISTS seasons (
+            name TEXT PRIMARY KEY,
+            started_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS matches_started_idx ON matches (started_at);
+    """),
+    # プレイヤー・履歴・ランキングをサーバーごとに分ける（同じ人でもサーバーが違えば別のレート）
+    (9, "guild_id partition key", _partition_by_guild),
+]
+
+
+def migrate() -> list:
+    """
+    未適用のマイグレーションを1トランザクションで適用し、適用したバージョンのリストを返す
+    """
+    applied = []
+    with get_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP
+            )
+            """
+        )
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        current = cur.fetchone()[0]
+        for version, description, step in MIGRATIONS:
+            if version <= current:
+                continue
+            if callable(step):
+                step(cur)
+            else:
+                cur.execute(step)
+            cur.execute(
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                (version, description)
+            )
+            applied.append(version)
+            print(f"schema: v{version} {description} を適用しました")
+    if SCHEMA_EXPLAIN:
+        for name, (_, seq_scans) in explain_hot_queries().items():
+            if seq_scans:
+                print(f"schema: {name} がシーケンシャルスキャンしています: {', '.join(seq_scans)}")
+    return applied
+
+
+# STATEMENTS の各文に渡す代表的な引数。s は explain_hot_queries が DB から拾った実在の値
+# （SQL 自体は STATEMENTS のものをそのまま使うので、実際に実行される文の計画になる）
+EXPLAIN_ARGS = {
+    "get_players": lambda s: (s["guild_id"], s["player_ids"]),
+    "save_players": lambda s: (
+        s["guild_id"], s["player_ids"], s["mus"], s["sigmas"], s["ones"], s["zeros"], s["timestamps"], s["ones"]
+    ),
+    "insert_history": lambda s: (
+        s["guild_id"], s["player_ids"], [s["match_id"]] * len(s["player_ids"]), s["timestamps"],
+        s["zeros"], s["zeros"], s["mus"], s["sigmas"], s["mus"], s["sigmas"]
+    ),
+    "finish_match": lambda s: (s["match_id"], 0),
+    "add_pair_stats": lambda s: (
+        s["guild_id"], s["player_ids"][:-1], s["player_ids"][1:],
+        s["ones"][1:], s["zeros"][1:], s["ones"][1:], s["zeros"][1:]
+    ),
+    "get_player_history": lambda s: (s["guild_id"], s["player_id"]),
+    "get_player_summary": lambda s: (s["guild_id"], s["player_id"]),
+    "get_rating_series": lambda s: (s["guild_id"], s["player_id"], HISTORY_CHART_POINTS),
+    "record_game": lambda s: (s["match_id"], 1, True),
+    "get_match_games": lambda s: (s["match_id"],),
+    "get_pair_stats": lambda s: (s["guild_id"], *sorted(s["player_ids"][:2])),
+    "get_partner_stats": lambda s: (s["guild_id"], s["player_id"]),
+    "undo_target": lambda s: (s["match_id"], s["guild_id"]),
+    "undo_latest": lambda s: (s["guild_id"], 1),
+    "undo_lock_players": lambda s: (s["guild_id"],),
+    "undo_history_since": lambda s: (s["guild_id"], s["match_id"]),
+    "undo_replay_history": lambda s: (s["history_ids"], s["mus"], s["sigmas"], s["mus"], s["sigmas"]),
+    "undo_remove": lambda s: (s["guild_id"], [s["match_id"]]),
+    "undo_restore_players": lambda s: (
+        s["guild_id"], s["player_ids"], s["mus"], s["sigmas"], s["ones"], s["zeros"]
+    ),
+}
+
+
+def _explain_samples(cur) -> dict:
+    """
+    最新の試合から、EXPLAIN_ARGS に渡す実在の guild_id / player_id / match_id などを集める
+    """
+    cur.execute(
+        """
+        SELECT guild_id, match_id, id, player_id, timestamp, mu_after, sigma_after
+        FROM match_history
+        WHERE match_id = (SELECT MAX(match_id) FROM match_history)
+        ORDER BY id
+        """
+    )
+    rows = cur.fetchall()
+    guild_id, match_id = (rows[0][0], rows[0][1]) if rows else (0, 0)
+    player_ids = [row[3] for row in rows] or [0, 0]
+    return {
+        "guild_id": guild_id,
+        "match_id": match_id,
+        "player_id": player_ids[0],
+        "player_ids": player_ids,
+        "history_ids": [row[2] for row in rows] or [0, 0],
+        "timestamps": [row[4] for row in rows] or [datetime.now()] * 2,
+        "mus": [row[5] for row in rows] or [0.0, 0.0],
+        "sigmas": [row[6] for row in rows] or [0.0, 0.0],
+        "ones": [1] * len(player_ids),
+        "zeros": [0] * len(player_ids),
+    }
+
+
+def explain_hot_queries(no_seqscan: bool = False) -> dict:
+    """
+    storage.postgres.STATEMENTS の各文を同じ引数の型で PREPARE し、EXPLAIN EXECUTE で実行計画を取得する。
+    {名前: (計画の行リスト, シーケンシャルスキャンしたテーブル)} で返す。
+    no_seqscan なら enable_seqscan を切って、使える索引があるかを確認する。
+    書き込みの文も EXPLAIN だけなので実行はされない。
+    """
+    report = {}
+    with get_connection() as conn, conn.cursor() as cur:
+        if no_seqscan:
+            cur.execute("SET LOCAL enable_seqscan = off")
+        samples = _explain_samples(cur)
+        for name, (types, sql) in STATEMENTS.items():
+            if name not in EXPLAIN_ARGS:
+                report[name] = (["EXPLAIN_ARGS に代表的な引数がありません"], [])
+                continue
+            # プールの接続では本物の名前が PREPARE 済みのことがあるので、別名で作って消す
+            # （PREPARE は rollback しても残るので、失敗したときも消してから元のエラーを出す）
+            statement = f"explain_{name}"
+            cur.execute("SAVEPOINT explain")
+            cur.execute(f"PREPARE {statement} ({', '.join(types)}) AS {sql}")
+            try:
+                cur.execute(
+                    f"EXPLAIN EXECUTE {statement} ({', '.join(f'%s::{t}' for t in types)})",
+                    EXPLAIN_ARGS[name](samples)
+                )
+                plan = [row[0] for row in cur.fetchall()]
+            except Exception:
+                cur.execute("ROLLBACK TO SAVEPOINT explain")
+                cur.execute(f"DEALLOCATE {statement}")
+                raise
+            cur.execute(f"DEALLOCATE {statement}")
+            seq_scans = [line.split("Seq Scan on ", 1)[1].split()[0] for line in plan if "Seq Scan on " in line]
+            report[name] = (plan, seq_scans)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DB スキーマのマイグレーションと実行計画の確認")
+    parser.add_argument("--explain", action="store_true", help="よく使うクエリの実行計画を表示する")
+    parser.add_argument("--no-seqscan", action="store_true", help="シーケンシャルスキャンを禁止して計画を取る")
+    args = parser.parse_args()
+
+    applied = migrate()
+    print(f"applied: {applied or 'none'}")
+    if args.explain:
+        for name, (plan, seq_scans) in explain_hot_queries(args.no_seqscan).items():
+            status = "SEQ SCAN: " + ", ".join(seq_scans) if seq_scans else "ok"
+            print(f"--- {name} ({status})")
+            print("\n".join(plan))
+
+
+if __name__ == "__main__":
+    main()
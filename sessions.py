@@ -0,0 +1,98 @@
+import asyncio
+
+# 1試合の参加人数
+ENTRY_LIMIT = 8
+
+
+class LobbySession:
+    """
+    1チャンネル分のロビー（ホスト・エントリー）と試合の状態
+    """
+
+    def __init__(self, guild_id: int, channel_id: int):
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.host_id = None     # 現在のホストのDiscord ID
+        self.entries = {}       # エントリー中のDiscord ID（挿入順を保つ dict で O(1) 判定）
+        self.entry_order = []   # /order で決めた試合の並び順
+        self.aborted = False
+        # /match の実行中はロックを保持し、同じチャンネルでの二重実行と並び順の変更を防ぐ
+        self.lock = asyncio.Lock()
+
+    def reset(self, host_id: str):
+        """
+        ホストを設定してエントリーを空にする
+        """
+        self.host_id = host_id
+        self.entries.clear()
+
+    def join(self, user_id: str) -> bool:
+        """
+        エントリーに追加する。既に参加済みなら False
+        """
+        if user_id in self.entries:
+            return False
+        self.entries[user_id] = None
+        return True
+
+    def leave(self, user_id: str) -> bool:
+        """
+        エントリーから外す。参加していなければ False
+        """
+        if user_id not in self.entries:
+            return False
+        del self.entries[user_id]
+        return True
+
+    def is_full(self) -> bool:
+        return len(self.entries) >= ENTRY_LIMIT
+
+    def __contains__(self, user_id):
+        return user_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SessionManager:
+    """
+    (guild_id, channel_id) ごとの LobbySession を管理する。
+    チャンネルが違えば複数の試合を並行して進められる。
+    """
+
+    def __init__(self):
+        self._sessions = {}
+
+    def get(self, guild_id: int, channel_id: int) -> LobbySession:
+        """
+        チャンネルのセッションを返す（なければ作成）
+        """
+        key = (guild_id, channel_id)
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._sessions[key] = LobbySession(guild_id, channel_id)
+        return session
+
+    def for_context(self, ctx) -> LobbySession:
+        """
+        コマンドが実行されたチャンネルのセッションを返す（DM ではロビーを作れないので ValueError）
+        """
+        if ctx.guild is None:
+            raise ValueError("DM ではロビーを使えません")
+        return self.get(ctx.guild.id, ctx.channel.id)
+
+    def discard(self, guild_id: int, channel_id: int):
+        """
+        チャンネルのセッションを破棄する
+        """
+        self._sessions.pop((guild_id, channel_id), None)
+
+    def __iter__(self):
+        return iter(list(self._sessions.values()))
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+# Bot 全体で共有するセッション管理
+sessions = SessionManager()
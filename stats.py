@@ -1,16 +1,35 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-from utils import get_all_players, get_player, get_player_history
+from async_utils import (
+    get_all_players, get_player_summary, get_rating_series, get_ranking_page, get_player_rank,
+    get_pair_stats, get_partner_stats, get_ranking_as_of, get_season_ranking, get_seasons, start_season
+)
+from config import ADMIN_ID
+from datetime import datetime, timedelta
 import traceback
-import matplotlib.pyplot as plt
+from charts import get_rating_chart
+from names import resolver
 from io import BytesIO
 import asyncio
+import os
+
+# /ranking の1ページあたりの表示人数（Embed の文字数上限に収まる件数）
+RANKING_PAGE_SIZE = 20
+# /synergy で勝率を出す最低ゲーム数（少ない組み合わせは偶然の偏りが大きい）
+SYNERGY_MIN_GAMES = int(os.getenv('SYNERGY_MIN_GAMES', 5))
+# /synergy で表示する人数
+SYNERGY_LIMIT = 5
+
+
+def _rate(wins: int, games: int) -> str:
+    return f"{wins / games:.0%}（{wins}/{games}）" if games else "-"
 
 class StatsCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    @commands.guild_only()
     @commands.hybrid_command(
         name="history",
         description="（メンション対応）戦績とレート変動を表示します"
@@ -20,36 +39,24 @@ class StatsCog(commands.Cog):
         """メンションで任意ユーザーの戦績を表示（管理者制限なし）"""
         target_user: discord.User = user or ctx.author
 
-        # --- DBから履歴を取得 ---
+        # --- DBで集計した戦績を取得（履歴全件は読み込まない） ---
         player_id = str(target_user.id)
-        history = get_player_history(player_id)  # List[dict] を想定（mu_after, sigma_after, rank を含む）
+        summary = await get_player_summary(ctx.guild.id, player_id)
 
-        if not history:
+        if not summary:
             await ctx.send(f"{target_user.display_name} さんの履歴が見つかりません。")
             return
 
-        # ---- 時系列を古い→新しいに整形 ----
-        chronological = list(reversed(history))
-
-        # ---- メトリクス計算 ----
-        ratings = [(row["mu_after"] - 3 * row["sigma_after"]) for row in chronological]
-        ranks = [row["rank"] for row in chronological]  # 0位が勝利という仕様
-        match_count = len(ranks)
-        wins = sum(1 for r in ranks if r == 0)
-        avg_rank = sum((r + 1) for r in ranks) / match_count  # 表示は1始まり
-        latest_rating = ratings[-1]
+        # ---- メトリクス ----
+        match_count = summary["match_count"]
+        wins = summary["wins"]  # 0位が勝利という仕様
+        avg_rank = float(summary["avg_rank"])  # 表示は1始まり
+        latest_rating = float(summary["latest_rating"])
 
-        # ---- グラフ生成 ----
-        try:
-            plt.figure()
-            plt.plot(range(1, match_count + 1), ratings, marker="o", label="Rate")
-            plt.xlabel("Match")
-            plt.ylabel("Rate")
-            plt.grid(True)
-            plt.tight_layout()
-            plt.savefig("rating.png")  # ファイル名は固定
-        finally:
-            plt.close()
+        # ---- グラフ生成（間引いた推移を別プロセスで描画し、最新試合が変わるまでキャッシュ） ----
+        png = await get_rating_chart(
+            player_id, summary["latest_match_id"], lambda: get_rating_series(ctx.guild.id, player_id)
+        )
 
         # ---- Embed作成 ----
         embed = discord.Embed(
@@ -63,17 +70,18 @@ class StatsCog(commands.Cog):
         embed.set_footer(text="SwitchSports Arena")
 
         # 画像を添付し、Embedに表示
-        file = discord.File("rating.png", filename="rating.png")
+        file = discord.File(BytesIO(png), filename="rating.png")
         embed.set_image(url="attachment://rating.png")
 
         await ctx.send(embed=embed, file=file)
 
 
+    @commands.guild_only()
     @commands.hybrid_command(name="player_list", description="登録プレイヤーの一覧を表示")
     async def player_list(self, ctx):
         try:
             await ctx.defer()
-            players = get_all_players()
+            players = await get_all_players(ctx.guild.id)
             if not players:
                 embed = discord.Embed(
                     description="エラーが発生しました",
@@ -88,10 +96,9 @@ class StatsCog(commands.Cog):
             lines.append(f"{'番号':<4} | {'プレイヤー名':<20}")
             lines.append("-" * 30)
 
+            names = await resolver.resolve(ctx.guild, [p['id'] for p in players])
             for i, p in enumerate(players, start=1):
-                member = ctx.guild.get_member(p['id'])
-                name = member.display_name if member else str(p['id'])
-                lines.append(f"{i:<4} | {name:<20}")
+                lines.append(f"{i:<4} | {names[p['id']]:<20}")
 
             lines.append("```")
             await ctx.send("\n".join(lines))
@@ -107,40 +114,114 @@ class StatsCog(commands.Cog):
 
 
 
+    @commands.guild_only()
     @commands.hybrid_command(name="ranking", description="全プレイヤーのレート順位を表示")
-    async def ranking(self, ctx):
+    @app_commands.describe(
+        page="表示するページ（1ページ20人）",
+        date="この日の終わり時点の順位を表示（YYYY-MM-DD）",
+        season="シーズン終了時点の順位を表示（シーズン中に試合に出た人のみ）"
+    )
+    async def ranking(self, ctx, page: int = 1, date: str | None = None, season: str | None = None):
         try:
             await ctx.defer()
-            players = get_all_players()
-            if not players:
+            title = "ランキング"
+            empty = "登録プレイヤーがいません"
+            if season is not None:
+                # 過去の時点の順位はスナップショットとその後の履歴から作る
+                found = await get_season_ranking(ctx.guild.id, season, max(page, 1), RANKING_PAGE_SIZE)
+                if found is None:
+                    names = [s['name'] for s in await get_seasons(ctx.guild.id)]
+                    embed = discord.Embed(
+                        description=f"シーズン「{season}」はありません（{', '.join(names) or 'シーズン未登録'}）",
+                        color=0xFEE75C
+                    )
+                    await ctx.send(embed=embed)
+                    return
+                rows, total = found
+                title = f"ランキング（{season}）"
+                empty = f"シーズン「{season}」に試合に出たプレイヤーがいません"
+            elif date is not None:
+                try:
+                    at = datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)
+                except ValueError:
+                    embed = discord.Embed(
+                        description="日付は YYYY-MM-DD の形式で指定してください",
+                        color=0xFEE75C
+                    )
+                    await ctx.send(embed=embed)
+                    return
+                rows, total = await get_ranking_as_of(ctx.guild.id, at, max(page, 1), RANKING_PAGE_SIZE)
+                title = f"ランキング（{date} 時点）"
+                empty = f"{date} までに試合に出たプレイヤーがいません"
+            else:
+                rows, total = await get_ranking_page(ctx.guild.id, max(page, 1), RANKING_PAGE_SIZE)
+            if total == 0:
                 embed = discord.Embed(
-                    description="登録プレイヤーがいません",
+                    description=empty,
                     color=0xFEE75C
                 )
                 await ctx.send(embed=embed)
                 return
 
-            # 保守的レートでソート
-            sorted_players = sorted(players, key=lambda p: p['mu'] - 3 * p['sigma'], reverse=True)
+            last_page = (total + RANKING_PAGE_SIZE - 1) // RANKING_PAGE_SIZE
+            if not rows:
+                embed = discord.Embed(
+                    description=f"ページは 1〜{last_page} を指定してください",
+                    color=0xFEE75C
+                )
+                await ctx.send(embed=embed)
+                return
 
-            # 表形式のメッセージ整形
+            # 表形式のメッセージ整形（保守的レート順）
 
             lines = []
 
-            for i, p in enumerate(sorted_players, start=1):
-                member = ctx.guild.get_member(p['id'])
-                name = member.display_name if member else str(p['id'])
-                conservative = round(p['mu'] - 3 * p['sigma'])
+            names = await resolver.resolve(ctx.guild, [player_id for _, player_id, _ in rows])
+            for rank, player_id, conservative in rows:
+                name = names[player_id]
 
                 # レートを右揃えでフォーマット
-                lines.append(f"{i}.  {conservative:<6} `{name}`")
+                lines.append(f"{rank}.  {round(conservative):<6} `{name}`")
 
 
             embed = discord.Embed(
-                title="ランキング",
+                title=title,
                 description="\n".join(lines),
                 color=0x800080
             )
+            embed.set_footer(text=f"SwitchSports Arena ・ {max(page, 1)}/{last_page} ページ")
+            await ctx.send(embed=embed)
+
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            embed = discord.Embed(
+                    description="エラーが発生しました",
+                    color=0xED4245
+                )
+            await ctx.send(embed=embed)
+
+    @commands.guild_only()
+    @commands.hybrid_command(name="rank", description="（メンション対応）現在の順位を表示します")
+    @app_commands.describe(user="順位を見たい相手をメンション（未指定なら自分）")
+    async def rank(self, ctx, user: discord.User | None = None):
+        try:
+            await ctx.defer()
+            target_user = user or ctx.author
+            found = await get_player_rank(ctx.guild.id, target_user.id)
+            if found is None:
+                embed = discord.Embed(
+                    description=f"{target_user.display_name} は未登録です",
+                    color=0xFEE75C
+                )
+                await ctx.send(embed=embed)
+                return
+
+            rank, conservative, total = found
+            embed = discord.Embed(
+                description=f"{target_user.display_name} は {total} 人中 **{rank} 位**（レート {round(conservative)}）",
+                color=0x800080
+            )
             embed.set_footer(text="SwitchSports Arena")
             await ctx.send(embed=embed)
 
@@ -153,5 +234,143 @@ class StatsCog(commands.Cog):
                 )
             await ctx.send(embed=embed)
 
+    @commands.guild_only()
+    @commands.hybrid_command(name="synergy", description="（メンション対応）相性の良い味方と苦手な相手を表示します")
+    @app_commands.describe(user="相性を見たい相手をメンション（未指定なら自分）")
+    async def synergy(self, ctx, user: discord.User | None = None):
+        try:
+            await ctx.defer()
+            target_user = user or ctx.author
+            rows = await get_partner_stats(ctx.guild.id, target_user.id)
+            partners = [r for r in rows if r["together_games"] >= SYNERGY_MIN_GAMES]
+            rivals = [
+                r for r in rows
+                if r["versus_games"] >= SYNERGY_MIN_GAMES and r["wins_against"] * 2 < r["versus_games"]
+            ]
+            if not partners and not rivals:
+                embed = discord.Embed(
+                    description=f"{target_user.display_name} の記録がまだ足りません（{SYNERGY_MIN_GAMES} ゲーム以上の組み合わせがありません）",
+                    color=0xFEE75C
+                )
+                await ctx.send(embed=embed)
+                return
+
+            # 勝率の高い味方と、負け越している相手（勝率の低い順）
+            partners.sort(key=lambda r: (-r["together_wins"] / r["together_games"], -r["together_games"]))
+            rivals.sort(key=lambda r: (r["wins_against"] / r["versus_games"], -r["versus_games"]))
+            partners = partners[:SYNERGY_LIMIT]
+            rivals = rivals[:SYNERGY_LIMIT]
+            names = await resolver.resolve(ctx.guild, [r["other"] for r in partners + rivals])
+
+            embed = discord.Embed(
+                title=f"{target_user.display_name} の相性",
+                color=0x1E90FF
+            )
+            embed.add_field(
+                name="🤝 相性の良い味方（同じチームでの勝率）",
+                value="\n".join(f"{names[r['other']]}: {_rate(r['together_wins'], r['together_games'])}" for r in partners) or "-",
+                inline=False
+            )
+            embed.add_field(
+                name="⚔️ 苦手な相手（敵としての勝率）",
+                value="\n".join(f"{names[r['other']]}: {_rate(r['wins_against'], r['versus_games'])}" for r in rivals) or "-",
+                inline=False
+            )
+            embed.set_footer(text=f"SwitchSports Arena ・ {SYNERGY_MIN_GAMES} ゲーム以上の組み合わせ")
+            await ctx.send(embed=embed)
+
+        except Exception:
+            traceback.print_exc()
+            embed = discord.Embed(
+                    description="エラーが発生しました",
+                    color=0xED4245
+                )
+            await ctx.send(embed=embed)
+
+    @commands.guild_only()
+    @commands.hybrid_command(name="versus", description="2人の対戦成績と、組んだときの成績を表示します")
+    @app_commands.describe(user="相手をメンション", other="もう1人をメンション（未指定なら自分）")
+    async def versus(self, ctx, user: discord.User, other: discord.User | None = None):
+        try:
+            await ctx.defer()
+            first = other or ctx.author
+            if first.id == user.id:
+                embed = discord.Embed(
+                    description="別々の2人を指定してください",
+                    color=0xFEE75C
+                )
+                await ctx.send(embed=embed)
+                return
+            stats = await get_pair_stats(ctx.guild.id, first.id, user.id)
+            if stats is None:
+                embed = discord.Embed(
+                    description=f"{first.display_name} と {user.display_name} が同じ試合に出た記録はありません",
+                    color=0xFEE75C
+                )
+                await ctx.send(embed=embed)
+                return
+
+            versus_games = stats["versus_games"]
+            wins = stats["wins_against"]
+            embed = discord.Embed(
+                title=f"{first.display_name} vs {user.display_name}",
+                color=0x1E90FF
+            )
+            embed.add_field(
+                name="⚔️ 対戦成績",
+                value=f"{wins} 勝 {versus_games - wins} 敗" + (f"（勝率 {wins / versus_games:.0%}）" if versus_games else ""),
+                inline=False
+            )
+            embed.add_field(
+                name="🤝 同じチームでの成績",
+                value=_rate(stats["together_wins"], stats["together_games"]),
+                inline=False
+            )
+            embed.set_footer(text="SwitchSports Arena")
+            await ctx.send(embed=embed)
+
+        except Exception:
+            traceback.print_exc()
+            embed = discord.Embed(
+                    description="エラーが発生しました",
+                    color=0xED4245
+                )
+            await ctx.send(embed=embed)
+
+    @commands.guild_only()
+    @commands.hybrid_command(name="season_start", description="（管理者のみ）新しいシーズンを開始します")
+    @app_commands.describe(name="シーズン名（/ranking の season に指定する名前）")
+    async def season_start(self, ctx, name: str):
+        try:
+            if ctx.author.id != ADMIN_ID:
+                embed = discord.Embed(
+                    description="このコマンドは管理者のみ実行できます",
+                    color=0xED4245
+                )
+                await ctx.send(embed=embed, ephemeral=True)
+                return
+            await ctx.defer()
+            season = await start_season(ctx.guild.id, name)
+            if season is None:
+                embed = discord.Embed(
+                    description=f"シーズン「{name}」は既にあります",
+                    color=0xFEE75C
+                )
+                await ctx.send(embed=embed)
+                return
+            embed = discord.Embed(
+                description=f"🏆 シーズン「{name}」を開始しました（{season['started_at']:%Y-%m-%d %H:%M}）",
+                color=0x57F287
+            )
+            await ctx.send(embed=embed)
+
+        except Exception:
+            traceback.print_exc()
+            embed = discord.Embed(
+                    description="エラーが発生しました",
+                    color=0xED4245
+                )
+            await ctx.send(embed=embed)
+
 async def setup(bot):
     await bot.add_cog(StatsCog(bot))
@@ -0,0 +1,62 @@
+"""
+永続化バックエンドの選択。STORAGE_BACKEND で切り替える。
+
+    postgres  PostgreSQL（既定。DB_HOST などで接続先を指定）
+    sqlite    SQLite の WAL モード（SQLITE_PATH のファイル。DB サーバー不要）
+    memory    プロセス内のみ（SQLite のインメモリ DB。終了すると消える）
+"""
+import os
+import threading
+from storage.base import Storage, ConflictError, plan_undo
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def create_storage(backend: str = None) -> Storage:
+    """
+    指定したバックエンドを新しく作る（未指定なら STORAGE_BACKEND）
+    """
+    backend = backend or os.getenv('STORAGE_BACKEND', 'postgres')
+    if backend == "postgres":
+        from storage.postgres import PostgresStorage
+        return PostgresStorage()
+    if backend == "sqlite":
+        from storage.sqlite import SQLiteStorage
+        return SQLiteStorage(os.getenv('SQLITE_PATH', 'game4v4.db'))
+    if backend == "memory":
+        from storage.memory import MemoryStorage
+        return MemoryStorage()
+    raise ValueError(f"不明な STORAGE_BACKEND です: {backend}")
+
+
+def get_storage() -> Storage:
+    """
+    プロセス共有のバックエンドを返す（初回呼び出し時に作成）
+    """
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage()
+    return _storage
+
+
+def set_storage(storage: Storage):
+    """
+    使うバックエンドを差し替える（ベンチマークなどで使う）
+    """
+    global _storage
+    with _storage_lock:
+        _storage = storage
+
+
+def close_storage():
+    """
+    バックエンドの接続を閉じる（Bot 終了時に呼ぶ）
+    """
+    global _storage
+    with _storage_lock:
+        if _storage is not None:
+            _storage.close()
+            _storage = None
@@ -0,0 +1,236 @@
+from outcomes import pair_deltas, resolve_patterns
+
+
+class ConflictError(Exception):
+    """
+    読み込んだ後に他の試合が players の行を更新していたため、書き込みを取り消したことを表す
+    """
+
+    def __init__(self, player_ids):
+        self.player_ids = set(player_ids)
+        super().__init__(f"players の行が他の処理で更新されています: {sorted(self.player_ids)}")
+
+
+class Storage:
+    """
+    永続化の共通インターフェース。utils がキャッシュを挟んでこのメソッドを呼ぶ。
+    メソッドはすべて同期で、DB 用のワーカースレッドから同時に呼ばれてもよいように実装すること。
+    プレイヤー・履歴・ペア統計・スナップショット・シーズンはサーバー（guild_id）ごとに別々に持ち、
+    guild_id を受け取るメソッドはそのサーバーの行だけを読み書きする。
+    players の行は guild_id, id, mu, sigma, games, wins, last_match, version を持つ辞書で返す。
+    version は players の行を書き換えるたびに1増やす（楽観的排他制御に使う）。
+    """
+
+    def migrate(self) -> list:
+        """
+        未適用のスキーマ変更を適用し、適用したバージョンのリストを返す
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        接続をすべて閉じる（Bot 終了時に呼ぶ）
+        """
+        raise NotImplementedError
+
+    # ---- Bot の状態 ----
+    def get_state(self, key: str) -> str:
+        raise NotImplementedError
+
+    def set_state(self, key: str, value: str):
+        raise NotImplementedError
+
+    # ---- プレイヤー ----
+    def get_players(self, guild_id: int, player_ids: list) -> dict:
+        """
+        {id: players の行} を返す。未登録の id は含めない
+        """
+        raise NotImplementedError
+
+    def get_all_players(self, guild_id: int) -> list:
+        raise NotImplementedError
+
+    def upsert_player(self, guild_id: int, player_id: int, mu: float, sigma: float, games: int, wins: int, last_match) -> dict:
+        """
+        プレイヤーを登録（既存なら更新）し、更新後の行を返す
+        """
+        raise NotImplementedError
+
+    # ---- 試合履歴 ----
+    def insert_match_history(self, guild_id: int, player_id: int, match_id: int, timestamp, rank: int, wins: int,
+                             mu_before: float, sigma_before: float, mu_after: float, sigma_after: float):
+        raise NotImplementedError
+
+    def save_match_results(self, guild_id: int, match_id: int, players: list, history: list, outcome_mask: int, pairs: list) -> list:
+        """
+        1試合分の players と match_history を1トランザクションで書き込み、試合を終了済みにする。
+        players の各行の version が読み込んだときのまま（players の辞書の version）でなければ、
+        何も書き込まずに ConflictError を投げる。
+        ゲーム結果は outcome_mask だけを matches に残して match_games からは消し、
+        pairs（outcomes.pair_deltas の戻り値）を pair_stats に足し込む。
+        更新後の players の行のリストを返す
+        """
+        raise NotImplementedError
+
+    def get_player_history(self, guild_id: int, player_id: int) -> list:
+        raise NotImplementedError
+
+    def get_player_summary(self, guild_id: int, player_id: int) -> dict:
+        """
+        match_count, wins, avg_rank, latest_match_id, latest_rating を返す。履歴がなければ None
+        """
+        raise NotImplementedError
+
+    def get_rating_series(self, guild_id: int, player_id: int, max_points: int) -> list:
+        """
+        [(何試合目か, 保守的レート), ...] を古い順に、max_points 程度に間引いて返す
+        """
+        raise NotImplementedError
+
+    # ---- 試合の採番と途中経過 ----
+    def start_match(self, guild_id: int, channel_id: int, host_id: int, entry_order: list,
+                    pattern_set: int, patterns: list) -> int:
+        """
+        同じチャンネルの中断中の試合を中止扱いにしてから、新しい試合を登録して match_id を返す。
+        patterns は定義済みのパターンセットでないとき（pattern_set が None）だけ渡される
+        """
+        raise NotImplementedError
+
+    def record_game(self, match_id: int, game_no: int, team1_won: bool):
+        raise NotImplementedError
+
+    def get_match_games(self, match_id: int) -> list:
+        raise NotImplementedError
+
+    def get_running_matches(self, channel_id: int = None) -> list:
+        """
+        各行は match_id, guild_id, channel_id, host_id, entry_order, pattern_set, patterns, games を持つ
+        """
+        raise NotImplementedError
+
+    def abort_match(self, match_id: int):
+        raise NotImplementedError
+
+    # ---- ペア統計 ----
+    def get_pair_stats(self, guild_id: int, player_a: int, player_b: int) -> dict:
+        """
+        player_a < player_b の組の together_games, together_wins, versus_games, a_wins を返す。なければ None
+        """
+        raise NotImplementedError
+
+    def get_partner_stats(self, guild_id: int, player_id: int) -> list:
+        """
+        player_id と同じ試合に出た全員について、other, together_games, together_wins,
+        versus_games, wins_against（player_id から見た勝ち数）を返す
+        """
+        raise NotImplementedError
+
+    # ---- 取り消し ----
+    def undo_matches(self, guild_id: int, count: int, match_id: int, replay) -> tuple:
+        """
+        guild_id のサーバーの試合を取り消し、(取り消した match_id のリスト, 対象プレイヤーID, 再計算した試合数, 更新後の players の行)
+        を返す。後の試合の再計算は plan_undo に replay を渡して行う。
+        pair_stats からは match_pair_deltas で求めた取り消し分を引き、
+        取り消した試合以降を含むそのサーバーのスナップショットは消す。
+        試合結果の保存と競合して書き込めなかったときは ConflictError を送出する
+        """
+        raise NotImplementedError
+
+    # ---- レートのスナップショット ----
+    def take_snapshot(self, guild_id: int) -> dict:
+        """
+        サーバーの前回のスナップショットに、その後の match_history を fold_history で適用して新しいスナップショットを保存する。
+        境界はそのサーバーの「終了済みの最新の試合」と「実行中の最古の試合の1つ前」の小さい方の match_id で、
+        後から終了した試合が境界より前に割り込まないようにする。
+        snapshot_id, last_match_id, players（人数）を返す。前回から進んでいなければ None
+        """
+        raise NotImplementedError
+
+    def load_ratings(self, guild_id: int, at=None) -> dict:
+        """
+        at より前（未指定なら現在まで）の match_history を反映した {player_id: 状態} を返す。
+        状態は fold_history と同じ形。at より前に収まる最新のスナップショットと、
+        それ以降の履歴だけを読む
+        """
+        raise NotImplementedError
+
+    def add_season(self, guild_id: int, name: str) -> dict:
+        """
+        サーバーに現在時刻から始まるシーズンを登録し、name, started_at を返す。同じ名前があれば None
+        """
+        raise NotImplementedError
+
+    def get_seasons(self, guild_id: int) -> list:
+        """
+        サーバーのシーズンの name, started_at を開始順に返す
+        """
+        raise NotImplementedError
+
+
+def plan_undo(targets: list, rows, replay) -> tuple:
+    """
+    取り消しで書き換える内容を計算する（どのバックエンドでも共通）。
+    rows は取り消す最古の試合以降の match_history を試合順に並べた
+    (match_id, 行ID, player_id, rank, wins, μ前, σ前) の並び。
+    replay(rows, state) は1試合を計算し直して match_history の更新内容を返す関数。
+    戻り値は (players の更新 [(id, μ, σ, 減らす試合数, 減らす勝利数)], 対象プレイヤーID,
+    match_history の更新 [(行ID, μ前, σ前, μ後, σ後)], 再計算した試合数)
+    """
+    matches = {}
+    for mid, row_id, pid, rank, wins, mu_b, sig_b in rows:
+        matches.setdefault(mid, []).append((row_id, pid, rank, wins, mu_b, sig_b))
+
+    target_set = set(targets)
+    state = {}     # player_id -> 巻き戻し後の (μ, σ)
+    removed = {}   # player_id -> [取り消す試合数, 取り消す勝利数]
+    undone = []
+    history_updates = []
+    replayed = 0
+    for mid, match_rows in matches.items():
+        if mid in target_set:
+            for _, pid, _, wins, mu_b, sig_b in match_rows:
+                state.setdefault(pid, (mu_b, sig_b))
+                delta = removed.setdefault(pid, [0, 0])
+                delta[0] += 1
+                delta[1] += wins
+                if pid not in undone:
+                    undone.append(pid)
+        elif any(r[1] in state for r in match_rows):
+            history_updates += replay([(r[0], r[1], r[2], r[4], r[5]) for r in match_rows], state)
+            replayed += 1
+
+    player_updates = [
+        (pid, mu, sigma) + tuple(removed.get(pid, (0, 0)))
+        for pid, (mu, sigma) in state.items()
+    ]
+    return player_updates, undone, history_updates, replayed
+
+
+def match_pair_deltas(matches, sign: int = 1) -> list:
+    """
+    複数試合分のペア統計の増分を組ごとに合計する。
+    matches は (entry_order, pattern_set, patterns, outcome_mask) の並び。結果のない移行前の試合は数えない
+    """
+    totals = {}
+    for entry_order, pattern_set, patterns, mask in matches:
+        patterns = resolve_patterns(pattern_set, patterns)
+        if entry_order is None or patterns is None or mask is None:
+            continue
+        for a, b, *values in pair_deltas(entry_order, patterns, mask, sign):
+            row = totals.setdefault((a, b), [0, 0, 0, 0])
+            for i, v in enumerate(values):
+                row[i] += v
+    return [(a, b) + tuple(row) for (a, b), row in totals.items()]
+
+
+def fold_history(state: dict, rows) -> dict:
+    """
+    スナップショットの状態に match_history の行を適用する（どのバックエンドでも共通）。
+    state は {player_id: (μ, σ, 試合数, 勝利数, 最終試合の日時)}、
+    rows は (player_id, timestamp, wins, μ後, σ後) を行ID順（書き込み順）に並べたもの。
+    state を書き換えて返す
+    """
+    for pid, timestamp, wins, mu, sigma in rows:
+        _, _, games, total_wins, _ = state.get(pid, (None, None, 0, 0, None))
+        state[pid] = (mu, sigma, games + 1, total_wins + wins, timestamp)
+    return state
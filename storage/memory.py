@@ -0,0 +1,11 @@
+from storage.sqlite import SQLiteStorage
+
+
+class MemoryStorage(SQLiteStorage):
+    """
+    プロセス内だけで完結するバックエンド。終了すると内容は消える。
+    SQL の互換性を保つため、独自のデータ構造ではなく SQLite のインメモリ DB を使う。
+    """
+
+    def __init__(self):
+        super().__init__(":memory:")
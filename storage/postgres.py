@@ -0,0 +1,727 @@
+import time
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import RealDictCursor, Json
+from config import DB_CONFIG, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_HEALTHCHECK_IDLE
+from storage.base import Storage, ConflictError, plan_undo, match_pair_deltas, fold_history
+from metrics import DB_STATEMENTS, DB_PLANS
+
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool は枯渇時に例外を投げるので、空きが出るまで待たせる
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+_last_used = {}  # id(conn) -> 最後に返却された時刻
+_prepared = {}   # id(conn) -> その接続で PREPARE 済みの文の名前
+_plan_stats = {}  # id(conn) -> {文の名前: (generic plan の回数, custom plan の回数)}
+
+# コマンドのたびに実行する文。接続ごとに初回だけ PREPARE し、以降は名前を指定して EXECUTE する
+# （SQL の解析を省き、PostgreSQL が実行計画を使い回せるようにする）。
+# 名前 -> (引数の型, 引数を $1, $2, ... で書いた SQL)。複数行の書き込みは配列を unnest して1文で送る
+STATEMENTS = {
+    "get_players": (("bigint", "bigint[]"), """
+        SELECT guild_id, id, mu, sigma, games, wins, last_match, version
+        FROM players
+        WHERE guild_id = $1 AND id = ANY($2)
+    """),
+    "save_players": (
+        ("bigint", "bigint[]", "double precision[]", "double precision[]", "integer[]", "integer[]",
+         "timestamp[]", "integer[]"),
+        # 読み込んだときから version が変わっていない行だけを更新する
+        """
+        UPDATE players p SET
+            mu = v.mu,
+            sigma = v.sigma,
+            games = v.games,
+            wins = v.wins,
+            last_match = v.last_match,
+            version = p.version + 1
+        FROM unnest($2, $3, $4, $5, $6, $7, $8) AS v (id, mu, sigma, games, wins, last_match, version)
+        WHERE p.guild_id = $1 AND p.id = v.id AND p.version = v.version
+        RETURNING p.guild_id, p.id, p.mu, p.sigma, p.games, p.wins, p.last_match, p.version
+        """
+    ),
+    "insert_history": (
+        ("bigint", "bigint[]", "bigint[]", "timestamp[]", "integer[]", "integer[]",
+         "double precision[]", "double precision[]", "double precision[]", "double precision[]"),
+        """
+        INSERT INTO match_history (
+            guild_id, player_id, match_id, timestamp, rank, wins,
+            mu_before, sigma_before, mu_after, sigma_after
+        )
+        SELECT $1, * FROM unnest($2, $3, $4, $5, $6, $7, $8, $9, $10)
+        """
+    ),
+    "finish_match": (("bigint", "integer"), """
+        WITH games AS (DELETE FROM match_games WHERE match_id = $1)
+        UPDATE matches SET status = 'finished', ended_at = LOCALTIMESTAMP, outcome_mask = $2
+        WHERE match_id = $1
+    """),
+    "add_pair_stats": (
+        ("bigint", "bigint[]", "bigint[]", "integer[]", "integer[]", "integer[]", "integer[]"),
+        """
+        INSERT INTO pair_stats AS s
+            (guild_id, player_a, player_b, together_games, together_wins, versus_games, a_wins)
+        SELECT $1, * FROM unnest($2, $3, $4, $5, $6, $7)
+        ON CONFLICT (guild_id, player_a, player_b) DO UPDATE SET
+            together_games = s.together_games + EXCLUDED.together_games,
+            together_wins = s.together_wins + EXCLUDED.together_wins,
+            versus_games = s.versus_games + EXCLUDED.versus_games,
+            a_wins = s.a_wins + EXCLUDED.a_wins
+        """
+    ),
+    "get_player_history": (("bigint", "bigint"), """
+        SELECT id, player_id, match_id, timestamp, rank, wins,
+               mu_before, sigma_before, mu_after, sigma_after
+        FROM match_history
+        WHERE guild_id = $1 AND player_id = $2
+        ORDER BY timestamp DESC
+    """),
+    "get_player_summary": (("bigint", "bigint"), """
+        SELECT
+            COUNT(*) AS match_count,
+            COUNT(*) FILTER (WHERE h.rank = 0) AS wins,
+            AVG(h.rank + 1) AS avg_rank,
+            MAX(h.match_id) AS latest_match_id,
+            (
+                SELECT l.mu_after - 3 * l.sigma_after
+                FROM match_history l
+                WHERE l.guild_id = $1 AND l.player_id = $2
+                ORDER BY l.match_id DESC
+                LIMIT 1
+            ) AS latest_rating
+        FROM match_history h
+        WHERE h.guild_id = $1 AND h.player_id = $2
+    """),
+    "get_rating_series": (("bigint", "bigint", "integer"), """
+        SELECT n, rating
+        FROM (
+            SELECT
+                ROW_NUMBER() OVER (ORDER BY match_id) AS n,
+                COUNT(*) OVER () AS total,
+                mu_after - 3 * sigma_after AS rating
+            FROM match_history
+            WHERE guild_id = $1 AND player_id = $2
+        ) h
+        WHERE total <= $3
+           OR (n - 1) % CEIL(total::numeric / $3)::int = 0
+           OR n = total
+        ORDER BY n
+    """),
+    "record_game": (("bigint", "smallint", "boolean"), """
+        INSERT INTO match_games (match_id, game_no, team1_won)
+        VALUES ($1, $2, $3)
+        ON CONFLICT (match_id, game_no) DO UPDATE SET
+            team1_won = EXCLUDED.team1_won,
+            recorded_at = LOCALTIMESTAMP
+    """),
+    "get_match_games": (("bigint",), """
+        SELECT team1_won FROM match_games
+        WHERE match_id = $1
+        ORDER BY game_no
+    """),
+    "get_pair_stats": (("bigint", "bigint", "bigint"), """
+        SELECT together_games, together_wins, versus_games, a_wins
+        FROM pair_stats
+        WHERE guild_id = $1 AND player_a = $2 AND player_b = $3
+    """),
+    "get_partner_stats": (("bigint", "bigint"), """
+        SELECT player_b AS other, together_games, together_wins,
+               versus_games, a_wins AS wins_against
+        FROM pair_stats WHERE guild_id = $1 AND player_a = $2
+        UNION ALL
+        SELECT player_a, together_games, together_wins,
+               versus_games, versus_games - a_wins
+        FROM pair_stats WHERE guild_id = $1 AND player_b = $2
+    """),
+    "undo_target": (("bigint", "bigint"), """
+        SELECT match_id, entry_order, pattern_set, patterns, outcome_mask FROM matches
+        WHERE match_id = $1 AND status = 'finished' AND guild_id = $2
+        FOR UPDATE
+    """),
+    "undo_latest": (("bigint", "integer"), """
+        SELECT match_id, entry_order, pattern_set, patterns, outcome_mask FROM matches
+        WHERE guild_id = $1 AND status = 'finished'
+        ORDER BY match_id DESC
+        LIMIT $2
+        FOR UPDATE
+    """),
+    "undo_lock_players": (("bigint",), """
+        SELECT id FROM players
+        WHERE guild_id = $1
+        ORDER BY id
+        FOR UPDATE
+    """),
+    "undo_history_since": (("bigint", "bigint"), """
+        SELECT match_id, id, player_id, rank, wins, mu_before, sigma_before
+        FROM match_history
+        WHERE guild_id = $1 AND match_id >= $2
+        ORDER BY match_id, id
+    """),
+    "undo_replay_history": (
+        ("bigint[]", "double precision[]", "double precision[]", "double precision[]", "double precision[]"),
+        """
+        UPDATE match_history h SET
+            mu_before = v.mu_before, sigma_before = v.sigma_before,
+            mu_after = v.mu_after, sigma_after = v.sigma_after
+        FROM unnest($1, $2, $3, $4, $5) AS v (id, mu_before, sigma_before, mu_after, sigma_after)
+        WHERE h.id = v.id
+        """
+    ),
+    "undo_remove": (("bigint", "bigint[]"), """
+        WITH history AS (DELETE FROM match_history WHERE guild_id = $1 AND match_id = ANY($2)),
+             snapshots AS (
+                 DELETE FROM rating_snapshots
+                 WHERE guild_id = $1 AND last_match_id >= (SELECT MIN(m) FROM unnest($2) m)
+             )
+        UPDATE matches SET status = 'undone' WHERE match_id = ANY($2)
+    """),
+    "undo_restore_players": (
+        ("bigint", "bigint[]", "double precision[]", "double precision[]", "integer[]", "integer[]"),
+        """
+        UPDATE players p SET
+            mu = v.mu,
+            sigma = v.sigma,
+            games = p.games - v.games,
+            wins = p.wins - v.wins,
+            version = p.version + 1,
+            last_match = (
+                SELECT h.timestamp
+                FROM match_history h
+                WHERE h.guild_id = p.guild_id AND h.player_id = p.id
+                ORDER BY h.match_id DESC
+                LIMIT 1
+            )
+        FROM unnest($2, $3, $4, $5, $6) AS v (id, mu, sigma, games, wins)
+        WHERE p.guild_id = $1 AND p.id = v.id
+        RETURNING p.guild_id, p.id, p.mu, p.sigma, p.games, p.wins, p.last_match, p.version
+        """
+    ),
+}
+
+
+def _get_pool():
+    """
+    プロセス共有のコネクションプールを返す（初回呼び出し時に作成）
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pg_pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, **DB_CONFIG)
+    return _pool
+
+
+def _is_healthy(conn) -> bool:
+    """
+    接続が使える状態か確認する。
+    しばらくアイドルだった接続だけクエリを投げて確かめる。
+    """
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0.0) < DB_POOL_HEALTHCHECK_IDLE:
+        return True
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # 疎通確認を兼ねて、この接続のプリペアド文が generic / custom plan のどちらで実行されたかを取る
+            cur.execute("SELECT * FROM pg_prepared_statements")
+            _record_plan_stats(conn, cur.fetchall())
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _record_plan_stats(conn, rows):
+    """
+    pg_prepared_statements の行を接続ごとに覚え、全接続の合計を DB_PLANS に反映する
+    （generic_plans / custom_plans は PostgreSQL 14 以降にしかない）
+    """
+    _plan_stats[id(conn)] = {
+        row['name']: (row.get('generic_plans', 0), row.get('custom_plans', 0)) for row in rows
+    }
+    _publish_plan_stats()
+
+
+def _publish_plan_stats():
+    """
+    接続ごとの統計を合計して DB_PLANS に入れる（捨てた接続の分は減らす）
+    """
+    totals = {labels: 0 for labels in DB_PLANS.snapshot()}
+    for stats in list(_plan_stats.values()):
+        for name, (generic, custom) in stats.items():
+            totals[(name, "generic")] = totals.get((name, "generic"), 0) + generic
+            totals[(name, "custom")] = totals.get((name, "custom"), 0) + custom
+    for (name, plan), count in totals.items():
+        DB_PLANS.set(count, name, plan)
+
+
+def _release(conn, discard: bool = False):
+    """
+    接続をプールに返す。壊れた接続は閉じて捨てる（次回の貸し出しで再接続される）
+    """
+    discard = discard or bool(conn.closed)
+    if not discard:
+        _last_used[id(conn)] = time.monotonic()
+    _get_pool().putconn(conn, close=discard)
+    # DB_POOL_MIN を下げていると、それを超えた分はプールが閉じる。閉じた接続の id は新しい接続に再利用されうるので情報を消す
+    if conn.closed:
+        _last_used.pop(id(conn), None)
+        _prepared.pop(id(conn), None)
+        if _plan_stats.pop(id(conn), None) is not None:
+            _publish_plan_stats()
+
+
+def _acquire():
+    """
+    プールから疎通確認済みの接続を借りる
+    """
+    pool = _get_pool()
+    # プール内の接続がすべて切れていても、最後は新規接続になる
+    for _ in range(DB_POOL_MAX + 1):
+        conn = pool.getconn()
+        if _is_healthy(conn):
+            return conn
+        _release(conn, discard=True)
+    raise psycopg2.OperationalError("データベースに接続できません")
+
+
+@contextmanager
+def get_connection():
+    """
+    プールから接続を借りる context manager。
+    ブロックを正常に抜けたら commit、例外なら rollback してプールへ返す。
+
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                ...
+    """
+    _pool_slots.acquire()
+    conn = None
+    discard = False
+    try:
+        conn = _acquire()
+        yield conn
+        conn.commit()
+    except BaseException as e:
+        if conn is not None:
+            # 通信エラーで切れた接続は再利用しない
+            discard = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            if isinstance(e, psycopg2.errors.InvalidSqlStatementName):
+                # DISCARD ALL などでプリペアド文が消えていたら、次回は PREPARE し直す
+                _prepared.pop(id(conn), None)
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        raise
+    finally:
+        if conn is not None:
+            _release(conn, discard)
+        _pool_slots.release()
+
+
+def close_pool():
+    """
+    プール内の全接続を閉じる（Bot 終了時に呼ぶ）
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _last_used.clear()
+            _prepared.clear()
+            _plan_stats.clear()
+
+
+def execute_prepared(cur, name: str, *params):
+    """
+    STATEMENTS の文を名前で実行する。この接続でまだ PREPARE していなければ先に PREPARE する
+    """
+    types, sql = STATEMENTS[name]
+    prepared = _prepared.setdefault(id(cur.connection), set())
+    if name not in prepared:
+        # PREPARE はトランザクションを rollback しても残るので、成功した時点で登録済みにしてよい
+        cur.execute(f"PREPARE {name} ({', '.join(types)}) AS {sql}")
+        prepared.add(name)
+        DB_STATEMENTS.inc(name, "prepare")
+    DB_STATEMENTS.inc(name, "execute")
+    cur.execute(f"EXECUTE {name} ({', '.join(f'%s::{t}' for t in types)})", params)
+
+
+def _columns(rows: list, width: int) -> list:
+    """
+    行のリストを列ごとのリストにする（unnest に配列で渡すため）
+    """
+    return [list(col) for col in zip(*rows)] if rows else [[] for _ in range(width)]
+
+
+def add_pair_stats(cur, guild_id: int, rows: list):
+    """
+    ペア統計の増分（outcomes.pair_deltas の形式）をサーバーの pair_stats に1文で足し込む
+    """
+    if not rows:
+        return
+    # 同時に書き込む試合どうしがデッドロックしないよう、常に同じ順で行をロックする
+    execute_prepared(cur, "add_pair_stats", guild_id, *_columns(sorted(rows), 6))
+
+
+def _load_snapshot(cur, guild_id: int, max_match_id: int = None, before=None) -> tuple:
+    """
+    サーバーのスナップショットのうち、last_match_id が max_match_id 以下で、
+    before より前の履歴だけからなる最新のものを (fold_history の状態, last_match_id) で返す。なければ ({}, 0)
+    """
+    cur.execute(
+        """
+        SELECT snapshot_id, last_match_id FROM rating_snapshots
+        WHERE guild_id = %(guild_id)s
+          AND (%(max_match_id)s::BIGINT IS NULL OR last_match_id <= %(max_match_id)s)
+          AND (%(before)s::TIMESTAMP IS NULL OR last_timestamp < %(before)s)
+        ORDER BY last_match_id DESC
+        LIMIT 1
+        """,
+        {"guild_id": guild_id, "max_match_id": max_match_id, "before": before}
+    )
+    row = cur.fetchone()
+    if row is None:
+        return {}, 0
+    cur.execute(
+        """
+        SELECT player_id, mu, sigma, games, wins, last_match
+        FROM rating_snapshot_players
+        WHERE snapshot_id = %s
+        """,
+        (row[0],)
+    )
+    return {r[0]: tuple(r[1:]) for r in cur.fetchall()}, row[1]
+
+
+class PostgresStorage(Storage):
+    """
+    PostgreSQL のバックエンド。接続はプロセス共有のコネクションプールから借りる
+    """
+
+    def migrate(self) -> list:
+        import schema
+        return schema.migrate()
+
+    def close(self):
+        close_pool()
+
+    def get_state(self, key: str) -> str:
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT value FROM bot_state WHERE key = %s", (key,))
+            row = cur.fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key: str, value: str):
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO bot_state (key, value) VALUES (%s, %s)
+                ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = LOCALTIMESTAMP
+                """,
+                (key, value)
+            )
+
+    def get_players(self, guild_id: int, player_ids: list) -> dict:
+        with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, "get_players", guild_id, [int(pid) for pid in player_ids])
+            rows = cur.fetchall()
+        return {row['id']: dict(row) for row in rows}
+
+    def get_all_players(self, guild_id: int) -> list:
+        with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                "SELECT guild_id, id, mu, sigma, games, wins, last_match, version FROM players WHERE guild_id = %s",
+                (guild_id,)
+            )
+            players = cur.fetchall()
+        return players
+
+    def upsert_player(self, guild_id: int, player_id: int, mu: float, sigma: float, games: int, wins: int,
+                      last_match) -> dict:
+        with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                INSERT INTO players AS p (guild_id, id, mu, sigma, games, wins, last_match)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (guild_id, id) DO UPDATE SET
+                    mu = EXCLUDED.mu,
+                    sigma = EXCLUDED.sigma,
+                    games = EXCLUDED.games,
+                    wins = EXCLUDED.wins,
+                    last_match = EXCLUDED.last_match,
+                    version = p.version + 1
+                RETURNING guild_id, id, mu, sigma, games, wins, last_match, version
+                """,
+                (guild_id, player_id, mu, sigma, games, wins, last_match)
+            )
+            row = cur.fetchone()
+        return row
+
+    def insert_match_history(self, guild_id: int, player_id: int, match_id: int, timestamp, rank: int, wins: int,
+                             mu_before: float, sigma_before: float, mu_after: float, sigma_after: float):
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO match_history (
+                    guild_id, player_id, match_id, timestamp, rank, wins,
+                    mu_before, sigma_before, mu_after, sigma_after
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                (guild_id, player_id, match_id, timestamp, rank, wins, mu_before, sigma_before, mu_after, sigma_after)
+            )
+
+    def save_match_results(self, guild_id: int, match_id: int, players: list, history: list, outcome_mask: int,
+                           pairs: list) -> list:
+        try:
+            return self._save_match_results(guild_id, match_id, players, history, outcome_mask, pairs)
+        except psycopg2.extensions.TransactionRollbackError:
+            # 同じプレイヤーを含む試合と同時に書き込んでデッドロックした場合も、読み直してやり直せばよい
+            raise ConflictError(int(p['player_id']) for p in players)
+
+    def _save_match_results(self, guild_id: int, match_id: int, players: list, history: list, outcome_mask: int,
+                            pairs: list) -> list:
+        # 人数に関わらず players の更新と match_history の insert はそれぞれ1文で送る
+        with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, "save_players", guild_id, *_columns([
+                (p['player_id'], p['mu'], p['sigma'], p['games'], p['wins'], p['last_match'], p['version'])
+                for p in players
+            ], 7))
+            updated = cur.fetchall()
+            if len(updated) != len(players):
+                # 例外で抜けるので、このトランザクションは rollback される
+                raise ConflictError({int(p['player_id']) for p in players} - {row['id'] for row in updated})
+            execute_prepared(cur, "insert_history", guild_id, *_columns([
+                (h['player_id'], h['match_id'], h['timestamp'], h['rank'], h['wins'],
+                 h['mu_before'], h['sigma_before'], h['mu_after'], h['sigma_after'])
+                for h in history
+            ], 9))
+            execute_prepared(cur, "finish_match", match_id, outcome_mask)
+            add_pair_stats(cur, guild_id, pairs)
+        return updated
+
+    def get_player_history(self, guild_id: int, player_id: int) -> list:
+        with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, "get_player_history", guild_id, player_id)
+            history = cur.fetchall()
+        return history
+
+    def get_player_summary(self, guild_id: int, player_id: int) -> dict:
+        with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, "get_player_summary", guild_id, player_id)
+            summary = cur.fetchone()
+        if not summary['match_count']:
+            return None
+        return summary
+
+    def get_rating_series(self, guild_id: int, player_id: int, max_points: int) -> list:
+        with get_connection() as conn, conn.cursor() as cur:
+            execute_prepared(cur, "get_rating_series", guild_id, player_id, max_points)
+            series = cur.fetchall()
+        return series
+
+    def start_match(self, guild_id: int, channel_id: int, host_id: int, entry_order: list,
+                    pattern_set: int, patterns: list) -> int:
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE matches SET status = 'aborted', ended_at = LOCALTIMESTAMP
+                WHERE channel_id = %s AND status = 'running'
+                """,
+                (channel_id,)
+            )
+            cur.execute(
+                """
+                INSERT INTO matches (guild_id, channel_id, host_id, entry_order, pattern_set, patterns)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                RETURNING match_id
+                """,
+                (guild_id, channel_id, host_id, [int(uid) for uid in entry_order], pattern_set,
+                 Json(patterns) if patterns is not None else None)
+            )
+            match_id = cur.fetchone()[0]
+        return match_id
+
+    def record_game(self, match_id: int, game_no: int, team1_won: bool):
+        with get_connection() as conn, conn.cursor() as cur:
+            execute_prepared(cur, "record_game", match_id, game_no, team1_won)
+
+    def get_match_games(self, match_id: int) -> list:
+        with get_connection() as conn, conn.cursor() as cur:
+            execute_prepared(cur, "get_match_games", match_id)
+            games = [row[0] for row in cur.fetchall()]
+        return games
+
+    def get_running_matches(self, channel_id: int = None) -> list:
+        with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                SELECT m.match_id, m.guild_id, m.channel_id, m.host_id, m.entry_order, m.pattern_set, m.patterns,
+                       COALESCE(
+                           array_agg(g.team1_won ORDER BY g.game_no) FILTER (WHERE g.game_no IS NOT NULL),
+                           '{}'
+                       ) AS games
+                FROM matches m
+                LEFT JOIN match_games g ON g.match_id = m.match_id
+                WHERE m.status = 'running'
+                  AND m.entry_order IS NOT NULL
+                  AND (%(channel_id)s::BIGINT IS NULL OR m.channel_id = %(channel_id)s)
+                GROUP BY m.match_id
+                ORDER BY m.match_id
+                """,
+                {"channel_id": channel_id}
+            )
+            matches = cur.fetchall()
+        return matches
+
+    def abort_match(self, match_id: int):
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE matches SET status = 'aborted', ended_at = LOCALTIMESTAMP
+                WHERE match_id = %s AND status = 'running'
+                """,
+                (match_id,)
+            )
+
+    def get_pair_stats(self, guild_id: int, player_a: int, player_b: int) -> dict:
+        with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, "get_pair_stats", guild_id, player_a, player_b)
+            row = cur.fetchone()
+        return row
+
+    def get_partner_stats(self, guild_id: int, player_id: int) -> list:
+        with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            execute_prepared(cur, "get_partner_stats", guild_id, player_id)
+            rows = cur.fetchall()
+        return rows
+
+    def undo_matches(self, guild_id: int, count: int, match_id: int, replay) -> tuple:
+        try:
+            return self._undo_matches(guild_id, count, match_id, replay)
+        except psycopg2.extensions.TransactionRollbackError:
+            # 試合結果の書き込みとデッドロックした。何も書かれていないのでやり直せばよい
+            raise ConflictError(())
+
+    def _undo_matches(self, guild_id: int, count: int, match_id: int, replay) -> tuple:
+        with get_connection() as conn, conn.cursor() as cur:
+            if match_id is not None:
+                execute_prepared(cur, "undo_target", match_id, guild_id)
+            else:
+                execute_prepared(cur, "undo_latest", guild_id, count)
+            found = cur.fetchall()
+            targets = sorted(row[0] for row in found)
+            if not targets:
+                return [], [], 0, []
+
+            # 履歴を読んでからレートを書き戻すまでに試合結果の保存が割り込まないよう、
+            # サーバーのプレイヤー行を先に id 順でロックする（保存側は version の不一致でやり直しになる）
+            execute_prepared(cur, "undo_lock_players", guild_id)
+            # 取り消す試合以降の履歴を試合順に読み、影響が広がる試合だけ計算し直す
+            execute_prepared(cur, "undo_history_since", guild_id, targets[0])
+            player_updates, undone, history_updates, replayed = plan_undo(targets, cur.fetchall(), replay)
+
+            if history_updates:
+                execute_prepared(cur, "undo_replay_history", *_columns(history_updates, 5))
+            execute_prepared(cur, "undo_remove", guild_id, targets)
+            add_pair_stats(cur, guild_id, match_pair_deltas([row[1:] for row in found], sign=-1))
+            execute_prepared(cur, "undo_restore_players", guild_id, *_columns(player_updates, 5))
+            restored = cur.fetchall()
+        restored = [dict(zip(('guild_id', 'id', 'mu', 'sigma', 'games', 'wins', 'last_match', 'version'), row)) for row in restored]
+        return targets, undone, replayed, restored
+
+    def take_snapshot(self, guild_id: int) -> dict:
+        try:
+            return self._take_snapshot(guild_id)
+        except psycopg2.extensions.TransactionRollbackError:
+            # 別のプロセスが同じ境界のスナップショットを同時に書き込んだ
+            return None
+
+    def _take_snapshot(self, guild_id: int) -> dict:
+        with get_connection() as conn, conn.cursor() as cur:
+            # 境界の計算から書き込みまで、同じ時点のデータを見る
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            cur.execute("""
+                SELECT LEAST(
+                    (SELECT MAX(match_id) FROM matches WHERE guild_id = %(guild_id)s AND status = 'finished'),
+                    (SELECT MIN(match_id) - 1 FROM matches WHERE guild_id = %(guild_id)s AND status = 'running')
+                );
+            """, {"guild_id": guild_id})
+            boundary = cur.fetchone()[0]
+            if boundary is None:
+                return None
+            state, base_match_id = _load_snapshot(cur, guild_id, max_match_id=boundary)
+            if base_match_id == boundary:
+                return None
+            cur.execute("""
+                SELECT player_id, timestamp, wins, mu_after, sigma_after
+                FROM match_history
+                WHERE guild_id = %s AND match_id > %s AND match_id <= %s
+                ORDER BY id;
+            """, (guild_id, base_match_id, boundary))
+            fold_history(state, cur.fetchall())
+
+            last_timestamp = max((s[4] for s in state.values() if s[4] is not None), default=None)
+            cur.execute("""
+                INSERT INTO rating_snapshots (guild_id, last_match_id, last_timestamp) VALUES (%s, %s, %s)
+                ON CONFLICT (guild_id, last_match_id) DO NOTHING
+                RETURNING snapshot_id;
+            """, (guild_id, boundary, last_timestamp))
+            row = cur.fetchone()
+            if row is None:
+                return None
+            cur.execute("""
+                INSERT INTO rating_snapshot_players (snapshot_id, player_id, mu, sigma, games, wins, last_match)
+                SELECT %s, * FROM unnest(
+                    %s::BIGINT[], %s::DOUBLE PRECISION[], %s::DOUBLE PRECISION[],
+                    %s::INTEGER[], %s::INTEGER[], %s::TIMESTAMP[]
+                );
+            """, [row[0]] + _columns([(pid,) + s for pid, s in state.items()], 6))
+        return {"snapshot_id": row[0], "last_match_id": boundary, "players": len(state)}
+
+    def load_ratings(self, guild_id: int, at=None) -> dict:
+        with get_connection() as conn, conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            state, base_match_id = _load_snapshot(cur, guild_id, before=at)
+            # at より前に始まった試合までに絞ってから、at より前の行だけを読む
+            cur.execute("""
+                SELECT player_id, timestamp, wins, mu_after, sigma_after
+                FROM match_history
+                WHERE guild_id = %(guild_id)s
+                  AND match_id > %(base)s
+                  AND (%(at)s::TIMESTAMP IS NULL OR (
+                      match_id <= (
+                          SELECT MAX(match_id) FROM matches
+                          WHERE guild_id = %(guild_id)s AND started_at < %(at)s
+                      )
+                      AND timestamp < %(at)s
+                  ))
+                ORDER BY id;
+            """, {"guild_id": guild_id, "base": base_match_id, "at": at})
+            return fold_history(state, cur.fetchall())
+
+    def add_season(self, guild_id: int, name: str) -> dict:
+        with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                INSERT INTO seasons (guild_id, name) VALUES (%s, %s)
+                ON CONFLICT (guild_id, name) DO NOTHING
+                RETURNING name, started_at
+                """,
+                (guild_id, name)
+            )
+            row = cur.fetchone()
+        return row
+
+    def get_seasons(self, guild_id: int) -> list:
+        with get_connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                "SELECT name, started_at FROM seasons WHERE guild_id = %s ORDER BY started_at",
+                (guild_id,)
+            )
+            seasons = cur.fetchall()
+        return seasons
@@ -0,0 +1,826 @@
+"""
+SQLite のバックエンド。DB サーバーなしで Bot・ベンチマークを動かすためのもの。
+1プロセス内で1つの接続を共有し、ロックで直列化する（WAL なので外部からの読み取りは妨げない）。
+"""
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from outcomes import PATTERN_SETS
+from storage.base import Storage, ConflictError, plan_undo, match_pair_deltas, fold_history
+from config import LEGACY_GUILD_ID
+
+# SQLite には TIMESTAMP 型がないので、ISO 形式の文字列で保存して読み出し時に戻す
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", lambda value: datetime.fromisoformat(value.decode()))
+
+_NOW = "(strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'))"
+_PLAYER_COLUMNS = "guild_id, id, mu, sigma, games, wins, last_match, version"
+# 1文に埋め込むプレースホルダ数の上限（古い SQLite の既定値 999 に収める）
+_MAX_PARAMS = 900
+
+def _compact_results(cur):
+    """
+    schema._compact_results と同じ移行（ゲーム結果のビットマスク化と pair_stats の作成）
+    """
+    cur.execute("ALTER TABLE matches ADD COLUMN outcome_mask INTEGER")
+    cur.execute("ALTER TABLE matches ADD COLUMN pattern_set INTEGER")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pair_stats (
+            player_a INTEGER NOT NULL,
+            player_b INTEGER NOT NULL,
+            together_games INTEGER NOT NULL DEFAULT 0,
+            together_wins INTEGER NOT NULL DEFAULT 0,
+            versus_games INTEGER NOT NULL DEFAULT 0,
+            a_wins INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (player_a, player_b),
+            CHECK (player_a < player_b)
+        ) WITHOUT ROWID
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS pair_stats_player_b_idx ON pair_stats (player_b)")
+    cur.execute(
+        """
+        UPDATE matches SET outcome_mask = (
+            SELECT COALESCE(SUM(CASE WHEN g.team1_won THEN 1 << g.game_no ELSE 0 END), 0)
+            FROM match_games g
+            WHERE g.match_id = matches.match_id
+        )
+        WHERE status = 'finished'
+          AND EXISTS (SELECT 1 FROM match_games g WHERE g.match_id = matches.match_id)
+        """
+    )
+    cur.execute(
+        """
+        DELETE FROM match_games
+        WHERE match_id IN (SELECT match_id FROM matches WHERE status <> 'running')
+        """
+    )
+    for set_id, patterns in PATTERN_SETS.items():
+        cur.execute(
+            "UPDATE matches SET pattern_set = ?, patterns = NULL WHERE patterns = ?",
+            (set_id, json.dumps(patterns))
+        )
+    cur.execute(
+        """
+        SELECT entry_order, pattern_set, patterns, outcome_mask
+        FROM matches
+        WHERE status = 'finished' AND outcome_mask IS NOT NULL
+        """
+    )
+    # この時点の pair_stats にはまだ guild_id がない
+    cur.executemany(
+        """
+        INSERT INTO pair_stats (player_a, player_b, together_games, together_wins, versus_games, a_wins)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        match_pair_deltas(_decode_match(row) for row in cur.fetchall())
+    )
+
+
+def _partition_by_guild(cur):
+    """
+    schema._partition_by_guild と同じ移行。主キーを変える表は作り直す
+    """
+    legacy = LEGACY_GUILD_ID
+    if legacy is None:
+        cur.execute(
+            """
+            SELECT guild_id FROM matches
+            WHERE guild_id IS NOT NULL
+            GROUP BY guild_id
+            ORDER BY COUNT(*) DESC
+            LIMIT 1
+            """
+        )
+        row = cur.fetchone()
+        legacy = row[0] if row else 0
+    cur.execute("UPDATE matches SET guild_id = ? WHERE guild_id IS NOT ?", (legacy, legacy))
+    if cur.rowcount:
+        print(f"schema: 既存の {cur.rowcount} 試合をサーバー {legacy} に割り当てました")
+    # 列の DEFAULT にはプレースホルダを使えないので、整数にしてから埋め込む
+    legacy = int(legacy)
+    for sql in [
+        "ALTER TABLE players RENAME TO players_old",
+        """
+        CREATE TABLE players (
+            guild_id INTEGER NOT NULL,
+            id INTEGER NOT NULL,
+            mu REAL,
+            sigma REAL,
+            games INTEGER,
+            wins INTEGER,
+            last_match TIMESTAMP,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, id)
+        )
+        """,
+        f"""
+        INSERT INTO players (guild_id, id, mu, sigma, games, wins, last_match, version)
+        SELECT {legacy}, id, mu, sigma, games, wins, last_match, version FROM players_old
+        """,
+        "DROP TABLE players_old",
+        f"ALTER TABLE match_history ADD COLUMN guild_id INTEGER NOT NULL DEFAULT {legacy}",
+        "ALTER TABLE pair_stats RENAME TO pair_stats_old",
+        """
+        CREATE TABLE pair_stats (
+            guild_id INTEGER NOT NULL,
+            player_a INTEGER NOT NULL,
+            player_b INTEGER NOT NULL,
+            together_games INTEGER NOT NULL DEFAULT 0,
+            together_wins INTEGER NOT NULL DEFAULT 0,
+            versus_games INTEGER NOT NULL DEFAULT 0,
+            a_wins INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, player_a, player_b),
+            CHECK (player_a < player_b)
+        ) WITHOUT ROWID
+        """,
+        f"INSERT INTO pair_stats SELECT {legacy}, * FROM pair_stats_old",
+        "DROP TABLE pair_stats_old",
+        "ALTER TABLE seasons RENAME TO seasons_old",
+        f"""
+        CREATE TABLE seasons (
+            guild_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            started_at TIMESTAMP NOT NULL DEFAULT {_NOW},
+            PRIMARY KEY (guild_id, name)
+        )
+        """,
+        f"INSERT INTO seasons SELECT {legacy}, * FROM seasons_old",
+        "DROP TABLE seasons_old",
+        # スナップショットは作り直せるので消す
+        "DROP TABLE rating_snapshot_players",
+        "DROP TABLE rating_snapshots",
+        f"""
+        CREATE TABLE rating_snapshots (
+            snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            last_match_id INTEGER NOT NULL,
+            last_timestamp TIMESTAMP,
+            created_at TIMESTAMP NOT NULL DEFAULT {_NOW},
+            UNIQUE (guild_id, last_match_id)
+        )
+        """,
+        """
+        CREATE TABLE rating_snapshot_players (
+            snapshot_id INTEGER NOT NULL REFERENCES rating_snapshots (snapshot_id) ON DELETE CASCADE,
+            player_id INTEGER NOT NULL,
+            mu REAL NOT NULL,
+            sigma REAL NOT NULL,
+            games INTEGER NOT NULL,
+            wins INTEGER NOT NULL,
+            last_match TIMESTAMP,
+            PRIMARY KEY (snapshot_id, player_id)
+        ) WITHOUT ROWID
+        """,
+        "DROP INDEX IF EXISTS match_history_player_match_idx",
+        "DROP INDEX IF EXISTS match_history_player_timestamp_idx",
+        "DROP INDEX IF EXISTS match_history_match_idx",
+        "DROP INDEX IF EXISTS matches_finished_idx",
+        "DROP INDEX IF EXISTS matches_started_idx",
+        "CREATE INDEX players_conservative_idx ON players (guild_id, (mu - 3 * sigma) DESC, id)",
+        "CREATE INDEX match_history_player_match_idx ON match_history (guild_id, player_id, match_id)",
+        "CREATE INDEX match_history_player_timestamp_idx ON match_history (guild_id, player_id, timestamp DESC)",
+        "CREATE INDEX match_history_match_idx ON match_history (guild_id, match_id)",
+        "CREATE INDEX pair_stats_player_b_idx ON pair_stats (guild_id, player_b)",
+        "CREATE INDEX matches_finished_idx ON matches (guild_id, match_id DESC) WHERE status = 'finished'",
+        "CREATE INDEX matches_started_idx ON matches (guild_id, started_at)",
+        "ANALYZE",
+    ]:
+        cur.execute(sql)
+
+
+def _decode_match(row) -> tuple:
+    """
+    matches の (entry_order, pattern_set, patterns, outcome_mask) の JSON 列を戻す
+    """
+    entry_order, pattern_set, patterns, mask = row
+    return (
+        json.loads(entry_order) if entry_order is not None else None,
+        pattern_set,
+        json.loads(patterns) if patterns is not None else None,
+        mask,
+    )
+
+
+def _add_pair_stats(cur, guild_id: int, rows: list):
+    cur.executemany(
+        """
+        INSERT INTO pair_stats (guild_id, player_a, player_b, together_games, together_wins, versus_games, a_wins)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (guild_id, player_a, player_b) DO UPDATE SET
+            together_games = together_games + excluded.together_games,
+            together_wins = together_wins + excluded.together_wins,
+            versus_games = versus_games + excluded.versus_games,
+            a_wins = a_wins + excluded.a_wins
+        """,
+        [(guild_id,) + tuple(row) for row in rows]
+    )
+
+
+# (バージョン, 説明, SQL またはカーソルを受け取る関数)。バージョン番号は schema.MIGRATIONS と揃え、
+# 追加は末尾にのみ行うこと
+MIGRATIONS = [
+    (1, "players / match_history", """
+        CREATE TABLE IF NOT EXISTS players (
+            id INTEGER PRIMARY KEY,
+            mu REAL,
+            sigma REAL,
+            games INTEGER,
+            wins INTEGER,
+            last_match TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS match_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            player_id INTEGER,
+            match_id INTEGER,
+            timestamp TIMESTAMP,
+            rank INTEGER,
+            wins INTEGER,
+            mu_before REAL,
+            sigma_before REAL,
+            mu_after REAL,
+            sigma_after REAL
+        );
+    """),
+    (2, "matches", f"""
+        CREATE TABLE IF NOT EXISTS matches (
+            match_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER,
+            channel_id INTEGER,
+            host_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'running',
+            started_at TIMESTAMP NOT NULL DEFAULT {_NOW},
+            ended_at TIMESTAMP,
+            entry_order TEXT,
+            patterns TEXT
+        );
+        CREATE INDEX IF NOT EXISTS matches_finished_idx
+            ON matches (match_id DESC) WHERE status = 'finished';
+        CREATE INDEX IF NOT EXISTS matches_running_idx
+            ON matches (channel_id) WHERE status = 'running';
+    """),
+    (3, "match_games", f"""
+        CREATE TABLE IF NOT EXISTS match_games (
+            match_id INTEGER NOT NULL REFERENCES matches (match_id) ON DELETE CASCADE,
+            game_no INTEGER NOT NULL,
+            team1_won INTEGER NOT NULL,
+            recorded_at TIMESTAMP NOT NULL DEFAULT {_NOW},
+            PRIMARY KEY (match_id, game_no)
+        );
+    """),
+    (4, "match_history / players indexes", """
+        CREATE INDEX IF NOT EXISTS match_history_player_match_idx
+            ON match_history (player_id, match_id);
+        CREATE INDEX IF NOT EXISTS match_history_player_timestamp_idx
+            ON match_history (player_id, timestamp DESC);
+        CREATE INDEX IF NOT EXISTS match_history_match_idx
+            ON match_history (match_id);
+        CREATE INDEX IF NOT EXISTS players_conservative_idx
+            ON players ((mu - 3 * sigma) DESC, id);
+        ANALYZE;
+    """),
+    (5, "bot_state", f"""
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT {_NOW}
+        );
+    """),
+    (6, "outcome_mask / pair_stats", _compact_results),
+    (7, "players.version", """
+        ALTER TABLE players ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+    """),
+    (8, "rating_snapshots / seasons", f"""
+        CREATE TABLE IF NOT EXISTS rating_snapshots (
+            snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            last_match_id INTEGER NOT NULL UNIQUE,
+            last_timestamp TIMESTAMP,
+            created_at TIMESTAMP NOT NULL DEFAULT {_NOW}
+        );
+        CREATE TABLE IF NOT EXISTS rating_snapshot_players (
+            snapshot_id INTEGER NOT NULL REFERENCES rating_snapshots (snapshot_id) ON DELETE CASCADE,
+            player_id INTEGER NOT NULL,
+            mu REAL NOT NULL,
+            sigma REAL NOT NULL,
+            games INTEGER NOT NULL,
+            wins INTEGER NOT NULL,
+            last_match TIMESTAMP,
+            PRIMARY KEY (snapshot_id, player_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS seasons (
+            name TEXT PRIMARY KEY,
+            started_at TIMESTAMP NOT NULL DEFAULT {_NOW}
+        );
+        CREATE INDEX IF NOT EXISTS matches_started_idx ON matches (started_at);
+    """),
+    (9, "guild_id partition key", _partition_by_guild),
+]
+
+
+def _load_snapshot(cur, guild_id: int, max_match_id: int = None, before=None) -> tuple:
+    """
+    storage.postgres._load_snapshot と同じ（match_history.timestamp は 'T' 区切りの文字列もあるので
+    julianday で比べる）
+    """
+    cur.execute(
+        """
+        SELECT snapshot_id, last_match_id FROM rating_snapshots
+        WHERE guild_id = :guild_id
+          AND (:max_match_id IS NULL OR last_match_id <= :max_match_id)
+          AND (:before IS NULL OR julianday(last_timestamp) < julianday(:before))
+        ORDER BY last_match_id DESC
+        LIMIT 1
+        """,
+        {"guild_id": guild_id, "max_match_id": max_match_id, "before": before}
+    )
+    row = cur.fetchone()
+    if row is None:
+        return {}, 0
+    cur.execute(
+        """
+        SELECT player_id, mu, sigma, games, wins, last_match
+        FROM rating_snapshot_players
+        WHERE snapshot_id = ?
+        """,
+        (row[0],)
+    )
+    return {r[0]: tuple(r)[1:] for r in cur.fetchall()}, row[1]
+
+
+def _chunks(values: list, size: int = _MAX_PARAMS):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _marks(values) -> str:
+    return ", ".join("?" * len(values))
+
+
+class SQLiteStorage(Storage):
+    """
+    SQLite（WAL モード）のバックエンド。path にファイルのパスを指定する
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # 自動の BEGIN は使わず、書き込みは _transaction で明示的に囲む
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None,
+            detect_types=sqlite3.PARSE_DECLTYPES
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # WAL ではコミットごとの fsync を省いても DB が壊れることはない
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+
+    @contextmanager
+    def _transaction(self):
+        """
+        ブロックを1トランザクションで実行する。正常に抜けたら commit、例外なら rollback
+        """
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                yield cur
+                cur.execute("COMMIT")
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+            finally:
+                cur.close()
+
+    def _query(self, sql: str, params=()) -> list:
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def _select_players(self, cur, guild_id: int, player_ids: list) -> list:
+        rows = []
+        for chunk in _chunks(list(player_ids)):
+            cur.execute(
+                f"SELECT {_PLAYER_COLUMNS} FROM players WHERE guild_id = ? AND id IN ({_marks(chunk)})",
+                [guild_id] + chunk
+            )
+            rows += [dict(row) for row in cur.fetchall()]
+        return rows
+
+    def migrate(self) -> list:
+        applied = []
+        with self._lock:
+            current = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            for version, description, step in MIGRATIONS:
+                if version <= current:
+                    continue
+                if callable(step):
+                    with self._transaction() as cur:
+                        step(cur)
+                        cur.execute(f"PRAGMA user_version = {version}")
+                else:
+                    # executescript は実行前に commit するので、BEGIN から自前で書く
+                    try:
+                        self._conn.executescript(f"BEGIN; {step} PRAGMA user_version = {version}; COMMIT;")
+                    except BaseException:
+                        # 途中の文で失敗すると BEGIN したままになるので、共有の接続を戻しておく
+                        if self._conn.in_transaction:
+                            self._conn.execute("ROLLBACK")
+                        raise
+                applied.append(version)
+                print(f"schema: v{version} {description} を適用しました")
+        return applied
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get_state(self, key: str) -> str:
+        rows = self._query("SELECT value FROM bot_state WHERE key = ?", (key,))
+        return rows[0]['value'] if rows else None
+
+    def set_state(self, key: str, value: str):
+        with self._transaction() as cur:
+            cur.execute(
+                f"""
+                INSERT INTO bot_state (key, value) VALUES (?, ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value, updated_at = {_NOW}
+                """,
+                (key, value)
+            )
+
+    def get_players(self, guild_id: int, player_ids: list) -> dict:
+        with self._lock:
+            rows = self._select_players(self._conn.cursor(), guild_id, player_ids)
+        return {row['id']: row for row in rows}
+
+    def get_all_players(self, guild_id: int) -> list:
+        return self._query(f"SELECT {_PLAYER_COLUMNS} FROM players WHERE guild_id = ?", (guild_id,))
+
+    def upsert_player(self, guild_id: int, player_id: int, mu: float, sigma: float, games: int, wins: int,
+                      last_match) -> dict:
+        with self._transaction() as cur:
+            cur.execute(
+                """
+                INSERT INTO players (guild_id, id, mu, sigma, games, wins, last_match)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (guild_id, id) DO UPDATE SET
+                    mu = excluded.mu,
+                    sigma = excluded.sigma,
+                    games = excluded.games,
+                    wins = excluded.wins,
+                    last_match = excluded.last_match,
+                    version = version + 1
+                """,
+                (guild_id, player_id, mu, sigma, games, wins, last_match)
+            )
+            return self._select_players(cur, guild_id, [player_id])[0]
+
+    def _insert_history(self, cur, guild_id: int, rows: list):
+        cur.executemany(
+            """
+            INSERT INTO match_history (
+                guild_id, player_id, match_id, timestamp, rank, wins,
+                mu_before, sigma_before, mu_after, sigma_after
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [(guild_id,) + tuple(row) for row in rows]
+        )
+
+    def insert_match_history(self, guild_id: int, player_id: int, match_id: int, timestamp, rank: int, wins: int,
+                             mu_before: float, sigma_before: float, mu_after: float, sigma_after: float):
+        with self._transaction() as cur:
+            self._insert_history(
+                cur, guild_id, [(player_id, match_id, timestamp, rank, wins, mu_before, sigma_before, mu_after, sigma_after)]
+            )
+
+    def save_match_results(self, guild_id: int, match_id: int, players: list, history: list, outcome_mask: int,
+                           pairs: list) -> list:
+        with self._transaction() as cur:
+            # 読み込んだときから version が変わっていない行だけを更新する
+            stale = set()
+            for p in players:
+                cur.execute(
+                    """
+                    UPDATE players SET
+                        mu = ?, sigma = ?, games = ?, wins = ?, last_match = ?, version = version + 1
+                    WHERE guild_id = ? AND id = ? AND version = ?
+                    """,
+                    (p['mu'], p['sigma'], p['games'], p['wins'], p['last_match'],
+                     guild_id, p['player_id'], p['version'])
+                )
+                if cur.rowcount != 1:
+                    stale.add(int(p['player_id']))
+            if stale:
+                # 例外で抜けるので、このトランザクションは rollback される
+                raise ConflictError(stale)
+            self._insert_history(cur, guild_id, [
+                (h['player_id'], h['match_id'], h['timestamp'], h['rank'], h['wins'],
+                 h['mu_before'], h['sigma_before'], h['mu_after'], h['sigma_after'])
+                for h in history
+            ])
+            cur.execute(
+                f"UPDATE matches SET status = 'finished', ended_at = {_NOW}, outcome_mask = ? WHERE match_id = ?",
+                (outcome_mask, match_id)
+            )
+            cur.execute("DELETE FROM match_games WHERE match_id = ?", (match_id,))
+            _add_pair_stats(cur, guild_id, pairs)
+            return self._select_players(cur, guild_id, [p['player_id'] for p in players])
+
+    def get_player_history(self, guild_id: int, player_id: int) -> list:
+        return self._query(
+            """
+            SELECT id, player_id, match_id, timestamp, rank, wins,
+                   mu_before, sigma_before, mu_after, sigma_after
+            FROM match_history
+            WHERE guild_id = ? AND player_id = ?
+            ORDER BY timestamp DESC
+            """,
+            (guild_id, player_id)
+        )
+
+    def get_player_summary(self, guild_id: int, player_id: int) -> dict:
+        summary = self._query(
+            """
+            SELECT
+                COUNT(*) AS match_count,
+                COALESCE(SUM(h.rank = 0), 0) AS wins,
+                AVG(h.rank + 1) AS avg_rank,
+                MAX(h.match_id) AS latest_match_id,
+                (
+                    SELECT l.mu_after - 3 * l.sigma_after
+                    FROM match_history l
+                    WHERE l.guild_id = :guild_id AND l.player_id = :player_id
+                    ORDER BY l.match_id DESC
+                    LIMIT 1
+                ) AS latest_rating
+            FROM match_history h
+            WHERE h.guild_id = :guild_id AND h.player_id = :player_id
+            """,
+            {"guild_id": guild_id, "player_id": player_id}
+        )[0]
+        if not summary['match_count']:
+            return None
+        return summary
+
+    def get_rating_series(self, guild_id: int, player_id: int, max_points: int) -> list:
+        rows = self._query(
+            """
+            SELECT n, rating
+            FROM (
+                SELECT
+                    ROW_NUMBER() OVER (ORDER BY match_id) AS n,
+                    COUNT(*) OVER () AS total,
+                    mu_after - 3 * sigma_after AS rating
+                FROM match_history
+                WHERE guild_id = :guild_id AND player_id = :player_id
+            ) h
+            WHERE total <= :max_points
+               OR (n - 1) % ((total + :max_points - 1) / :max_points) = 0
+               OR n = total
+            ORDER BY n
+            """,
+            {"guild_id": guild_id, "player_id": player_id, "max_points": max_points}
+        )
+        return [(row['n'], row['rating']) for row in rows]
+
+    def start_match(self, guild_id: int, channel_id: int, host_id: int, entry_order: list,
+                    pattern_set: int, patterns: list) -> int:
+        with self._transaction() as cur:
+            cur.execute(
+                f"""
+                UPDATE matches SET status = 'aborted', ended_at = {_NOW}
+                WHERE channel_id = ? AND status = 'running'
+                """,
+                (channel_id,)
+            )
+            cur.execute(
+                """
+                INSERT INTO matches (guild_id, channel_id, host_id, entry_order, pattern_set, patterns)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (guild_id, channel_id, host_id, json.dumps([int(uid) for uid in entry_order]), pattern_set,
+                 json.dumps(patterns) if patterns is not None else None)
+            )
+            return cur.lastrowid
+
+    def record_game(self, match_id: int, game_no: int, team1_won: bool):
+        with self._transaction() as cur:
+            cur.execute(
+                f"""
+                INSERT INTO match_games (match_id, game_no, team1_won)
+                VALUES (?, ?, ?)
+                ON CONFLICT (match_id, game_no) DO UPDATE SET
+                    team1_won = excluded.team1_won,
+                    recorded_at = {_NOW}
+                """,
+                (match_id, game_no, int(team1_won))
+            )
+
+    def get_match_games(self, match_id: int) -> list:
+        rows = self._query(
+            "SELECT team1_won FROM match_games WHERE match_id = ? ORDER BY game_no",
+            (match_id,)
+        )
+        return [bool(row['team1_won']) for row in rows]
+
+    def get_running_matches(self, channel_id: int = None) -> list:
+        with self._lock:
+            matches = self._query(
+                """
+                SELECT match_id, guild_id, channel_id, host_id, entry_order, pattern_set, patterns
+                FROM matches
+                WHERE status = 'running'
+                  AND entry_order IS NOT NULL
+                  AND (:channel_id IS NULL OR channel_id = :channel_id)
+                ORDER BY match_id
+                """,
+                {"channel_id": channel_id}
+            )
+            games = {}
+            for row in self._query(
+                """
+                SELECT g.match_id, g.team1_won
+                FROM match_games g
+                JOIN matches m ON m.match_id = g.match_id
+                WHERE m.status = 'running'
+                ORDER BY g.match_id, g.game_no
+                """
+            ):
+                games.setdefault(row['match_id'], []).append(bool(row['team1_won']))
+        for match in matches:
+            match['entry_order'] = json.loads(match['entry_order'])
+            match['patterns'] = json.loads(match['patterns']) if match['patterns'] is not None else None
+            match['games'] = games.get(match['match_id'], [])
+        return matches
+
+    def abort_match(self, match_id: int):
+        with self._transaction() as cur:
+            cur.execute(
+                f"""
+                UPDATE matches SET status = 'aborted', ended_at = {_NOW}
+                WHERE match_id = ? AND status = 'running'
+                """,
+                (match_id,)
+            )
+
+    def get_pair_stats(self, guild_id: int, player_a: int, player_b: int) -> dict:
+        rows = self._query(
+            """
+            SELECT together_games, together_wins, versus_games, a_wins
+            FROM pair_stats
+            WHERE guild_id = ? AND player_a = ? AND player_b = ?
+            """,
+            (guild_id, player_a, player_b)
+        )
+        return rows[0] if rows else None
+
+    def get_partner_stats(self, guild_id: int, player_id: int) -> list:
+        return self._query(
+            """
+            SELECT player_b AS other, together_games, together_wins,
+                   versus_games, a_wins AS wins_against
+            FROM pair_stats WHERE guild_id = :guild_id AND player_a = :player_id
+            UNION ALL
+            SELECT player_a, together_games, together_wins,
+                   versus_games, versus_games - a_wins
+            FROM pair_stats WHERE guild_id = :guild_id AND player_b = :player_id
+            """,
+            {"guild_id": guild_id, "player_id": player_id}
+        )
+
+    def undo_matches(self, guild_id: int, count: int, match_id: int, replay) -> tuple:
+        # BEGIN IMMEDIATE で書き込みロックを取るので、PostgreSQL の FOR UPDATE は不要
+        with self._transaction() as cur:
+            if match_id is not None:
+                cur.execute("""
+                    SELECT match_id, entry_order, pattern_set, patterns, outcome_mask FROM matches
+                    WHERE match_id = ? AND status = 'finished' AND guild_id = ?
+                """, (match_id, guild_id))
+            else:
+                cur.execute("""
+                    SELECT match_id, entry_order, pattern_set, patterns, outcome_mask FROM matches
+                    WHERE guild_id = ? AND status = 'finished'
+                    ORDER BY match_id DESC
+                    LIMIT ?
+                """, (guild_id, count))
+            found = cur.fetchall()
+            targets = sorted(row[0] for row in found)
+            if not targets:
+                return [], [], 0, []
+
+            cur.execute("""
+                SELECT match_id, id, player_id, rank, wins, mu_before, sigma_before
+                FROM match_history
+                WHERE guild_id = ? AND match_id >= ?
+                ORDER BY match_id, id
+            """, (guild_id, targets[0]))
+            player_updates, undone, history_updates, replayed = plan_undo(
+                targets, [tuple(row) for row in cur.fetchall()], replay
+            )
+
+            cur.executemany("""
+                UPDATE match_history SET
+                    mu_before = ?, sigma_before = ?, mu_after = ?, sigma_after = ?
+                WHERE id = ?
+            """, [update[1:] + update[:1] for update in history_updates])
+            for chunk in _chunks(targets):
+                cur.execute(
+                    f"DELETE FROM match_history WHERE guild_id = ? AND match_id IN ({_marks(chunk)})",
+                    [guild_id] + chunk
+                )
+                cur.execute(f"UPDATE matches SET status = 'undone' WHERE match_id IN ({_marks(chunk)})", chunk)
+            cur.execute(
+                "DELETE FROM rating_snapshots WHERE guild_id = ? AND last_match_id >= ?", (guild_id, targets[0])
+            )
+            _add_pair_stats(cur, guild_id, match_pair_deltas([_decode_match(tuple(row)[1:]) for row in found], sign=-1))
+            cur.executemany("""
+                UPDATE players SET
+                    mu = ?,
+                    sigma = ?,
+                    games = games - ?,
+                    wins = wins - ?,
+                    version = version + 1,
+                    last_match = (
+                        SELECT h.timestamp
+                        FROM match_history h
+                        WHERE h.guild_id = players.guild_id AND h.player_id = players.id
+                        ORDER BY h.match_id DESC
+                        LIMIT 1
+                    )
+                WHERE guild_id = ? AND id = ?
+            """, [update[1:] + (guild_id, update[0]) for update in player_updates])
+            restored = self._select_players(cur, guild_id, [update[0] for update in player_updates])
+        return targets, undone, replayed, restored
+
+    def take_snapshot(self, guild_id: int) -> dict:
+        with self._transaction() as cur:
+            cur.execute("""
+                SELECT
+                    (SELECT MAX(match_id) FROM matches WHERE guild_id = :guild_id AND status = 'finished'),
+                    (SELECT MIN(match_id) FROM matches WHERE guild_id = :guild_id AND status = 'running')
+            """, {"guild_id": guild_id})
+            finished, running = cur.fetchone()
+            boundary = finished if running is None or finished is None else min(finished, running - 1)
+            if boundary is None:
+                return None
+            state, base_match_id = _load_snapshot(cur, guild_id, max_match_id=boundary)
+            if base_match_id == boundary:
+                return None
+            cur.execute("""
+                SELECT player_id, timestamp, wins, mu_after, sigma_after
+                FROM match_history
+                WHERE guild_id = ? AND match_id > ? AND match_id <= ?
+                ORDER BY id
+            """, (guild_id, base_match_id, boundary))
+            fold_history(state, [tuple(row) for row in cur.fetchall()])
+
+            last_timestamp = max((s[4] for s in state.values() if s[4] is not None), default=None)
+            cur.execute(
+                "INSERT INTO rating_snapshots (guild_id, last_match_id, last_timestamp) VALUES (?, ?, ?)",
+                (guild_id, boundary, last_timestamp)
+            )
+            snapshot_id = cur.lastrowid
+            cur.executemany("""
+                INSERT INTO rating_snapshot_players (snapshot_id, player_id, mu, sigma, games, wins, last_match)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [(snapshot_id, pid) + s for pid, s in state.items()])
+        return {"snapshot_id": snapshot_id, "last_match_id": boundary, "players": len(state)}
+
+    def load_ratings(self, guild_id: int, at=None) -> dict:
+        with self._lock:
+            cur = self._conn.cursor()
+            state, base_match_id = _load_snapshot(cur, guild_id, before=at)
+            cur.execute("""
+                SELECT player_id, timestamp, wins, mu_after, sigma_after
+                FROM match_history
+                WHERE guild_id = :guild_id
+                  AND match_id > :base
+                  AND (:at IS NULL OR (
+                      match_id <= (
+                          SELECT MAX(match_id) FROM matches WHERE guild_id = :guild_id AND started_at < :at
+                      )
+                      AND julianday(timestamp) < julianday(:at)
+                  ))
+                ORDER BY id
+            """, {"guild_id": guild_id, "base": base_match_id, "at": at})
+            return fold_history(state, [tuple(row) for row in cur.fetchall()])
+
+    def add_season(self, guild_id: int, name: str) -> dict:
+        with self._transaction() as cur:
+            cur.execute(
+                "INSERT INTO seasons (guild_id, name) VALUES (?, ?) ON CONFLICT (guild_id, name) DO NOTHING",
+                (guild_id, name)
+            )
+            if cur.rowcount != 1:
+                return None
+            cur.execute("SELECT name, started_at FROM seasons WHERE guild_id = ? AND name = ?", (guild_id, name))
+            return dict(cur.fetchone())
+
+    def get_seasons(self, guild_id: int) -> list:
+        return self._query(
+            "SELECT name, started_at FROM seasons WHERE guild_id = ? ORDER BY started_at", (guild_id,)
+        )
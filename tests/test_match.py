@@ -0,0 +1,161 @@
+"""
+MatchCog._run_match を DB なしで動かすテスト（DB と Discord の呼び出しは差し替える）
+"""
+import asyncio
+import match
+
+
+class FakeMessage:
+    async def edit(self, **kwargs):
+        pass
+
+
+class FakeChannel:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(kwargs.get("embed"))
+        return FakeMessage()
+
+
+class FakeGuild:
+    id = 10
+
+
+class FakeSession:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.aborted = False
+
+
+class AlwaysAWins:
+    """押された扱いで即座に Aチーム勝利を返す MatchView"""
+
+    def __init__(self, *args):
+        self.result = True
+        self.interaction = None
+
+    async def wait(self):
+        return False
+
+
+def _patch_db(monkeypatch, entry_order):
+    games = []
+
+    async def start_match(*args):
+        return 1
+
+    async def record_game(match_id, game_no, team1_won):
+        # 保存に時間がかかっても、中止より前に書き込まれることを確かめられるようにする
+        await asyncio.sleep(0.01)
+        games.append(team1_won)
+
+    async def get_match_games(match_id):
+        return list(games)
+
+    async def get_players(guild_id, ids):
+        return {
+            int(uid): {"mu": 1500.0, "sigma": 50.0, "games": 0, "wins": 0, "version": 0}
+            for uid in ids
+        }
+
+    async def save_match_results(*args):
+        return []
+
+    async def resolve(guild, ids):
+        return {uid: f"P{uid}" for uid in ids}
+
+    async def edit(message, interaction=None, **kwargs):
+        pass
+
+    monkeypatch.setattr(match, "start_match", start_match)
+    monkeypatch.setattr(match, "record_game", record_game)
+    monkeypatch.setattr(match, "get_match_games", get_match_games)
+    monkeypatch.setattr(match, "get_players", get_players)
+    monkeypatch.setattr(match, "save_match_results", save_match_results)
+    monkeypatch.setattr(match.resolver, "resolve", resolve)
+    monkeypatch.setattr(match.edit_scheduler, "edit", edit)
+    monkeypatch.setattr(match, "MatchView", AlwaysAWins)
+    return games
+
+
+def test_snapshot_failure_does_not_report_match_error(monkeypatch):
+    entry_order = [str(uid) for uid in range(101, 109)]
+    _patch_db(monkeypatch, entry_order)
+
+    async def maybe_take_snapshot(guild_id):
+        raise RuntimeError("snapshot failed")
+
+    monkeypatch.setattr(match, "maybe_take_snapshot", maybe_take_snapshot)
+
+    async def run():
+        channel = FakeChannel()
+        session = FakeSession()
+        await session.lock.acquire()
+        await match.MatchCog(None)._run_match(channel, FakeGuild(), 20, session, entry_order)
+        return channel, session
+
+    channel, session = asyncio.run(run())
+    assert not session.lock.locked()
+    assert not any(embed is not None and "❌" in (embed.description or "") for embed in channel.sent)
+
+
+def test_abort_waits_for_pending_game_save(monkeypatch):
+    entry_order = [str(uid) for uid in range(101, 109)]
+    games = _patch_db(monkeypatch, entry_order)
+    views = iter([True, "abort"])
+
+    class ScriptedView(AlwaysAWins):
+        def __init__(self, *args):
+            super().__init__()
+            self.result = next(views)
+
+    aborted_with = []
+
+    async def abort_match(match_id):
+        aborted_with.append(list(games))
+
+    monkeypatch.setattr(match, "MatchView", ScriptedView)
+    monkeypatch.setattr(match, "abort_match", abort_match)
+
+    async def run():
+        session = FakeSession()
+        await session.lock.acquire()
+        await match.MatchCog(None)._run_match(FakeChannel(), FakeGuild(), 20, session, entry_order)
+
+    asyncio.run(run())
+    assert aborted_with == [[True]]
+
+
+def _run_and_collect(entry_order):
+    async def run():
+        channel = FakeChannel()
+        session = FakeSession()
+        await session.lock.acquire()
+        await match.MatchCog(None)._run_match(channel, FakeGuild(), 20, session, entry_order)
+        return [embed.description for embed in channel.sent if embed is not None and embed.description]
+
+    return asyncio.run(run())
+
+
+def test_error_before_start_does_not_offer_resume(monkeypatch):
+    entry_order = [str(uid) for uid in range(101, 109)]
+    _patch_db(monkeypatch, entry_order)
+
+    async def start_match(*args):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(match, "start_match", start_match)
+    assert _run_and_collect(entry_order) == ["❌ エラーが発生しました。"]
+
+
+def test_error_while_saving_offers_resume(monkeypatch):
+    entry_order = [str(uid) for uid in range(101, 109)]
+    _patch_db(monkeypatch, entry_order)
+
+    async def save_match_results(*args):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(match, "save_match_results", save_match_results)
+    assert _run_and_collect(entry_order) == ["❌ エラーが発生しました。`/resume` で続きから再開できます。"]
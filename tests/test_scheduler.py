@@ -0,0 +1,41 @@
+"""
+EditScheduler のテスト（Discord への送信は差し替える）
+"""
+import asyncio
+from types import SimpleNamespace
+import discord
+import pytest
+from scheduler import EditScheduler
+
+
+class ExpiredInteractionMessage(discord.InteractionMessage):
+    """webhook のトークンが切れていて、インタラクション経由では編集できないメッセージ"""
+
+    def __init__(self):
+        self.id = 1
+        self.channel = SimpleNamespace(id=20)
+        self.edited = []
+
+    async def edit(self, **kwargs):
+        raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Webhook")
+
+
+def test_expired_interaction_message_falls_back_to_channel_edit(monkeypatch):
+    async def channel_edit(message, **kwargs):
+        message.edited.append(kwargs)
+
+    monkeypatch.setattr(discord.Message, "edit", channel_edit)
+    message = ExpiredInteractionMessage()
+    scheduler = EditScheduler()
+    asyncio.run(scheduler.edit(message, content="final"))
+    assert message.edited == [{"content": "final"}]
+    assert scheduler.sent == 1
+
+
+def test_other_edit_errors_are_raised(monkeypatch):
+    async def channel_edit(message, **kwargs):
+        raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Message")
+
+    monkeypatch.setattr(discord.Message, "edit", channel_edit)
+    with pytest.raises(discord.NotFound):
+        asyncio.run(EditScheduler().edit(ExpiredInteractionMessage(), content="final"))
@@ -0,0 +1,20 @@
+"""
+SessionManager のテスト
+"""
+from types import SimpleNamespace
+import pytest
+from sessions import SessionManager
+
+
+def test_for_context_rejects_direct_messages():
+    manager = SessionManager()
+    with pytest.raises(ValueError):
+        manager.for_context(SimpleNamespace(guild=None, channel=SimpleNamespace(id=20)))
+    assert len(manager) == 0
+
+
+def test_for_context_is_per_channel():
+    manager = SessionManager()
+    ctx = SimpleNamespace(guild=SimpleNamespace(id=10), channel=SimpleNamespace(id=20))
+    assert manager.for_context(ctx) is manager.get(10, 20)
+    assert manager.get(10, 21) is not manager.get(10, 20)
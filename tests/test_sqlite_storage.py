@@ -0,0 +1,20 @@
+"""
+SQLiteStorage のテスト（インメモリ DB）
+"""
+import sqlite3
+import pytest
+import storage.sqlite as sqlite_storage
+from storage.sqlite import SQLiteStorage
+
+
+def test_failed_migration_rolls_back(monkeypatch):
+    storage = SQLiteStorage(":memory:")
+    version, description, step = sqlite_storage.MIGRATIONS[0]
+    monkeypatch.setattr(sqlite_storage, "MIGRATIONS", [(version, description, step + " CREATE TABLE broken (;")])
+    with pytest.raises(sqlite3.OperationalError):
+        storage.migrate()
+    assert not storage._conn.in_transaction
+    assert storage._conn.execute("PRAGMA user_version").fetchone()[0] == 0
+
+    monkeypatch.undo()
+    assert storage.migrate() == [version for version, _, _ in sqlite_storage.MIGRATIONS]
@@ -1,70 +1,110 @@
-import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from dotenv import load_dotenv
+import threading
+from config import PLAYER_CACHE_SIZE, PLAYER_CACHE_TTL, HISTORY_CHART_POINTS, SNAPSHOT_INTERVAL
+from storage import get_storage, ConflictError
+from cache import LRUCache
+from ranking import RankingIndex, conservative_rating
+from outcomes import pattern_set_id, resolve_patterns
 
-# .env から環境変数を読み込む
-load_dotenv()
+# players の行を (guild_id, id) -> 辞書 で保持する write-through キャッシュ
+player_cache = LRUCache(PLAYER_CACHE_SIZE, PLAYER_CACHE_TTL)
 
-# DB接続設定
-DB_CONFIG = {
-    'host': os.getenv('DB_HOST', 'localhost'),
-    'port': int(os.getenv('DB_PORT', 5432)),
-    'user': os.getenv('DB_USER', 'postgres'),
-}
+_matches_since_snapshot = {}  # guild_id -> 前回のスナップショットからの試合数
+_snapshot_lock = threading.Lock()
 
-def get_connection():
+# /ranking 用の保守的レート順索引（サーバーごと。初回利用時に読み込み、以降は更新分だけ反映）
+ranking_indexes = {}  # guild_id -> RankingIndex
+_ranking_load_lock = threading.Lock()
+
+
+def migrate() -> list:
+    """
+    使用中のバックエンドに未適用のスキーマ変更を適用する（起動時に呼ぶ）
+    """
+    return get_storage().migrate()
+
+
+def get_state(key: str) -> str:
+    """
+    bot_state から値を取得する。なければ None
     """
-    新しいデータベース接続を返す
+    return get_storage().get_state(key)
+
+
+def set_state(key: str, value: str):
     """
-    return psycopg2.connect(**DB_CONFIG)
+    bot_state に値を保存する（既にあれば上書き）
+    """
+    get_storage().set_state(key, value)
 
 
-def get_player(player_id: int) -> dict:
+def get_player(guild_id: int, player_id: int) -> dict:
     """
-    指定した player_id の情報を players テーブルから取得して辞書で返す。
+    サーバー内の指定した player_id の情報を players テーブルから取得して辞書で返す。
     レコードがなければ None。
+    キャッシュにあれば DB には問い合わせない。
     """
-    conn = get_connection()
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(
-            """
-            SELECT id, mu, sigma, games, wins, last_match
-            FROM players
-            WHERE id = %s
-            """,
-            (player_id,)
-        )
-        player = cur.fetchone()
-    conn.close()
-    return player
+    key = (int(guild_id), int(player_id))
+    cached = player_cache.get(key)
+    if cached is not None:
+        return dict(cached)
+
+    generation = player_cache.generation
+    player = get_storage().get_players(int(guild_id), [int(player_id)]).get(int(player_id))
+    if player is None:
+        return None
+    player_cache.fill(key, dict(player), generation)
+    return dict(player)
 
 
-def upsert_player(player_id: int, mu: float, sigma: float, games: int, wins: int, last_match: str):
+def get_players(guild_id: int, player_ids: list) -> dict:
     """
-    players テーブルにレコードを挿入、
+    サーバー内の複数の player_id をまとめて取得し、{id: 辞書} で返す。
+    キャッシュにないものだけを1クエリで取得する。未登録の id は含まれない。
+    """
+    guild_id = int(guild_id)
+    players = {}
+    missing = []
+    for pid in player_ids:
+        cached = player_cache.get((guild_id, int(pid)))
+        if cached is not None:
+            players[int(pid)] = dict(cached)
+        else:
+            missing.append(int(pid))
+    if not missing:
+        return players
+
+    generation = player_cache.generation
+    for row in get_storage().get_players(guild_id, missing).values():
+        player_cache.fill((guild_id, row['id']), dict(row), generation)
+        players[row['id']] = dict(row)
+    return players
+
+
+def refresh_players(rows: list):
+    """
+    更新後の players の行をキャッシュとサーバーごとのランキング索引に反映する（コミット後に呼ぶ）
+    """
+    by_guild = {}
+    for row in rows:
+        player_cache.set((row['guild_id'], row['id']), dict(row))
+        by_guild.setdefault(row['guild_id'], []).append(row)
+    for guild_id, guild_rows in by_guild.items():
+        index = ranking_indexes.get(guild_id)
+        if index is not None and index.loaded:
+            index.update(guild_rows)
+
+
+def upsert_player(guild_id: int, player_id: int, mu: float, sigma: float, games: int, wins: int, last_match: str):
+    """
+    サーバーの players テーブルにレコードを挿入、
     既存なら mu, sigma, games, wins, last_match を更新する
     """
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO players (id, mu, sigma, games, wins, last_match)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (id) DO UPDATE SET
-                mu = EXCLUDED.mu,
-                sigma = EXCLUDED.sigma,
-                games = EXCLUDED.games,
-                wins = EXCLUDED.wins,
-                last_match = EXCLUDED.last_match
-            """,
-            (player_id, mu, sigma, games, wins, last_match)
-        )
-    conn.commit()
-    conn.close()
+    row = get_storage().upsert_player(int(guild_id), player_id, mu, sigma, games, wins, last_match)
+    refresh_players([row])
 
 
 def insert_match_history(
+    guild_id: int,
     player_id: int,
     match_id: int,
     timestamp: str,
@@ -76,77 +116,266 @@ def insert_match_history(
     sigma_after: float
 ):
     """
-    match_history テーブルに履歴レコードを追加する
+    サーバーの match_history テーブルに履歴レコードを追加する
     """
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO match_history (
-                player_id, match_id, timestamp, rank, wins,
-                mu_before, sigma_before, mu_after, sigma_after
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """,
-            (player_id, match_id, timestamp, rank, wins, mu_before, sigma_before, mu_after, sigma_after)
-        )
-    conn.commit()
-    conn.close()
+    get_storage().insert_match_history(
+        int(guild_id), player_id, match_id, timestamp, rank, wins, mu_before, sigma_before, mu_after, sigma_after
+    )
 
 
-def get_all_players() -> list:
+def save_match_results(guild_id: int, match_id: int, players: list, history: list, outcome_mask: int = None,
+                       pairs: list = ()):
     """
-    players テーブルの全プレイヤー情報を辞書リストで返す
+    サーバーの1試合分の結果を1トランザクションでまとめて書き込む。
+    players は upsert_player、history は insert_match_history と同じキーを持つ辞書のリスト。
+    matches の該当試合を終了済みにしてゲーム結果を outcome_mask で残し、
+    pairs（outcomes.pair_deltas の戻り値）を pair_stats に足し込む。
+    players の version は読み込んだときの値を渡す。その後に他の試合が同じプレイヤーを更新していたら
+    何も書き込まずに ConflictError を投げるので、呼び出し元は読み直して計算し直すこと。
+    途中で失敗した場合はどれも反映されない。
     """
-    conn = get_connection()
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT id, mu, sigma, games, wins, last_match FROM players")
-        players = cur.fetchall()
-    conn.close()
-    return players
+    try:
+        updated = get_storage().save_match_results(int(guild_id), match_id, players, history, outcome_mask, list(pairs))
+    except ConflictError as e:
+        # 次の get_players で DB から最新の行を読み直させる
+        for pid in e.player_ids:
+            player_cache.invalidate((int(guild_id), pid))
+        raise
+    refresh_players(updated)
+
+
+def start_match(guild_id: int, channel_id: int, host_id: int, entry_order: list, patterns: list) -> int:
+    """
+    matches に実行中の試合を登録し、採番した match_id を返す。
+    再開できるよう、並び順と試合パターンも保存する。
+    定義済みのパターンはパターンセットIDだけを保存する。
+    同じチャンネルで中断されたままの試合は中止扱いにする。
+    """
+    set_id = pattern_set_id(patterns)
+    return get_storage().start_match(
+        guild_id, channel_id, host_id, entry_order, set_id, patterns if set_id is None else None
+    )
+
+
+def record_game(match_id: int, game_no: int, team1_won: bool):
+    """
+    進行中の試合の1ゲーム分の結果を保存する（game_no は0始まり）
+    """
+    get_storage().record_game(match_id, game_no, team1_won)
+
+
+def get_match_games(match_id: int) -> list:
+    """
+    保存済みのゲーム結果を game_no 順に返す（Aチーム勝利なら True）
+    """
+    return get_storage().get_match_games(match_id)
+
+
+def get_running_matches(channel_id: int = None) -> list:
+    """
+    中断されたままの試合を返す（channel_id を指定するとそのチャンネルのみ）。
+    各行は match_id, guild_id, channel_id, host_id, entry_order, patterns と
+    保存済みのゲーム結果 games（game_no 順）を持つ。
+    """
+    matches = get_storage().get_running_matches(channel_id)
+    for m in matches:
+        m['patterns'] = resolve_patterns(m['pattern_set'], m['patterns'])
+    return matches
+
+
+def abort_match(match_id: int):
+    """
+    記録されずに終わった試合を中止扱いにする
+    """
+    get_storage().abort_match(match_id)
+
+
+def get_all_players(guild_id: int) -> list:
+    """
+    サーバーの全プレイヤー情報を辞書リストで返す
+    """
+    return get_storage().get_all_players(int(guild_id))
+
+
+def get_player_history(guild_id: int, player_id: int) -> list:
+    """
+    サーバー内の指定した player_id の試合履歴を timestamp 降順で返す
+    """
+    return get_storage().get_player_history(int(guild_id), player_id)
+
+
+def get_player_summary(guild_id: int, player_id: int) -> dict:
+    """
+    サーバー内の指定した player_id の戦績を DB 側で集計して返す。
+    試合数・1位の回数・平均順位（1始まり）・最新の match_id・最新の保守的レート。
+    履歴がなければ None。
+    """
+    return get_storage().get_player_summary(int(guild_id), player_id)
 
 
-def get_player_history(player_id: int) -> list:
-    """
-    指定した player_id の試合履歴を timestamp 降順で返す
-    """
-    conn = get_connection()
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(
-            """
-            SELECT id, player_id, match_id, timestamp, rank, wins,
-                   mu_before, sigma_before, mu_after, sigma_after
-            FROM match_history
-            WHERE player_id = %s
-            ORDER BY timestamp DESC
-            """,
-            (player_id,)
-        )
-        history = cur.fetchall()
-    conn.close()
-    return history
-
-
-# ロビー用グローバル変数
-entry_list = []  # 現在のエントリー順（Discord IDのリスト）
-host_id = None   # 現在のホストのDiscord ID
-
-# 試合エントリー順（ホスト＋参加者の順）
-entry_order = []  # 試合実行時にセットされる（例: [host_id, ...]）
-
-# 手動定義の試合パターン（インデックスベース）
-match_patterns = [
-    {"team1": [0, 1, 2, 3], "team2": [4, 5, 6, 7]},
-    {"team1": [0, 2, 4, 6], "team2": [1, 3, 5, 7]},
-    {"team1": [0, 3, 4, 7], "team2": [1, 2, 5, 6]},
-    {"team1": [0, 1, 6, 7], "team2": [2, 3, 4, 5]},
-    {"team1": [0, 2, 5, 7], "team2": [1, 3, 4, 6]},
-    {"team1": [0, 1, 4, 5], "team2": [2, 3, 6, 7]},
-    {"team1": [0, 3, 5, 6], "team2": [1, 2, 4, 7]},
-    {"team1": [0, 1, 2, 4], "team2": [3, 5, 6, 7]},
-    {"team1": [0, 3, 4, 6], "team2": [1, 2, 5, 7]},
-    {"team1": [0, 1, 3, 7], "team2": [2, 4, 5, 6]},
-    {"team1": [0, 2, 3, 5], "team2": [1, 4, 6, 7]},
-    {"team1": [0, 2, 6, 7], "team2": [1, 3, 4, 5]},
-    {"team1": [0, 1, 5, 6], "team2": [2, 3, 4, 7]},
-    {"team1": [0, 4, 5, 7], "team2": [1, 2, 3, 6]},
-]
+def get_rating_series(guild_id: int, player_id: int, max_points: int = HISTORY_CHART_POINTS) -> list:
+    """
+    サーバー内の指定した player_id の保守的レート推移を古い順に返す。
+    max_points を超える場合は等間隔に間引き（最新の1点は必ず含める）、
+    [(何試合目か, 保守的レート), ...] の形で返す。
+    """
+    return get_storage().get_rating_series(int(guild_id), player_id, max_points)
+
+
+def get_pair_stats(guild_id: int, player_id: int, other_id: int) -> dict:
+    """
+    サーバー内の2人のペア統計を player_id から見た形で返す（pair_stats の1行を引くだけ）。
+    together_games / together_wins は同じチームでの試合数と勝利数、
+    versus_games / wins_against は敵同士での試合数と player_id の勝利数。記録がなければ None
+    """
+    a, b = sorted((int(player_id), int(other_id)))
+    row = get_storage().get_pair_stats(int(guild_id), a, b)
+    # 取り消しで 0 に戻った組は記録なしと同じ
+    if row is None or not (row['together_games'] or row['versus_games']):
+        return None
+    row = dict(row)
+    wins_a = row.pop('a_wins')
+    row['wins_against'] = wins_a if a == int(player_id) else row['versus_games'] - wins_a
+    return row
+
+
+def get_partner_stats(guild_id: int, player_id: int) -> list:
+    """
+    サーバー内で player_id と同じ試合に出た全員とのペア統計を返す。
+    各行は other, together_games, together_wins, versus_games, wins_against
+    """
+    return [
+        dict(row) for row in get_storage().get_partner_stats(int(guild_id), int(player_id))
+        if row['together_games'] or row['versus_games']
+    ]
+
+
+def _ranking_index(guild_id: int) -> RankingIndex:
+    """
+    サーバーのランキング索引を返す。未読み込みなら players から作る。
+    読み込み中に更新があった場合は読み直す。
+    """
+    guild_id = int(guild_id)
+    index = ranking_indexes.get(guild_id)
+    if index is not None and index.loaded:
+        return index
+    with _ranking_load_lock:
+        index = ranking_indexes.setdefault(guild_id, RankingIndex())
+        for _ in range(3):
+            if index.loaded:
+                return index
+            generation = player_cache.generation
+            index.load(get_all_players(guild_id))
+            if player_cache.generation == generation:
+                return index
+            index.invalidate()
+        index.load(get_all_players(guild_id))
+    return index
+
+
+def get_ranking_page(guild_id: int, page: int, per_page: int) -> tuple:
+    """
+    サーバー内の保守的レート順の page ページ目（1始まり）を返す。
+    戻り値は ([(順位, id, 保守的レート), ...], 全プレイヤー数)
+    """
+    index = _ranking_index(guild_id)
+    return index.page(page, per_page), len(index)
+
+
+def get_player_rank(guild_id: int, player_id: int) -> tuple:
+    """
+    サーバー内でのプレイヤーの (順位, 保守的レート, 全プレイヤー数) を返す。未登録なら None
+    """
+    index = _ranking_index(guild_id)
+    found = index.rank_of(int(player_id))
+    if found is None:
+        return None
+    return found[0], found[1], len(index)
+
+
+def take_snapshot(guild_id: int) -> dict:
+    """
+    サーバーの現在までの match_history を反映したレートのスナップショットを保存する。
+    snapshot_id, last_match_id, players を返す。前回から試合がなければ None
+    """
+    return get_storage().take_snapshot(int(guild_id))
+
+
+def maybe_take_snapshot(guild_id: int) -> dict:
+    """
+    試合結果の保存後に呼ぶ。サーバーごとに SNAPSHOT_INTERVAL 試合ごとにスナップショットを取り、取らなければ None
+    """
+    guild_id = int(guild_id)
+    with _snapshot_lock:
+        count = _matches_since_snapshot.get(guild_id, 0) + 1
+        if not SNAPSHOT_INTERVAL or count < SNAPSHOT_INTERVAL:
+            _matches_since_snapshot[guild_id] = count
+            return None
+        _matches_since_snapshot[guild_id] = 0
+    return take_snapshot(guild_id)
+
+
+def get_ratings_as_of(guild_id: int, at=None) -> dict:
+    """
+    サーバー内で at（datetime）より前の試合までを反映した各プレイヤーの状態を {id: 辞書} で返す（未指定なら現在）。
+    辞書は mu, sigma, games, wins, last_match を持つ。それまでに試合に出ていないプレイヤーは含まない。
+    直前のスナップショットとその後の履歴だけを読むので、全履歴の再生はしない。
+    """
+    return {
+        pid: dict(zip(("mu", "sigma", "games", "wins", "last_match"), state))
+        for pid, state in get_storage().load_ratings(int(guild_id), at).items()
+    }
+
+
+def _ranking_rows(players: dict, page: int, per_page: int) -> tuple:
+    """
+    {id: 辞書} を保守的レート順（同点は id 順）に並べ、get_ranking_page と同じ形で page ページ目を返す
+    """
+    ordered = sorted((-conservative_rating(p['mu'], p['sigma']), pid) for pid, p in players.items())
+    start = (page - 1) * per_page
+    rows = [(start + i + 1, pid, -neg) for i, (neg, pid) in enumerate(ordered[start:start + per_page])]
+    return rows, len(ordered)
+
+
+def get_ranking_as_of(guild_id: int, at, page: int, per_page: int) -> tuple:
+    """
+    サーバー内で at より前の試合までで集計した保守的レート順の page ページ目を返す（get_ranking_page と同じ形）
+    """
+    return _ranking_rows(get_ratings_as_of(guild_id, at), page, per_page)
+
+
+def start_season(guild_id: int, name: str) -> dict:
+    """
+    サーバーで現在時刻から新しいシーズンを始め、区切りの時点のスナップショットを取る。
+    name, started_at を返す。同じ名前のシーズンがあれば None
+    """
+    season = get_storage().add_season(int(guild_id), name)
+    if season is not None:
+        take_snapshot(guild_id)
+    return season
+
+
+def get_seasons(guild_id: int) -> list:
+    """
+    サーバーのシーズンの name, started_at を開始順に返す
+    """
+    return get_storage().get_seasons(int(guild_id))
+
+
+def get_season_ranking(guild_id: int, name: str, page: int, per_page: int) -> tuple:
+    """
+    シーズン終了時点（開催中なら現在）の保守的レート順を、シーズン中に試合に出たプレイヤーだけで返す。
+    戻り値は get_ranking_page と同じ形。サーバーにそのシーズンがなければ None
+    """
+    seasons = get_seasons(guild_id)
+    names = [s['name'] for s in seasons]
+    if name not in names:
+        return None
+    i = names.index(name)
+    before = get_ratings_as_of(guild_id, seasons[i]['started_at'])
+    after = get_ratings_as_of(guild_id, seasons[i + 1]['started_at'] if i + 1 < len(seasons) else None)
+    played = {
+        pid: p for pid, p in after.items()
+        if p['games'] > before.get(pid, {}).get('games', 0)
+    }
+    return _ranking_rows(played, page, per_page)